@@ -0,0 +1,132 @@
+"""
+Load tests the upload paths against fitlek.fakeserver.
+
+    python benchmarks/loadtest.py --requests=200 --concurrency=1,4,16,64 --latency=0.05
+
+For each destination and concurrency level it reports uploads per second and the
+p50 / p99 latency of individual uploads. A fake server is started in-process
+unless --url is given.
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fitlek.fakeserver import FakeServer  # noqa: E402
+from fitlek.fartlek import create_fartlek_workout  # noqa: E402
+from fitlek.garmin import GarminClient  # noqa: E402
+from fitlek.getfit import getfit_download  # noqa: E402
+from fitlek.intervals import IntervalsUploader  # noqa: E402
+from fitlek.thttp import Session  # noqa: E402
+
+
+def percentile(values, p):
+    return statistics.quantiles(values, n=100, method="inclusive")[p - 1] if len(values) > 1 else values[0]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    try:
+        func(*args)
+        return time.perf_counter() - start, None
+    except Exception as e:
+        return time.perf_counter() - start, e
+
+
+def run_garmin(url, workouts, concurrency):
+    client = GarminClient("loadtest", "loadtest", sso_url=f"{url}/sso/signin", connect_url=url)
+    client.connect()
+    batch = client.add_workouts(workouts, max_workers=concurrency)
+    results = list(batch)
+    return [r.elapsed for r in results], sum(not r.ok for r in results)
+
+
+def run_pool(func, workouts, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda w: timed(func, w), workouts))
+    return [elapsed for elapsed, _ in results], sum(error is not None for _, error in results)
+
+
+def run_intervals(url, workouts, concurrency):
+    uploader = IntervalsUploader(f"loadtest-{concurrency}", "key", session=Session(), base_url=f"{url}/api/v1")
+    uploader.folder_id()  # resolve the folder once up front, like a long-running uploader would
+    # upload_many raises on a failed upload, upload just returns the response
+    return run_pool(lambda w: uploader.upload_many([w]), workouts, concurrency)
+
+
+def run_getfit(url, workouts, concurrency):
+    def download(workout):
+        if getfit_download(workout.workout_name, workout, save=False, url=f"{url}/api/getfitfromjson") is None:
+            raise RuntimeError("getfit download failed")
+
+    return run_pool(download, workouts, concurrency)
+
+
+DESTINATIONS = {
+    "garmin": run_garmin,
+    "intervals": run_intervals,
+    "getfit": run_getfit,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="an already running fakeserver (default: start one in-process)")
+    parser.add_argument("--requests", type=int, default=200, help="uploads per destination and concurrency level")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma separated concurrency levels")
+    parser.add_argument("--destinations", default=",".join(DESTINATIONS))
+    parser.add_argument("--latency", type=float, default=0.02, help="latency of the in-process server")
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--throttle-rate", type=float, default=0)
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if not url:
+        server = FakeServer(latency=args.latency, error_rate=args.error_rate, throttle_rate=args.throttle_rate)
+        url = server.start().url
+
+    random.seed(0)
+    workouts = [create_fartlek_workout("45:00", "04:30") for _ in range(args.requests)]
+    results = []
+
+    try:
+        for destination in args.destinations.split(","):
+            for concurrency in [int(c) for c in args.concurrency.split(",")]:
+                start = time.perf_counter()
+                latencies, failures = DESTINATIONS[destination](url, workouts, concurrency)
+                elapsed = time.perf_counter() - start
+
+                result = {
+                    "destination": destination,
+                    "concurrency": concurrency,
+                    "requests": len(latencies),
+                    "failures": failures,
+                    "per_second": len(latencies) / elapsed,
+                    "p50": percentile(latencies, 50),
+                    "p99": percentile(latencies, 99),
+                }
+                results.append(result)
+                print(
+                    f"{destination:10} concurrency={concurrency:<4} {result['per_second']:8.1f} req/s  "
+                    f"p50={result['p50'] * 1000:7.1f}ms  p99={result['p99'] * 1000:7.1f}ms  failures={failures}"
+                )
+    finally:
+        if server:
+            server.stop()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Offline benchmarks for workout generation, serialization, export and the HTTP client.
+
+    python benchmarks/run.py --output=before.json
+    ... make some changes ...
+    python benchmarks/run.py --output=after.json --compare=before.json
+
+Results are written as JSON (seconds per call). With --compare, any benchmark
+whose median is more than --threshold slower than the previous run is reported
+and the script exits with a non-zero status.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import threading
+import timeit
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fitlek import thttp  # noqa: E402
+from fitlek.exporters import export  # noqa: E402
+from fitlek.fartlek import create_fartlek_workout, fartlek  # noqa: E402
+from fitlek.fit import FitEncoder  # noqa: E402
+from fitlek.intervals import workout_description  # noqa: E402
+
+DURATIONS = ["10:00", "30:00", "60:00", "120:00", "300:00"]
+TARGET_PACE = "04:30"
+REPEAT = 5
+
+
+class LoopbackHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    body = json.dumps({"workouts": list(range(100))}).encode()
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+def measure(func):
+    random.seed(0)
+    number, _ = timeit.Timer(func).autorange()
+    times = [t / number for t in timeit.Timer(func).repeat(REPEAT, number)]
+    return {"median": statistics.median(times), "best": min(times), "number": number}
+
+
+def benchmarks():
+    for duration in DURATIONS:
+        random.seed(0)
+        workout = create_fartlek_workout(duration, TARGET_PACE)
+        encoder = FitEncoder()
+
+        # the loop variables are bound now, rather than looked up when the benchmark runs
+        yield f"fartlek[{duration}]", partial(fartlek, duration)
+        yield f"create_fartlek_workout[{duration}]", partial(create_fartlek_workout, duration, TARGET_PACE)
+        yield f"garminconnect_json[{duration}]", workout.garminconnect_json
+        yield f"json.dumps[{duration}]", lambda workout=workout: json.dumps(workout.garminconnect_json())
+        yield f"workout_description[{duration}]", partial(workout_description, workout)
+        yield f"fit.encode[{duration}]", partial(encoder.encode, workout)
+        yield f"export[all][{duration}]", partial(export, workout)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), LoopbackHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    try:
+        with thttp.Session() as session:
+            yield "thttp.request[loopback]", lambda: thttp.request(url)
+            yield "thttp.Session.request[loopback]", lambda: session.request(url)
+    finally:
+        server.shutdown()
+
+
+def compare(results, previous, threshold):
+    regressions = []
+    for name, result in results.items():
+        if name not in previous:
+            continue
+
+        change = result["median"] / previous[name]["median"] - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  <-- regression"
+
+        before, after = previous[name]["median"] * 1e6, result["median"] * 1e6
+        print(f"{name:40} {before:10.1f}us -> {after:10.1f}us {change:+7.1%}{flag}", file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="write results to this file (default: stdout)")
+    parser.add_argument("--compare", help="results from a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before failing (default: 0.2)")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this")
+    args = parser.parse_args()
+
+    results = {}
+    for name, func in benchmarks():
+        if args.filter in name:
+            results[name] = measure(func)
+            print(f"{name:40} {results[name]['median'] * 1e6:10.1f}us", file=sys.stderr)
+
+    report = {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)["results"]
+        if compare(results, previous, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
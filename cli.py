@@ -1,17 +1,12 @@
 #! /usr/bin/env python
-import json
 import sys
 
 from fitlek.fartlek import create_fartlek_workout
-from fitlek.garmin import GarminClient
+from fitlek.timing import StageTimer
 
-try:
-    from fitlek.getfit import getfit_download
-
-    ENABLE_GETFIT = True
-except ImportError:
-    print("Getfit disabled")
-    ENABLE_GETFIT = False
+# Only what --dry-run needs is imported up front. The rest (especially the HTTP
+# stack, which pulls in ssl) is imported by the code path that uses it, see
+# tests/test_startup.py.
 
 
 def parse_args(args):
@@ -35,8 +30,128 @@ def get_or_throw(d, key, error):
         raise Exception(error)
 
 
-if __name__ == "__main__":
-    args = parse_args(sys.argv)
+def session_cache_dir(args):
+    from fitlek.garmin import DEFAULT_SESSION_CACHE_DIR
+
+    # --session-cache=<dir> overrides where the Garmin session is cached, --no-session-cache disables it
+    return args.get("--session-cache", DEFAULT_SESSION_CACHE_DIR) if "--no-session-cache" not in args else None
+
+
+def roster(args, timer):
+    import json
+
+    from fitlek.ledger import DEFAULT_LEDGER_PATH, UploadLedger
+    from fitlek.roster import RosterUploader, read_roster
+
+    athletes = read_roster(get_or_throw(args, "--roster", "The --roster value is required (a .csv or .jsonl file)"))
+    limits = {d: args[f"--{d}-workers"] for d in ("garmin", "intervals") if f"--{d}-workers" in args}
+
+    # --ledger[=<path>] skips workouts that were uploaded by a previous run (that day, for rows without a seed)
+    ledger_path = args.get("--ledger")
+    ledger = UploadLedger(DEFAULT_LEDGER_PATH if ledger_path is True else ledger_path) if ledger_path else None
+
+    # one JSON line per athlete, written as each upload finishes
+    log = open(args["--log"], "a") if "--log" in args else sys.stdout
+    uploader = RosterUploader(
+        workers=args.get("--workers", 8), limits=limits, ledger=ledger, session_cache_dir=session_cache_dir(args)
+    )
+    counts = {"uploaded": 0, "skipped": 0, "failed": 0}
+
+    try:
+        with timer.stage("roster"):
+            for result in uploader.run(athletes):
+                counts[result.status] += 1
+                log.write(json.dumps(result.as_dict()) + "\n")
+                log.flush()
+    finally:
+        if log is not sys.stdout:
+            log.close()
+        if ledger:
+            ledger.close()
+
+    print(", ".join(f"{n} {status}" for status, n in counts.items()), file=sys.stderr)
+    if counts["failed"]:
+        sys.exit(1)
+
+
+def training_plan(args, duration, target_pace):
+    from fitlek.plan import TrainingPlan
+
+    # a plan of --weeks weeks of --runs-per-week runs, progressing to --end-duration and --end-pace
+    return TrainingPlan(
+        args.get("--weeks", 1),
+        args.get("--runs-per-week", 1),
+        duration,
+        target_pace,
+        end_duration=args.get("--end-duration"),
+        end_pace=args.get("--end-pace"),
+        seed=args.get("--seed"),
+    )
+
+
+def fit_bundle(args, duration, target_pace, timer):
+    from fitlek.bulk import export_plan
+
+    path = get_or_throw(args, "--fit-bundle", "The --fit-bundle value is required (a .zip file or a directory)")
+    plan = training_plan(args, duration, target_pace)
+
+    with timer.stage("fit-bundle"):
+        written = export_plan(plan, path, workers=args.get("--workers"))
+
+    print(f"Wrote {written} FIT files to {path}", file=sys.stderr)
+
+
+def garmin_client(args, timer):
+    from fitlek.garmin import GarminClient
+    from fitlek.thttp import Retry, Session
+
+    username = get_or_throw(args, "--username", "The Garmin Connect --username value is required")
+    password = get_or_throw(args, "--password", "The Garmin Connect --password value is required")
+
+    # with --profile the HTTP requests are timed too, splitting network time from our own
+    session = Session(retry=Retry(), hooks=[timer.record_request]) if "--profile" in args else None
+    return GarminClient(username, password, session=session, cache_dir=session_cache_dir(args))
+
+
+def sync(args, duration, target_pace, timer):
+    from fitlek.sync import GarminSync
+
+    # an unseeded plan is different every run, so every sync would replace all of its workouts
+    get_or_throw(args, "--seed", "The --seed value is required with --sync, so that the plan is the same each time")
+    plan = training_plan(args, duration, target_pace)
+    client = garmin_client(args, timer)
+
+    with timer.stage("connect"):
+        client.connect()
+    with timer.stage("sync"):
+        # the listing is cached alongside the session, --full-sync ignores what's cached
+        garmin_sync = GarminSync(client, cache_dir=session_cache_dir(args), max_workers=args.get("--workers", 4))
+        result = garmin_sync.sync(plan, full="--full-sync" in args, dry_run="--dry-run" in args)
+
+    added, deleted, kept = len(result.added), len(result.deleted), len(result.kept)
+    if "--dry-run" in args:
+        print(f"Would add {added} and delete {deleted} workouts, keeping {kept}")
+    else:
+        print(f"Added {added} and deleted {deleted} workouts, kept {kept}")
+    for failure in result.failed:
+        print(f"Failed: {failure.error}", file=sys.stderr)
+    if result.failed:
+        sys.exit(1)
+
+
+def main(args, timer):
+    if "--serve" in args:
+        from fitlek.server import serve
+
+        return serve(
+            args.get("--host", "127.0.0.1"),
+            args.get("--port", 8000),
+            workers=args.get("--workers"),
+            cache_dir=args.get("--cache-dir"),
+        )
+
+    if "--roster" in args:
+        return roster(args, timer)
 
     duration = get_or_throw(args, "--duration", "The --duration value is required (format: MM:SS)")
     target_pace = get_or_throw(
@@ -45,18 +160,59 @@ if __name__ == "__main__":
         "The --target-pace value is required (format: MM:SS - mins/km)",
     )
 
-    workout = create_fartlek_workout(duration, target_pace)
+    if "--fit-bundle" in args:
+        return fit_bundle(args, duration, target_pace, timer)
+    if "--sync" in args:
+        return sync(args, duration, target_pace, timer)
+
+    with timer.stage("generate"):
+        workout = create_fartlek_workout(duration, target_pace)
 
     if "--dry-run" in args:
-        print(json.dumps(workout.garminconnect_json(), indent=2))
-    elif ENABLE_GETFIT and "--fit" in args:
-        getfit_download(workout)
+        from fitlek.jsonstream import dump_workout
+
+        with timer.stage("serialize"):
+            dump_workout(workout, sys.stdout, indent=2)
+            print()
+    elif "--fit" in args:
+        from fitlek.fit import write_workout
+
+        # --fit=<path> writes somewhere other than fitlek.fit
+        path = args["--fit"] if isinstance(args["--fit"], str) else "fitlek.fit"
+        with timer.stage("fit"):
+            with open(path, "wb") as f:
+                write_workout(workout, f)
     else:
-        username = get_or_throw(args, "--username", "The Garmin Connect --username value is required")
-        password = get_or_throw(args, "--password", "The Garmin Connect --password value is required")
+        client = garmin_client(args, timer)
 
-        client = GarminClient(username, password)
-        client.connect()
-        client.add_workout(workout)
+        with timer.stage("connect"):
+            client.connect()
+        with timer.stage("upload"):
+            client.add_workout(workout)
 
         print("Added workout. Check https://connect.garmin.com/modern/workouts and get ready to run!")
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv)
+    timer = StageTimer()
+
+    # --profile prints how long each stage took to stderr, --profile=<file> also saves cProfile stats there
+    profile = args.get("--profile")
+    if isinstance(profile, str):
+        import cProfile
+
+        profiler = cProfile.Profile()
+    else:
+        profiler = None
+
+    try:
+        if profiler:
+            profiler.runcall(main, args, timer)
+        else:
+            main(args, timer)
+    finally:
+        if profile:
+            print(timer.summary(), file=sys.stderr)
+        if profiler:
+            profiler.dump_stats(profile)
@@ -0,0 +1,287 @@
+"""
+An asyncio counterpart to thttp.
+
+request() takes the same arguments as thttp.request() and returns the same
+Response tuple, but runs on the event loop using asyncio streams so that many
+requests can be in flight without a thread each. Failed requests are retried
+according to a thttp.Retry, as they are by thttp.
+"""
+
+import asyncio
+import ssl
+import time
+from email.parser import BytesParser
+from http.client import HTTPMessage
+from http.cookiejar import CookieJar
+from urllib.error import URLError
+from urllib.parse import urlsplit
+
+from .thttp import (
+    MAX_REDIRECTS,
+    USER_AGENT,
+    build_response,
+    prepare_request,
+    redirect_request,
+)
+
+NO_BODY_STATUSES = (204, 304)
+
+
+class _ResponseInfo:
+    # just enough of a response for CookieJar.extract_cookies()
+    def __init__(self, message):
+        self.message = message
+
+    def info(self):
+        return self.message
+
+
+async def _read_body(reader, method, status, message):
+    # returns (body, reusable), a connection is only reusable if the body length is known
+    if method == "HEAD" or status in NO_BODY_STATUSES or 100 <= status < 200:
+        return b"", True
+
+    if "chunked" in message.get("transfer-encoding", "").lower():
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0].strip(), 16)
+            if size == 0:
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass  # trailers
+        return b"".join(chunks), True
+
+    if message.get("content-length") is not None:
+        return await reader.readexactly(int(message["content-length"])), True
+
+    return await reader.read(), False
+
+
+class AsyncSession:
+    """
+    Pools keep-alive connections per host, like thttp.Session. max_per_host caps
+    the number of requests in flight to any one host, others wait their turn
+    (but a request waiting to be retried doesn't hold its place).
+
+    Requests that don't pass a Retry use the session's retry (if any).
+    """
+
+    def __init__(self, cookiejar=None, pool_size=10, max_per_host=None, retry=None):
+        self.cookiejar = cookiejar if cookiejar is not None else CookieJar()
+        self.pool_size = pool_size
+        self.max_per_host = max_per_host
+        self.retry = retry
+        self._pools = {}
+        self._semaphores = {}
+        self._ssl_contexts = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            for _, writer in pool:
+                writer.close()
+
+    def _ssl_context(self, verify):
+        if verify not in self._ssl_contexts:
+            ctx = ssl.create_default_context()
+            if not verify:  # ignore ssl errors
+                ctx.check_hostname = False
+                ctx.verify_mode = ssl.CERT_NONE
+            self._ssl_contexts[verify] = ctx
+        return self._ssl_contexts[verify]
+
+    def _semaphore(self, host):
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.max_per_host)
+        return self._semaphores[host]
+
+    async def _connection(self, key, url):
+        scheme, host, verify = key
+        pool = self._pools.get(key)
+
+        while pool:
+            reader, writer = pool.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer, True
+            writer.close()
+
+        if scheme not in ("http", "https"):
+            raise URLError(f"unknown url type: {scheme}")
+
+        parts = urlsplit(url)
+        try:
+            reader, writer = await asyncio.open_connection(
+                parts.hostname,
+                parts.port or (443 if scheme == "https" else 80),
+                ssl=self._ssl_context(verify) if scheme == "https" else None,
+            )
+        except OSError as e:
+            raise URLError(e)
+        return reader, writer, False
+
+    def _release(self, key, reader, writer):
+        pool = self._pools.setdefault(key, [])
+        if len(pool) < self.pool_size:
+            pool.append((reader, writer))
+        else:
+            writer.close()
+
+    async def _send(self, req, verify):
+        key = (req.type, req.host, verify)
+        method = req.get_method()
+
+        headers = {"Host": req.host, "User-agent": USER_AGENT, "Accept-encoding": "identity"}
+        headers.update(req.header_items())
+        if req.data is not None:
+            headers["Content-length"] = str(len(req.data))
+        head = f"{method} {req.selector} HTTP/1.1\r\n" + "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+
+        while True:
+            reader, writer, reused = await self._connection(key, req.full_url)
+            try:
+                writer.write(head.encode("latin-1") + b"\r\n" + (req.data or b""))
+                await writer.drain()
+
+                status_line = await reader.readline()
+                if not status_line:
+                    raise ConnectionResetError("connection closed before a response was received")
+                version, status = status_line.split(None, 2)[:2]
+                status = int(status)
+
+                header_lines = []
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    header_lines.append(line)
+                message = BytesParser(_class=HTTPMessage).parsebytes(b"".join(header_lines))
+
+                content, reusable = await _read_body(reader, method, status, message)
+            except (ConnectionResetError, BrokenPipeError, asyncio.IncompleteReadError):
+                writer.close()
+                if reused:
+                    continue  # the server closed an idle connection, try again with a new one
+                raise
+            except BaseException:
+                writer.close()
+                raise
+
+            if reusable and version == b"HTTP/1.1" and "close" not in message.get("connection", "").lower():
+                self._release(key, reader, writer)
+            else:
+                writer.close()
+            return status, message, content
+
+    async def _send_limited(self, req, verify, timeout):
+        if self.max_per_host:
+            async with self._semaphore(req.host):
+                return await asyncio.wait_for(self._send(req, verify), timeout)
+        return await asyncio.wait_for(self._send(req, verify), timeout)
+
+    async def _send_with_retry(self, req, verify, timeout, retry):
+        if not retry:
+            return await self._send_limited(req, verify, timeout)
+
+        method = req.get_method()
+        start = time.monotonic()
+        attempt = 0
+
+        while True:
+            try:
+                status, message, content = await self._send_limited(req, verify, timeout)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                delay = retry.delay(attempt, start) if retry.retry_error(method, e) else None
+                if delay is None:
+                    raise
+            else:
+                if not retry.retry_status(method, status):
+                    return status, message, content
+                delay = retry.delay(attempt, start, message.get("retry-after"))
+                if delay is None:
+                    return status, message, content
+
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def request(
+        self,
+        url,
+        params={},
+        json=None,
+        data=None,
+        headers={},
+        method="GET",
+        verify=True,
+        redirect=True,
+        cookiejar=None,
+        basic_auth=None,
+        timeout=None,
+        retry=None,
+    ):
+        """
+        Takes the same arguments as thttp.request(), the timeout applies to each
+        attempt at a request (and each redirect) as a whole.
+        """
+        req = prepare_request(url, params, json, data, headers, method, basic_auth)
+        if not timeout:
+            timeout = 60
+
+        if cookiejar is None:
+            cookiejar = self.cookiejar
+        if retry is None:
+            retry = self.retry
+
+        redirects = 0
+
+        while True:
+            cookiejar.add_cookie_header(req)
+            status, message, content = await self._send_with_retry(req, verify, timeout, retry)
+            cookiejar.extract_cookies(_ResponseInfo(message), req)
+
+            location = message.get("location")
+            next_req = redirect_request(req, status, location) if redirect and location else None
+            if not next_req or redirects >= MAX_REDIRECTS:
+                break
+
+            req = next_req
+            redirects += 1
+
+        return build_response(req, status, content, message.items(), cookiejar)
+
+
+async def request(
+    url,
+    params={},
+    json=None,
+    data=None,
+    headers={},
+    method="GET",
+    verify=True,
+    redirect=True,
+    cookiejar=None,
+    basic_auth=None,
+    timeout=None,
+    retry=None,
+):
+    """
+    A one-off request, use an AsyncSession to reuse connections between requests.
+    """
+    async with AsyncSession(cookiejar=cookiejar) as session:
+        return await session.request(
+            url,
+            params=params,
+            json=json,
+            data=data,
+            headers=headers,
+            method=method,
+            verify=verify,
+            redirect=redirect,
+            basic_auth=basic_auth,
+            timeout=timeout,
+            retry=retry,
+        )
@@ -0,0 +1,149 @@
+"""
+Writes FIT files for many workouts at once, encoding them on a pool of processes.
+
+The files are streamed into a ZIP archive (if path ends in .zip) or a directory
+as each chunk is encoded, so only a few chunks are held in memory however many
+workouts there are:
+
+    plan = TrainingPlan(12, 3, "30:00", "05:00", end_duration="50:00", seed=1)
+    export_plan(plan, "plan.zip", workers=4)
+"""
+
+import os
+import re
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from .fit import FitEncoder
+from .utils import default_workers
+
+CHUNK_SIZE = 16
+
+
+def _encode_chunk(workouts):
+    encoder = FitEncoder()
+    return [(workout.workout_name, encoder.encode(workout)) for workout in workouts]
+
+
+def _encode_plan_chunk(plan, start, stop):
+    # the workouts are generated in the worker too, only the plan is sent to it
+    return _encode_chunk(plan.workout(i) for i in range(start, stop))
+
+
+def fit_filename(index, workout_name):
+    slug = re.sub(r"[^a-z0-9]+", "-", workout_name.lower()).strip("-") or "workout"
+    return f"{index + 1:04}-{slug}.fit"
+
+
+class ZipWriter:
+    """
+    Writes files into a new ZIP archive at path. The archive is built next to
+    path and only moved into place by close(), so a failed export (or another run
+    writing the same path) never leaves a partial archive behind.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self._zip = zipfile.ZipFile(self._tmp_path, "w", compression=zipfile.ZIP_DEFLATED)
+
+    def write(self, name, content):
+        self._zip.writestr(name, content)
+
+    def close(self, failed=False):
+        self._zip.close()
+        if failed:
+            os.remove(self._tmp_path)
+        else:
+            os.replace(self._tmp_path, self.path)
+
+
+class DirectoryWriter:
+    """
+    Writes files into the directory at path (creating it). A file is never
+    overwritten, if the name is taken a number is added to it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, name, content):
+        stem, ext = os.path.splitext(name)
+        for n in range(1, 1000):
+            path = os.path.join(self.path, name if n == 1 else f"{stem}-{n}{ext}")
+            try:
+                with open(path, "xb") as f:
+                    f.write(content)
+                return
+            except FileExistsError:
+                continue
+        raise FileExistsError(f"no free name for {name} in {self.path}")
+
+    def close(self, failed=False):
+        pass
+
+
+def _writer(path):
+    return ZipWriter(path) if path.lower().endswith(".zip") else DirectoryWriter(path)
+
+
+def _export(tasks, path, workers):
+    # tasks yields (function, args) that each return a list of (workout_name, fit_bytes)
+    if workers is None:
+        workers = default_workers()
+    writer = _writer(path)
+    written = 0
+
+    def write(files):
+        nonlocal written
+        for workout_name, content in files:
+            writer.write(fit_filename(written, workout_name), content)
+            written += 1
+
+    try:
+        if not workers:
+            for func, args in tasks:
+                write(func(*args))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                # at most two chunks per worker are encoded (or waiting to be written) at a time, and
+                # they're written in order so that the file names don't depend on which finishes first
+                tasks = iter(tasks)
+                pending = deque(pool.submit(func, *args) for func, args in islice(tasks, workers * 2))
+                while pending:
+                    files = pending.popleft().result()
+                    pending.extend(pool.submit(func, *args) for func, args in islice(tasks, 1))
+                    write(files)
+    except BaseException:
+        writer.close(failed=True)
+        raise
+
+    writer.close()
+    return written
+
+
+def export_fit(workouts, path, workers=None, chunk_size=CHUNK_SIZE):
+    """
+    Writes a FIT file for each of workouts (any iterable) to path, a .zip archive
+    or a directory, and returns how many were written. Files are named by their
+    position and workout name (see fit_filename).
+
+    The workouts are encoded chunk_size at a time on a pool of workers processes
+    (default: one per core), with workers=0 they're encoded in this process.
+    """
+    workouts = iter(workouts)
+    chunks = iter(lambda: list(islice(workouts, chunk_size)), [])
+    return _export(((_encode_chunk, (chunk,)) for chunk in chunks), path, workers)
+
+
+def export_plan(plan, path, workers=None, chunk_size=CHUNK_SIZE):
+    """
+    The same as export_fit(plan, ...) for a TrainingPlan, but the workouts are
+    generated by the worker processes as well as encoded.
+    """
+    tasks = ((_encode_plan_chunk, (plan, i, min(i + chunk_size, len(plan)))) for i in range(0, len(plan), chunk_size))
+    return _export(tasks, path, workers)
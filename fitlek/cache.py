@@ -0,0 +1,237 @@
+"""
+A cache for rendered workouts (Garmin JSON, intervals.icu text, FIT bytes).
+
+A seeded workout is always the same, so it only needs to be generated and
+encoded once:
+
+    cache = ArtifactCache(maxsize=1024, ttl=3600, directory="/var/cache/fitlek")
+    key = ("45:00", "04:30", "42", "fit")
+    content = cache.get_or_set(key, lambda: encode_workout(create_fartlek_workout("45:00", "04:30", seed="42")))
+
+Its files are kept by a DiskStore, which thttp.DiskCache uses for responses too.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class DiskStore:
+    """
+    Values (bytes) in files in directory, named by the sha256 of their key (a
+    string). A file is written next to its final name and then moved into place,
+    so readers (in any process) never see part of one.
+
+    With max_bytes, the least recently used files are removed once their total
+    size goes over it. Otherwise files are only removed with remove().
+    """
+
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        # name -> size, least recently used first (only kept with a max_bytes)
+        files = []
+        if max_bytes is not None:
+            for f in os.scandir(directory):
+                if f.is_file() and not f.name.endswith(".tmp"):
+                    stat = f.stat()
+                    files.append((stat.st_mtime, f.name, stat.st_size))
+        self._files = OrderedDict((name, size) for _, name, size in sorted(files))
+        self.size = sum(self._files.values())
+
+    def __len__(self):
+        return len(self._files)
+
+    @staticmethod
+    def _name(key):
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def read(self, key):
+        """
+        Returns (value, mtime) for key, or None if there's no file for it.
+        """
+        name = self._name(key)
+        path = os.path.join(self.directory, name)
+        try:
+            mtime = os.path.getmtime(path)
+            with open(path, "rb") as f:
+                value = f.read()
+        except OSError:
+            return None
+
+        if self.max_bytes is not None:
+            # the mtime records the last use, so that the order survives a restart
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            with self._lock:
+                if name in self._files:
+                    self._files.move_to_end(name)
+        return value, mtime
+
+    def write(self, key, value):
+        """
+        Stores value for key, and returns how many files were removed to make room
+        for it, or None if it wasn't stored (writing is best effort).
+        """
+        if self.max_bytes is not None and len(value) > self.max_bytes:
+            return None
+
+        name = self._name(key)
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError:
+            return None
+
+        evicted = []
+        if self.max_bytes is not None:
+            with self._lock:
+                self.size += len(value) - self._files.pop(name, 0)
+                self._files[name] = len(value)
+                while self.size > self.max_bytes:
+                    evicted_name, size = self._files.popitem(last=False)
+                    self.size -= size
+                    evicted.append(evicted_name)
+
+        for evicted_name in evicted:
+            self._remove(evicted_name)
+        return len(evicted)
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    def remove(self, key):
+        name = self._name(key)
+        with self._lock:
+            self.size -= self._files.pop(name, 0)
+        self._remove(name)
+
+    def clear(self):
+        """
+        Removes the files this store knows about (those written or found on disk
+        with a max_bytes).
+        """
+        with self._lock:
+            names = list(self._files)
+            self._files.clear()
+            self.size = 0
+        for name in names:
+            self._remove(name)
+
+
+class ArtifactCache:
+    """
+    Keeps up to maxsize values in memory, evicting the least recently used, and
+    drops values older than ttl seconds (if a ttl is given). Keys are tuples of
+    strings (e.g. duration, pace, seed and format), values are bytes.
+
+    With a directory, values are also written there and memory misses are read
+    back from it, so the cache survives a restart and can be shared between
+    processes. Files older than ttl are ignored and removed when they're read.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, directory=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.directory = directory
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires, value)
+        self._lock = threading.Lock()
+        self._store = DiskStore(directory) if directory else None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _read(self, key):
+        # returns (value, age in seconds)
+        stored = self._store.read(repr(key))
+        if stored is None:
+            return MISSING, 0
+
+        value, mtime = stored
+        age = max(0, time.time() - mtime)
+        if self.ttl is not None and age > self.ttl:
+            self._store.remove(repr(key))
+            return MISSING, 0
+        return value, age
+
+    def _remember(self, key, value, age=0):
+        expires = time.monotonic() + self.ttl - age if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires is None or expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        value, age = self._read(key) if self._store is not None else (MISSING, 0)
+        if value is MISSING:
+            with self._lock:
+                self.misses += 1
+            return default
+
+        self._remember(key, value, age)
+        with self._lock:
+            self.hits += 1
+            self.disk_hits += 1
+        return value
+
+    def set(self, key, value):
+        self._remember(key, value)
+        if self._store is not None:
+            self._store.write(repr(key), value)
+
+    def get_or_set(self, key, create):
+        """
+        Returns the cached value for key, or calls create() and caches what it returns.
+        """
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            value = create()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0,
+        }
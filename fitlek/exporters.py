@@ -0,0 +1,260 @@
+"""
+Exports workouts to Garmin Connect JSON, intervals.icu text, FIT, Zwift (.zwo)
+and TCX.
+
+export() walks a workout's steps once and hands each step to every requested
+exporter, so producing all of the formats costs a single pass:
+
+    files = export(workout, ["garmin", "fit", "zwo"])
+    files["fit"]  # bytes
+
+New formats subclass Exporter and are added with @register.
+"""
+
+import json
+from html import escape
+
+from .fit import FitEncoder
+from .workout import workout_json
+
+# intervals.icu pace targets, as a percentage of threshold pace
+PACES = {
+    "warmup": "60-80%",
+    "interval": "90-120%",
+    "recovery": "60-90%",
+    "cooldown": "60-80%",
+}
+
+EXPORTERS = {}
+
+
+def register(exporter):
+    EXPORTERS[exporter.name] = exporter
+    return exporter
+
+
+class Exporter:
+    """
+    Builds one format from a workout: begin() is called with the workout, then
+    add_step() with each of its steps in order, and end() returns the bytes.
+    """
+
+    name = None
+    content_type = "application/octet-stream"
+    extension = None
+
+    def begin(self, workout):
+        pass
+
+    def add_step(self, step):
+        raise NotImplementedError
+
+    def end(self):
+        raise NotImplementedError
+
+
+@register
+class GarminExporter(Exporter):
+    """
+    The same JSON as json.dumps(workout.garminconnect_json()).
+    """
+
+    name = "garmin"
+    content_type = "application/json"
+    extension = "json"
+
+    def begin(self, workout):
+        self.workout = workout
+        self.steps = []
+
+    def add_step(self, step):
+        self.steps.append(step.garminconnect_json())
+
+    def end(self):
+        return json.dumps(workout_json(self.workout.sport_type, self.workout.workout_name, self.steps)).encode()
+
+
+def intervals_step(step):
+    return f"{step.step_type}\n- {step.end_condition_value.replace(':', 'm')}s {PACES[step.step_type]} Pace\n\n"
+
+
+@register
+class IntervalsExporter(Exporter):
+    """
+    The intervals.icu workout text, see intervals.workout_description().
+    """
+
+    name = "intervals"
+    content_type = "text/plain; charset=utf-8"
+    extension = "txt"
+
+    def begin(self, workout):
+        self.parts = []
+
+    def add_step(self, step):
+        self.parts.append(intervals_step(step))
+
+    def end(self):
+        return "".join(self.parts).encode()
+
+
+@register
+class FitExporter(Exporter):
+    name = "fit"
+    content_type = "application/vnd.ant.fit"
+    extension = "fit"
+
+    def __init__(self):
+        self.encoder = FitEncoder()
+
+    def begin(self, workout):
+        self.encoder.begin(workout)
+
+    def add_step(self, step):
+        self.encoder.add_step(step)
+
+    def end(self):
+        return bytes(self.encoder.end())
+
+
+def _pace_range(pace):
+    low, high = pace.rstrip("%").split("-")
+    return int(low) / 100, int(high) / 100
+
+
+# Zwift run workouts give "power" as a fraction of threshold pace
+ZWO_POWER = {step_type: _pace_range(pace) for step_type, pace in PACES.items()}
+
+
+def _time_step_seconds(step, format_name):
+    if step.end_condition != "time" or step.parsed_end_condition_value() is None:
+        raise ValueError(f"{format_name} export only supports time based steps")
+    return step.parsed_end_condition_value()
+
+
+@register
+class ZwiftExporter(Exporter):
+    """
+    A Zwift workout file. Warmups and cooldowns ramp across their pace range,
+    other steps hold the middle of it.
+    """
+
+    name = "zwo"
+    content_type = "application/xml"
+    extension = "zwo"
+
+    def begin(self, workout):
+        self.parts = [
+            "<workout_file>\n",
+            "    <author>fitlek</author>\n",
+            f"    <name>{escape(workout.workout_name, quote=False)}</name>\n",
+            "    <description></description>\n",
+            "    <sportType>run</sportType>\n",
+            "    <workout>\n",
+        ]
+
+    def add_step(self, step):
+        seconds = _time_step_seconds(step, "Zwift")
+        low, high = ZWO_POWER[step.step_type]
+
+        if step.step_type == "warmup":
+            element = f'<Warmup Duration="{seconds}" PowerLow="{low:.2f}" PowerHigh="{high:.2f}"/>'
+        elif step.step_type == "cooldown":
+            element = f'<Cooldown Duration="{seconds}" PowerLow="{high:.2f}" PowerHigh="{low:.2f}"/>'
+        else:
+            element = f'<SteadyState Duration="{seconds}" Power="{(low + high) / 2:.2f}"/>'
+        self.parts.append(f"        {element}\n")
+
+    def end(self):
+        self.parts.append("    </workout>\n</workout_file>\n")
+        return "".join(self.parts).encode()
+
+
+TCX_SPORTS = {"running": "Running", "cycling": "Biking"}
+
+
+def _tcx_duration(step):
+    value = step.parsed_end_condition_value()
+    if step.end_condition == "time" and value is not None:
+        return f'<Duration xsi:type="Time_t"><Seconds>{value}</Seconds></Duration>'
+    if step.end_condition == "distance" and value is not None:
+        return f'<Duration xsi:type="Distance_t"><Meters>{value}</Meters></Duration>'
+    return '<Duration xsi:type="UserInitiated_t"/>'
+
+
+def _tcx_target(target):
+    if target.target in ("pace.zone", "speed.zone"):
+        if target.zone:
+            zone = f'<SpeedZone xsi:type="PredefinedSpeedZone_t"><Number>{target.zone}</Number></SpeedZone>'
+            return f'<Target xsi:type="Speed_t">{zone}</Target>'
+        values = [v for v in (target.to_value, target.from_value) if v is not None]
+        if values:
+            return (
+                '<Target xsi:type="Speed_t"><SpeedZone xsi:type="CustomSpeedZone_t"><ViewAs>Pace</ViewAs>'
+                f"<LowInMetersPerSecond>{min(values)}</LowInMetersPerSecond>"
+                f"<HighInMetersPerSecond>{max(values)}</HighInMetersPerSecond></SpeedZone></Target>"
+            )
+    elif target.target == "heart.rate.zone" and target.zone:
+        zone = f'<HeartRateZone xsi:type="PredefinedHeartRateZone_t"><Number>{target.zone}</Number></HeartRateZone>'
+        return f'<Target xsi:type="HeartRate_t">{zone}</Target>'
+    return '<Target xsi:type="None_t"/>'
+
+
+@register
+class TcxExporter(Exporter):
+    """
+    A Training Center (TCX) workout. TCX workout names are limited to 15 characters.
+    """
+
+    name = "tcx"
+    content_type = "application/vnd.garmin.tcx+xml"
+    extension = "tcx"
+
+    def begin(self, workout):
+        self.step_id = 0
+        self.parts = [
+            '<?xml version="1.0" encoding="UTF-8"?>\n',
+            '<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2"'
+            ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">\n',
+            "  <Workouts>\n",
+            f'    <Workout Sport="{escape(TCX_SPORTS.get(workout.sport_type, "Other"))}">\n',
+            f"      <Name>{escape(workout.workout_name[:15], quote=False)}</Name>\n",
+        ]
+
+    def add_step(self, step):
+        self.step_id += 1
+        intensity = "Resting" if step.step_type == "recovery" else "Active"
+        self.parts.append(
+            f'      <Step xsi:type="Step_t"><StepId>{self.step_id}</StepId>{_tcx_duration(step)}'
+            f"<Intensity>{intensity}</Intensity>{_tcx_target(step.target)}</Step>\n"
+        )
+
+    def end(self):
+        self.parts.append("    </Workout>\n  </Workouts>\n</TrainingCenterDatabase>\n")
+        return "".join(self.parts).encode()
+
+
+def export(workout, formats=None):
+    """
+    Returns {format: bytes} for each of formats (default: every registered format),
+    walking the workout's steps once.
+    """
+    if formats is None:
+        formats = list(EXPORTERS)
+    elif isinstance(formats, str):
+        formats = [formats]
+
+    unknown = [name for name in formats if name not in EXPORTERS]
+    if unknown:
+        raise ValueError(f"unknown format {', '.join(unknown)}, must be one of: {', '.join(EXPORTERS)}")
+
+    exporters = [EXPORTERS[name]() for name in formats]
+    for exporter in exporters:
+        exporter.begin(workout)
+
+    add_steps = [exporter.add_step for exporter in exporters]
+    for step in workout.workout_steps:
+        for add_step in add_steps:
+            add_step(step)
+
+    return {name: exporter.end() for name, exporter in zip(formats, exporters)}
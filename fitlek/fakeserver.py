@@ -0,0 +1,306 @@
+"""
+A local stand-in for Garmin Connect, intervals.icu and the getfit service, for
+testing and load-testing uploads without touching the real services.
+
+    python -m fitlek.fakeserver --port=8000 --latency=0.05 --throttle-rate=0.01
+
+Then point fitlek at it:
+
+    FITLEK_GARMIN_SSO_URL=http://127.0.0.1:8000/sso/signin
+    FITLEK_GARMIN_CONNECT_URL=http://127.0.0.1:8000
+    FITLEK_INTERVALS_URL=http://127.0.0.1:8000/api/v1
+    FITLEK_GETFIT_URL=http://127.0.0.1:8000/api/getfitfromjson
+
+Only the endpoints (and the parts of their responses) that fitlek uses are
+implemented. Any username / password and any intervals.icu API key is accepted.
+"""
+
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from .fit import encode_workout
+from .workout import Target, Workout, WorkoutStep
+
+SESSION_COOKIE = "SESSIONID"
+
+
+class FakeServer(ThreadingHTTPServer):
+    """
+    latency (seconds) is added to every response. A proportion of requests
+    (error_rate) fail with a 500, and another (throttle_rate) are rejected with a
+    429 and a Retry-After of retry_after seconds.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address=("127.0.0.1", 0), latency=0, error_rate=0, throttle_rate=0, retry_after=1, seed=None):
+        super().__init__(address, FakeHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.sessions = set()
+        self.tickets = set()
+        self.garmin_workouts = {}
+        self.intervals_folders = {}
+        self.intervals_workouts = {}
+        self.requests = 0
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def sso_url(self):
+        return f"{self.url}/sso/signin"
+
+    @property
+    def connect_url(self):
+        return self.url
+
+    @property
+    def intervals_url(self):
+        return f"{self.url}/api/v1"
+
+    @property
+    def getfit_url(self):
+        return f"{self.url}/api/getfitfromjson"
+
+    def next_id(self):
+        with self.lock:
+            return next(self.ids)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    routes = [
+        ("POST", r"/sso/signin", "sso_signin"),
+        ("GET", r"/sso/ticket", "sso_ticket"),
+        ("GET", r"/modern/proxy/workout-service/workouts", "garmin_list_workouts"),
+        ("POST", r"/modern/proxy/workout-service/workout", "garmin_add_workout"),
+        ("DELETE", r"/modern/proxy/workout-service/workout/(\d+)", "garmin_delete_workout"),
+        ("GET", r"/api/v1/athlete/([^/]+)/folders", "intervals_list_folders"),
+        ("POST", r"/api/v1/athlete/([^/]+)/folders", "intervals_create_folder"),
+        ("POST", r"/api/v1/athlete/([^/]+)/workouts", "intervals_add_workouts"),
+        ("POST", r"/api/getfitfromjson", "getfit"),
+    ]
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_POST(self):
+        self.dispatch()
+
+    def do_DELETE(self):
+        self.dispatch()
+
+    def dispatch(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        url = urlsplit(self.path)
+        self.query = parse_qs(url.query)
+
+        with server.lock:
+            server.requests += 1
+            roll = server.random.random()
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if roll < server.throttle_rate:
+            return self.respond(429, {"error": "too many requests"}, {"Retry-After": str(server.retry_after)})
+        if roll < server.throttle_rate + server.error_rate:
+            return self.respond(500, {"error": "internal server error"})
+
+        for method, pattern, name in self.routes:
+            match = re.fullmatch(pattern, url.path)
+            if match and method == self.command:
+                return getattr(self, name)(body, *match.groups())
+        self.respond(404, {"error": "not found"})
+
+    def respond(self, status, content, headers={}, content_type="application/json"):
+        if content_type == "application/json":
+            content = json.dumps(content).encode()
+        elif isinstance(content, str):
+            content = content.encode()
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def has_session(self):
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        return SESSION_COOKIE in cookie and cookie[SESSION_COOKIE].value in self.server.sessions
+
+    def has_api_key(self):
+        return self.headers.get("Authorization", "").startswith("Bearer ")
+
+    # Garmin Connect
+
+    def sso_signin(self, body):
+        form = parse_qs(body.decode())
+        if not form.get("username") or not form.get("password"):
+            return self.respond(401, "<html>invalid credentials</html>", content_type="text/html")
+
+        ticket = f"ST-{self.server.next_id()}"
+        with self.server.lock:
+            self.server.tickets.add(ticket)
+        page = f'<html><script>var response_url = "{self.server.url}/sso/ticket?ticket={ticket}";</script></html>'
+        self.respond(200, page, content_type="text/html")
+
+    def sso_ticket(self, body):
+        ticket = self.query.get("ticket", [""])[0]
+        with self.server.lock:
+            if ticket not in self.server.tickets:
+                return self.respond(403, {"error": "invalid ticket"})
+            self.server.tickets.discard(ticket)
+            session = f"session-{ticket}"
+            self.server.sessions.add(session)
+        self.respond(200, "<html>ok</html>", {"Set-Cookie": f"{SESSION_COOKIE}={session}; Path=/"}, "text/html")
+
+    def garmin_list_workouts(self, body):
+        if not self.has_session():
+            return self.respond(401, {"error": "unauthorized"})
+
+        start = int(self.query.get("start", ["0"])[0])
+        limit = int(self.query.get("limit", ["100"])[0])
+        with self.server.lock:
+            workouts = sorted(self.server.garmin_workouts.values(), key=lambda w: w["updateDate"], reverse=True)
+        self.respond(200, workouts[start : start + limit])
+
+    def garmin_add_workout(self, body):
+        if not self.has_session():
+            return self.respond(401, {"error": "unauthorized"})
+
+        workout = json.loads(body)
+        workout["workoutId"] = self.server.next_id()
+        workout["updateDate"] = workout["createdDate"] = time.strftime("%Y-%m-%dT%H:%M:%S.0", time.gmtime())
+        with self.server.lock:
+            self.server.garmin_workouts[workout["workoutId"]] = workout
+        self.respond(200, workout)
+
+    def garmin_delete_workout(self, body, workout_id):
+        if not self.has_session():
+            return self.respond(401, {"error": "unauthorized"})
+
+        with self.server.lock:
+            deleted = self.server.garmin_workouts.pop(int(workout_id), None)
+        self.respond(204 if deleted else 404, b"", content_type="text/plain")
+
+    # intervals.icu
+
+    def intervals_list_folders(self, body, athlete_id):
+        if not self.has_api_key():
+            return self.respond(401, {"error": "unauthorized"})
+
+        with self.server.lock:
+            folders = [f for f in self.server.intervals_folders.values() if f["athlete_id"] == athlete_id]
+        self.respond(200, folders)
+
+    def intervals_create_folder(self, body, athlete_id):
+        if not self.has_api_key():
+            return self.respond(401, {"error": "unauthorized"})
+
+        folder = {**json.loads(body), "id": self.server.next_id(), "athlete_id": athlete_id}
+        with self.server.lock:
+            self.server.intervals_folders[folder["id"]] = folder
+        self.respond(200, folder)
+
+    def intervals_add_workouts(self, body, athlete_id):
+        if not self.has_api_key():
+            return self.respond(401, {"error": "unauthorized"})
+
+        workouts = json.loads(body)
+        with self.server.lock:
+            if any(w["folder_id"] not in self.server.intervals_folders for w in workouts):
+                return self.respond(422, {"error": "folder not found"})
+
+        created = [{**w, "id": self.server.next_id(), "athlete_id": athlete_id} for w in workouts]
+        with self.server.lock:
+            self.server.intervals_workouts.update((w["id"], w) for w in created)
+        self.respond(200, created)
+
+    # getfit
+
+    def getfit(self, body):
+        request = json.loads(body)
+        workout = Workout("running", request["name"])
+        for i, step in enumerate(request["steps"]):
+            minutes, seconds = divmod(step["duration"], 60)
+            target = (
+                Target("pace.zone", step["targetSpeedHigh"], step["targetSpeedLow"])
+                if step["targetSpeedLow"]
+                else Target()
+            )
+            workout.add_step(WorkoutStep(i + 1, step["intensity"], "time", f"{minutes:02}:{seconds:02}", target))
+        self.respond(200, encode_workout(workout), content_type="application/octet-stream")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake Garmin Connect / intervals.icu / getfit server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0, help="seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0, help="proportion of requests that return a 500")
+    parser.add_argument("--throttle-rate", type=float, default=0, help="proportion of requests that return a 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After sent with 429s")
+    args = parser.parse_args()
+
+    server = FakeServer(
+        (args.host, args.port),
+        latency=args.latency,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+    )
+    print(f"Listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
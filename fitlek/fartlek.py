@@ -1,47 +1,78 @@
 import random
+from array import array
 
 from .utils import mmss_to_seconds, pace_to_ms, seconds_to_mmss
 from .workout import Target, Workout, WorkoutStep
 
 
-def fartlek(target_time):
-    target_seconds = mmss_to_seconds(target_time)
-
+def warmup_and_cooldown(target_seconds):
     if target_seconds >= 40 * 60:
         # runs greater than 40 minutes == 10 minute warmup / cooldown
-        warmup = 60 * 10
-        cooldown = 60 * 10
+        return 60 * 10, 60 * 10
     elif target_seconds >= 25 * 60:
         # runs greater than 25 mins == 8 mins warmup + 4 mins cooldown
-        warmup = 60 * 8
-        cooldown = 60 * 4
+        return 60 * 8, 60 * 4
     else:
         # all other runs get a 5 minute warmup and 2 minute cooldown
-        warmup = 60 * 5
-        cooldown = 60 * 2
+        return 60 * 5, 60 * 2
+
 
-    workout = [warmup, cooldown]
+def _fartlek_steps(target_seconds, rng):
+    warmup, cooldown = warmup_and_cooldown(target_seconds)
+    steps = array("I", [warmup])
+    total = warmup + cooldown
 
-    while sum(workout) < target_seconds:
+    while total < target_seconds:
         # add an interval, recovery pair
-        interval = 15 * random.randint(2, 8)
-        recovery = interval + 15 * random.randint(2, 4)
+        interval = 15 * rng.randint(2, 8)
+        recovery = interval + 15 * rng.randint(2, 4)
+
+        steps.append(interval)
+        steps.append(recovery)
+        total += interval + recovery
 
-        workout.insert(-1, interval)
-        workout.insert(-1, recovery)
+    steps.append(cooldown)
 
-    if sum(workout) > target_seconds:
+    if total > target_seconds:
         # remove the last interval and increase something by the amount remaining
-        workout.pop(-2) + workout.pop(-2)
-        remaining = target_seconds - sum(workout)
-        i = random.randint(1, len(workout) - 1)
-        workout[i] += remaining
+        total -= steps.pop(-2) + steps.pop(-2)
+        remaining = target_seconds - total
+        i = rng.randint(1, len(steps) - 1)
+        steps[i] += remaining
+
+    return steps
+
+
+def fartlek_batch(durations, seed=None, rng=None):
+    """
+    Generates the step durations (in seconds) for many workouts at once.
+
+    Durations can be "MM:SS" strings or a number of seconds. Each workout is
+    returned as a compact array of unsigned ints: warmup, interval / recovery
+    pairs and the cooldown. Pass a seed (or a random.Random) to get the same
+    workouts back again.
+    """
+    if rng is None:
+        rng = random.Random(seed)
+    return [_fartlek_steps(d if isinstance(d, int) else mmss_to_seconds(d), rng) for d in durations]
+
+
+def _rng(seed, rng):
+    # the global random module unless a seed or random.Random is given
+    if rng is not None:
+        return rng
+    return random.Random(seed) if seed is not None else random
+
 
-    return workout
+def fartlek(target_time, seed=None, rng=None):
+    return fartlek_batch([target_time], rng=_rng(seed, rng))[0].tolist()
 
 
-def create_fartlek_workout(duration, target_pace, name=None):
-    workout_steps = fartlek(duration)
+def create_fartlek_workout(duration, target_pace, name=None, rng=None, seed=None):
+    """
+    Pass a seed (or a random.Random) to get the same workout back again.
+    """
+    workout_steps = fartlek_batch([duration], rng=_rng(seed, rng))[0].tolist()
     target_min = round(pace_to_ms(target_pace) * 1.10, 2)
     target_max = round(pace_to_ms(target_pace) * 0.9, 2)
 
@@ -0,0 +1,241 @@
+"""
+A small FIT encoder for workout files.
+
+Only the messages needed to describe a structured workout are written: file_id,
+workout and workout_step. Output is deterministic - encoding the same workout
+twice produces the same bytes.
+
+Message and field numbers are from the FIT SDK profile:
+https://developer.garmin.com/fit/file-types/workout/
+"""
+
+import struct
+
+PROTOCOL_VERSION = 0x10
+PROFILE_VERSION = 2132
+
+FILE_TYPE_WORKOUT = 5
+MANUFACTURER_DEVELOPMENT = 255
+
+# base types
+ENUM = 0x00
+STRING = 0x07
+UINT16 = 0x84
+UINT32 = 0x86
+UINT32Z = 0x8C
+
+UINT32_INVALID = 0xFFFFFFFF
+
+SPORTS = {
+    "running": 1,
+    "cycling": 2,
+}
+
+INTENSITIES = {"warmup": 2, "cooldown": 3, "interval": 0, "recovery": 4}
+
+DURATION_TYPES = {
+    "time": 0,  # milliseconds
+    "distance": 1,  # centimeters
+    "lap.button": 5,  # open
+}
+
+TARGET_TYPES = {
+    "no.target": 2,  # open
+    "power.zone": 4,
+    "cadence.zone": 3,
+    "heart.rate.zone": 1,
+    "speed.zone": 0,
+    "pace.zone": 0,  # FIT has no pace target, pace is a speed range
+}
+
+# (scale, offset) applied to custom target values
+TARGET_SCALES = {
+    0: (1000, 0),  # millimeters per second
+    1: (1, 100),  # bpm are offset by 100 to leave room for zones
+    3: (1, 0),
+    4: (1, 1000),  # watts are offset by 1000 to leave room for zones
+}
+
+HEADER = struct.Struct("<BBHI4s")
+FILE_ID = struct.Struct("<BBHHII")
+WORKOUT = struct.Struct("<BBH")
+WORKOUT_STEP = struct.Struct("<BHBIBIIIB")
+
+
+def _crc_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+
+CRC_TABLE = _crc_table()
+
+
+def crc16(data, crc=0):
+    table = CRC_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def _definition(local_type, global_message, fields):
+    message = struct.pack("<BBBHB", 0x40 | local_type, 0, 0, global_message, len(fields))
+    return message + b"".join(struct.pack("BBB", *field) for field in fields)
+
+
+FILE_ID_DEFINITION = _definition(
+    0,
+    0,
+    [
+        (0, 1, ENUM),  # type
+        (1, 2, UINT16),  # manufacturer
+        (2, 2, UINT16),  # product
+        (3, 4, UINT32Z),  # serial_number
+        (4, 4, UINT32),  # time_created
+    ],
+)
+
+WORKOUT_STEP_DEFINITION = _definition(
+    2,
+    27,
+    [
+        (254, 2, UINT16),  # message_index
+        (1, 1, ENUM),  # duration_type
+        (2, 4, UINT32),  # duration_value
+        (3, 1, ENUM),  # target_type
+        (4, 4, UINT32),  # target_value
+        (5, 4, UINT32),  # custom_target_value_low
+        (6, 4, UINT32),  # custom_target_value_high
+        (7, 1, ENUM),  # intensity
+    ],
+)
+
+_workout_definitions = {}
+
+
+def _workout_definition(name_size):
+    # the workout name is a fixed size string field, so the definition depends on its length
+    try:
+        return _workout_definitions[name_size]
+    except KeyError:
+        definition = _definition(
+            1,
+            26,
+            [
+                (4, 1, ENUM),  # sport
+                (6, 2, UINT16),  # num_valid_steps
+                (8, name_size, STRING),  # wkt_name
+            ],
+        )
+        _workout_definitions[name_size] = definition
+        return definition
+
+
+def _duration(step):
+    duration_type = DURATION_TYPES[step.end_condition]
+    value = step.parsed_end_condition_value()
+
+    if value is None or duration_type == DURATION_TYPES["lap.button"]:
+        return duration_type, UINT32_INVALID
+    elif duration_type == DURATION_TYPES["time"]:
+        return duration_type, value * 1000
+    else:
+        return duration_type, value * 100
+
+
+def _target(target):
+    target_type = TARGET_TYPES[target.target]
+
+    if target_type == TARGET_TYPES["no.target"]:
+        return target_type, 0, UINT32_INVALID, UINT32_INVALID
+    if target.zone:
+        return target_type, target.zone, UINT32_INVALID, UINT32_INVALID
+
+    scale, offset = TARGET_SCALES[target_type]
+    values = [v for v in (target.to_value, target.from_value) if v is not None]
+    if not values:
+        return target_type, 0, UINT32_INVALID, UINT32_INVALID
+    return target_type, 0, round(min(values) * scale) + offset, round(max(values) * scale) + offset
+
+
+class FitEncoder:
+    """
+    Encodes workouts into FIT bytes.
+
+    The encoder keeps a single buffer that is reused between workouts, so one
+    encoder can be used to write many files:
+
+        encoder = FitEncoder()
+        for workout in workouts:
+            with open(...) as f:
+                encoder.write(workout, f)
+
+    Steps can also be fed one at a time with begin(), add_step() and end().
+    """
+
+    def __init__(self, time_created=None, serial_number=0):
+        # time_created is a FIT timestamp (seconds since 1989-12-31 UTC), it's left unset
+        # by default so that the output only depends on the workout
+        self.time_created = UINT32_INVALID if time_created is None else time_created
+        self.serial_number = serial_number
+        self.buffer = bytearray()
+        self._step_index = 0
+
+    def begin(self, workout):
+        buffer = self.buffer
+        del buffer[:]
+        buffer += bytes(HEADER.size + 2)  # filled in by end()
+
+        buffer += FILE_ID_DEFINITION
+        buffer += FILE_ID.pack(0, FILE_TYPE_WORKOUT, MANUFACTURER_DEVELOPMENT, 0, self.serial_number, self.time_created)
+
+        name = workout.workout_name.encode("utf-8")[:254] + b"\x00"
+        buffer += _workout_definition(len(name))
+        buffer += WORKOUT.pack(1, SPORTS[workout.sport_type], len(workout.workout_steps)) + name
+
+        buffer += WORKOUT_STEP_DEFINITION
+        self._step_index = 0
+
+    def add_step(self, step):
+        duration_type, duration_value = _duration(step)
+        self.buffer += WORKOUT_STEP.pack(
+            2,
+            self._step_index,
+            duration_type,
+            duration_value,
+            *_target(step.target),
+            INTENSITIES[step.step_type],
+        )
+        self._step_index += 1
+
+    def end(self):
+        buffer = self.buffer
+        header_size = HEADER.size + 2
+        header = HEADER.pack(header_size, PROTOCOL_VERSION, PROFILE_VERSION, len(buffer) - header_size, b".FIT")
+        buffer[:header_size] = header + struct.pack("<H", crc16(header))
+        buffer += struct.pack("<H", crc16(buffer))
+        return buffer
+
+    def encode_into(self, workout):
+        self.begin(workout)
+        for step in workout.workout_steps:
+            self.add_step(step)
+        return self.end()
+
+    def encode(self, workout):
+        return bytes(self.encode_into(workout))
+
+    def write(self, workout, f):
+        f.write(self.encode_into(workout))
+
+
+def encode_workout(workout, time_created=None):
+    return FitEncoder(time_created=time_created).encode(workout)
+
+
+def write_workout(workout, f, time_created=None):
+    FitEncoder(time_created=time_created).write(workout, f)
@@ -1,8 +1,108 @@
+import asyncio
+import hashlib
+import os
 import re
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from http.cookiejar import LoadError, LWPCookieJar
+from itertools import islice
 
-from .thttp import request
+from .athttp import AsyncSession
+from .ledger import LOOKUP_CHUNK_SIZE
+from .thttp import Retry, Session
 
-SSO_LOGIN_URL = "https://sso.garmin.com/sso/signin"
+# these can be pointed somewhere else (like fitlek.fakeserver) with environment variables
+SSO_LOGIN_URL = os.environ.get("FITLEK_GARMIN_SSO_URL", "https://sso.garmin.com/sso/signin")
+CONNECT_URL = os.environ.get("FITLEK_GARMIN_CONNECT_URL", "https://connect.garmin.com")
+
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:82.0) Gecko/20100101 Firefox/82.0"
+SSO_HEADERS = {
+    "origin": "https://sso.garmin.com",
+    "user-agent": USER_AGENT,
+}
+WORKOUT_HEADERS = {
+    "Referer": "https://connect.garmin.com/modern/workout/create/running",
+    "NK": "NT",
+    "X-app-ver": "4.38.2.0",
+    "user-agent": USER_AGENT,
+}
+
+DEFAULT_SESSION_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "fitlek")
+SESSION_CACHE_TTL = 60 * 60 * 12
+
+
+class UploadResult(namedtuple("UploadResult", "workout status json error elapsed skipped", defaults=(False,))):
+    """
+    skipped is True if the workout wasn't uploaded because the ledger shows it
+    already has been, json is then just {"workoutId": <its id>}.
+    """
+
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def _response_result(workout, response, start):
+    error = None if response.status <= 299 else RuntimeError(f"upload failed: {response.status}")
+    return UploadResult(workout, response.status, response.json, error, time.perf_counter() - start)
+
+
+class UploadBatch:
+    """
+    Runs uploads on a thread pool and yields an UploadResult for each workout in
+    the order they finish. Failures are reported in the result rather than raised.
+
+    Only a few workouts per worker are pulled from the iterable at a time, so it
+    can be a generator. The counters and throughput are updated as results come in.
+    """
+
+    def __init__(self, upload, workouts, max_workers):
+        self._upload = upload
+        self._workouts = workouts
+        self.max_workers = max_workers
+        self.succeeded = 0
+        self.failed = 0
+        self.started = None
+        self.finished = None
+
+    @property
+    def completed(self):
+        return self.succeeded + self.failed
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def per_second(self):
+        return self.completed / self.elapsed if self.elapsed else 0
+
+    def __iter__(self):
+        self.started = time.perf_counter()
+        workouts = iter(self._workouts)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            pending = {pool.submit(self._upload, w) for w in islice(workouts, self.max_workers * 2)}
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                pending.update(pool.submit(self._upload, w) for w in islice(workouts, len(done)))
+
+                for future in done:
+                    result = future.result()
+                    if result.ok:
+                        self.succeeded += 1
+                    else:
+                        self.failed += 1
+                    yield result
+
+        self.finished = time.perf_counter()
 
 
 class GarminClient:
@@ -14,45 +114,88 @@ class GarminClient:
 
     Lots of details about the Workouts grokked from:
     https://github.com/mgif/quick-plan
+
+    sso_url and connect_url default to SSO_LOGIN_URL and CONNECT_URL.
+
+    If a cache_dir is provided the authenticated cookies are saved there (per username)
+    and reused by connect() until they are cache_ttl seconds old, or until Garmin
+    rejects them.
+
+    With a ledger (a fitlek.ledger.UploadLedger), uploaded workouts are recorded
+    under "garmin:<username>" and aren't uploaded again.
     """
 
-    def __init__(self, username, password):
+    def __init__(
+        self,
+        username,
+        password,
+        session=None,
+        cache_dir=None,
+        cache_ttl=SESSION_CACHE_TTL,
+        sso_url=None,
+        connect_url=None,
+        ledger=None,
+    ):
         self.username = username
         self.password = password
-        self.cookiejar = None
+        self.ledger = ledger
+        self.destination = f"garmin:{username}"
+        self.sso_url = sso_url or SSO_LOGIN_URL
+        self.workout_service_url = f"{connect_url or CONNECT_URL}/modern/proxy/workout-service"
+        # 429s and 503s are retried (with backoff) even for uploads, see Retry
+        self.session = session or Session(retry=Retry())
+        self.cookiejar = self.session.cookiejar
+        self.cache_dir = cache_dir
+        self.cache_ttl = cache_ttl
+        self._cached_session = False
+        self._auth_lock = threading.Lock()
+        self._auth_generation = 0
 
-    def connect(self):
-        self._authenticate()
+    def connect(self, probe=False):
+        """
+        Logs in, unless there's a recent cached session for this user. With probe=True
+        a cached session is checked with an extra request before it's used, otherwise
+        an expired session is only noticed (and replaced) when an upload is rejected.
+        """
+        if self._load_session() and (not probe or self.is_authenticated()):
+            self._cached_session = True
+        else:
+            self._authenticate()
 
-    def _authenticate(self):
-        form_data = {
-            "username": self.username,
-            "password": self.password,
-            "embed": "false",
+    def _probe_request(self):
+        return {
+            "url": f"{self.workout_service_url}/workouts",
+            "params": {"start": 0, "limit": 1},
+            "headers": WORKOUT_HEADERS,
+            "cookiejar": self.cookiejar,
+            "redirect": False,
         }
 
-        request_params = {"service": "https://connect.garmin.com/modern"}
-        headers = {
-            "origin": "https://sso.garmin.com",
-            "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:82.0) Gecko/20100101 Firefox/82.0",
-        }
+    def is_authenticated(self):
+        return self.session.request(**self._probe_request()).status == 200
 
-        auth_response = request(
-            SSO_LOGIN_URL,
-            headers=headers,
-            params=request_params,
-            data=form_data,
-            method="POST",
-        )
+    def _login_request(self):
+        return {
+            "url": self.sso_url,
+            "headers": SSO_HEADERS,
+            "params": {"service": "https://connect.garmin.com/modern"},
+            "data": {
+                "username": self.username,
+                "password": self.password,
+                "embed": "false",
+            },
+            "method": "POST",
+        }
 
+    def _auth_ticket_url(self, auth_response):
         self.cookiejar = auth_response.cookiejar
 
         if auth_response.status != 200:
             raise ValueError("authentication failure: did you enter valid credentials?")
 
-        auth_ticket_url = self._extract_auth_ticket_url(auth_response.content.decode())
-        response = request(auth_ticket_url, cookiejar=self.cookiejar, headers=headers)
+        return self._extract_auth_ticket_url(auth_response.content.decode())
 
+    def _claimed_auth_ticket(self, auth_ticket_url, response):
         if response.status != 200:
             raise RuntimeError(
                 "auth failure: failed to claim auth ticket: {}: {}\n{}".format(
@@ -60,9 +203,20 @@ class GarminClient:
                 )
             )
 
+        self._cached_session = False
+        self._auth_generation += 1
+        self._save_session()
+
+    def _authenticate(self):
+        self.cookiejar.clear()
+        auth_response = self.session.request(**self._login_request())
+        auth_ticket_url = self._auth_ticket_url(auth_response)
+        response = self.session.request(auth_ticket_url, cookiejar=self.cookiejar, headers=SSO_HEADERS)
+        self._claimed_auth_ticket(auth_ticket_url, response)
+
     @staticmethod
     def _extract_auth_ticket_url(auth_response):
-        match = re.search(r'response_url\s*=\s*"(https:[^"]+)"', auth_response)
+        match = re.search(r'response_url\s*=\s*"(https?:[^"]+)"', auth_response)
         if not match:
             raise RuntimeError(
                 "auth failure: unable to extract auth ticket URL. did you provide a correct username/password?"
@@ -70,20 +224,375 @@ class GarminClient:
         auth_ticket_url = match.group(1).replace("\\", "")
         return auth_ticket_url
 
-    def add_workout(self, workout):
-        response = request(
-            "https://connect.garmin.com/modern/proxy/workout-service/workout",
-            method="POST",
-            json=workout.garminconnect_json(),
-            headers={
-                "Referer": "https://connect.garmin.com/modern/workout/create/running",
-                "NK": "NT",
-                "X-app-ver": "4.38.2.0",
-                "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:82.0) Gecko/20100101 Firefox/82.0",
+    def _session_cache_path(self):
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, hashlib.sha256(self.username.encode()).hexdigest() + ".lwp")
+
+    def _load_session(self):
+        path = self._session_cache_path()
+        if not path:
+            return False
+
+        jar = LWPCookieJar()
+        try:
+            if time.time() - os.path.getmtime(path) > self.cache_ttl:
+                return False
+            jar.load(path, ignore_discard=True, ignore_expires=True)
+        except (OSError, LoadError):
+            return False
+
+        for cookie in jar:
+            self.cookiejar.set_cookie(cookie)
+        return True
+
+    def _save_session(self):
+        path = self._session_cache_path()
+        if not path:
+            return
+
+        jar = LWPCookieJar()
+        for cookie in self.cookiejar:
+            jar.set_cookie(cookie)
+
+        # the cookies are as good as a password, keep them private
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+            f.write("#LWP-Cookies-2.0\n")
+            f.write(jar.as_lwp_str(ignore_discard=True, ignore_expires=True))
+        os.replace(tmp_path, path)
+
+    def _workout_request(self, workout):
+        return {
+            "url": f"{self.workout_service_url}/workout",
+            "method": "POST",
+            "json": workout.garminconnect_json(),
+            "headers": WORKOUT_HEADERS,
+            "cookiejar": self.cookiejar,
+        }
+
+    def _list_request(self, start, limit):
+        return {
+            "url": f"{self.workout_service_url}/workouts",
+            # newest changes first, see list_workouts()
+            "params": {
+                "start": start,
+                "limit": limit,
+                "myWorkoutsOnly": "true",
+                "orderBy": "UPDATE_DATE",
+                "orderSeq": "DESC",
             },
-            cookiejar=self.cookiejar,
+            "headers": WORKOUT_HEADERS,
+            "cookiejar": self.cookiejar,
+        }
+
+    def _delete_request(self, workout_id):
+        return {
+            "url": f"{self.workout_service_url}/workout/{workout_id}",
+            "method": "DELETE",
+            "headers": WORKOUT_HEADERS,
+            "cookiejar": self.cookiejar,
+        }
+
+    def _request(self, build_request, *args):
+        # build_request(*args) is called again for the retry, so that it picks up the new cookies
+        generation, cached = self._auth_generation, self._cached_session
+        response = self.session.request(**build_request(*args))
+
+        if response.status in (401, 403) and cached:
+            # the cached session has expired, log in again (unless another thread already has) and retry
+            with self._auth_lock:
+                if generation == self._auth_generation:
+                    self._authenticate()
+            response = self.session.request(**build_request(*args))
+
+        return response
+
+    def _upload(self, workout):
+        return self._request(self._workout_request, workout)
+
+    def _upload_result(self, workout):
+        start = time.perf_counter()
+        try:
+            response = self._upload(workout)
+        except Exception as e:
+            return UploadResult(workout, None, None, e, time.perf_counter() - start)
+
+        return _response_result(workout, response, start)
+
+    def _record(self, content_hash, created):
+        if created and created.get("workoutId") is not None:
+            self.ledger.record(self.destination, content_hash, created["workoutId"])
+
+    def _ledger_items(self, workouts):
+        # (workout, content_hash, remote_id) for each workout, remote_id is None unless
+        # it's been uploaded before. The ledger is checked for many workouts at a time.
+        workouts = iter(workouts)
+        while chunk := list(islice(workouts, LOOKUP_CHUNK_SIZE)):
+            hashes = [workout.content_hash() for workout in chunk]
+            uploaded = self.ledger.lookup(self.destination, hashes)
+            for workout, content_hash in zip(chunk, hashes):
+                yield workout, content_hash, uploaded.get(content_hash)
+
+    def _ledger_upload_result(self, item):
+        workout, content_hash, remote_id = item
+        if remote_id is not None:
+            return UploadResult(workout, None, {"workoutId": remote_id}, None, 0, True)
+
+        result = self._upload_result(workout)
+        if result.ok:
+            self._record(content_hash, result.json)
+        return result
+
+    def upload(self, workout):
+        """
+        Uploads a single workout and returns its UploadResult, like add_workouts()
+        but without a thread pool.
+        """
+        if self.ledger:
+            content_hash = workout.content_hash()
+            return self._ledger_upload_result((workout, content_hash, self.ledger.get(self.destination, content_hash)))
+        return self._upload_result(workout)
+
+    def add_workout(self, workout):
+        """
+        Returns the created workout. With a ledger, a workout that has been uploaded
+        before isn't uploaded again and {"workoutId": <its id>} is returned.
+        """
+        if self.ledger:
+            content_hash = workout.content_hash()
+            remote_id = self.ledger.get(self.destination, content_hash)
+            if remote_id is not None:
+                return {"workoutId": remote_id}
+
+        response = self._upload(workout)
+
+        if response.status > 299:
+            print(response)
+        elif self.ledger:
+            self._record(content_hash, response.json)
+        return response.json
+
+    def list_workouts(self, start=0, limit=100):
+        """
+        Returns a page of the account's workouts, most recently updated first. These
+        are summaries (workoutId, workoutName, updateDate, ...) without the steps.
+        """
+        response = self._request(self._list_request, start, limit)
+        if response.status != 200:
+            raise RuntimeError(f"listing workouts failed: {response.status}")
+        return response.json
+
+    def iter_workouts(self, page_size=100):
+        """
+        Yields every workout in the account (see list_workouts), fetching a page at a
+        time. Stop iterating early to avoid fetching the rest.
+        """
+        start = 0
+        while True:
+            page = self.list_workouts(start, page_size)
+            yield from page
+            if len(page) < page_size:
+                return
+            start += page_size
+
+    def _delete_result(self, workout_id):
+        start = time.perf_counter()
+        try:
+            response = self._request(self._delete_request, workout_id)
+        except Exception as e:
+            return UploadResult(workout_id, None, None, e, time.perf_counter() - start)
+
+        # a workout that's already gone is as good as deleted
+        gone = response.status <= 299 or response.status == 404
+        error = None if gone else RuntimeError(f"delete failed: {response.status}")
+        return UploadResult(workout_id, response.status, None, error, time.perf_counter() - start)
+
+    def delete_workout(self, workout_id):
+        result = self._delete_result(workout_id)
+        if result.error:
+            raise result.error
+
+    def delete_workouts(self, workout_ids, max_workers=4):
+        """
+        Deletes many workouts concurrently, returning an UploadBatch whose results
+        have the workout id in place of the workout.
+        """
+        return UploadBatch(self._delete_result, workout_ids, max_workers)
+
+    def add_workouts(self, workouts, max_workers=4):
+        """
+        Uploads many workouts concurrently over this client's session, see UploadBatch:
+
+            batch = client.add_workouts(workouts, max_workers=8)
+            for result in batch:
+                ...
+            print(batch.per_second)
+        """
+        if self.ledger:
+            return UploadBatch(self._ledger_upload_result, self._ledger_items(workouts), max_workers)
+        return UploadBatch(self._upload_result, workouts, max_workers)
+
+
+class AsyncGarminClient(GarminClient):
+    """
+    The same as GarminClient, but for use with asyncio. The session (if provided)
+    should be an athttp.AsyncSession.
+    """
+
+    def __init__(
+        self,
+        username,
+        password,
+        session=None,
+        cache_dir=None,
+        cache_ttl=SESSION_CACHE_TTL,
+        sso_url=None,
+        connect_url=None,
+        ledger=None,
+    ):
+        super().__init__(
+            username,
+            password,
+            session or AsyncSession(retry=Retry()),
+            cache_dir=cache_dir,
+            cache_ttl=cache_ttl,
+            sso_url=sso_url,
+            connect_url=connect_url,
+            ledger=ledger,
         )
+        self._auth_lock = asyncio.Lock()
+
+    async def connect(self, probe=False):
+        if self._load_session() and (not probe or await self.is_authenticated()):
+            self._cached_session = True
+        else:
+            await self._authenticate()
+
+    async def is_authenticated(self):
+        return (await self.session.request(**self._probe_request())).status == 200
+
+    async def _authenticate(self):
+        self.cookiejar.clear()
+        auth_response = await self.session.request(**self._login_request())
+        auth_ticket_url = self._auth_ticket_url(auth_response)
+        response = await self.session.request(auth_ticket_url, cookiejar=self.cookiejar, headers=SSO_HEADERS)
+        self._claimed_auth_ticket(auth_ticket_url, response)
+
+    async def _request(self, build_request, *args):
+        generation, cached = self._auth_generation, self._cached_session
+        response = await self.session.request(**build_request(*args))
+
+        if response.status in (401, 403) and cached:
+            async with self._auth_lock:
+                if generation == self._auth_generation:
+                    await self._authenticate()
+            response = await self.session.request(**build_request(*args))
+
+        return response
+
+    async def _upload(self, workout):
+        return await self._request(self._workout_request, workout)
+
+    async def _upload_result(self, workout):
+        start = time.perf_counter()
+        try:
+            response = await self._upload(workout)
+        except Exception as e:
+            return UploadResult(workout, None, None, e, time.perf_counter() - start)
+
+        return _response_result(workout, response, start)
+
+    async def _ledger_upload_result(self, item):
+        workout, content_hash, remote_id = item
+        if remote_id is not None:
+            return UploadResult(workout, None, {"workoutId": remote_id}, None, 0, True)
+
+        result = await self._upload_result(workout)
+        if result.ok:
+            self._record(content_hash, result.json)
+        return result
+
+    async def upload(self, workout):
+        if self.ledger:
+            content_hash = workout.content_hash()
+            item = (workout, content_hash, self.ledger.get(self.destination, content_hash))
+            return await self._ledger_upload_result(item)
+        return await self._upload_result(workout)
+
+    async def add_workout(self, workout):
+        if self.ledger:
+            content_hash = workout.content_hash()
+            remote_id = self.ledger.get(self.destination, content_hash)
+            if remote_id is not None:
+                return {"workoutId": remote_id}
+
+        response = await self._upload(workout)
 
         if response.status > 299:
             print(response)
+        elif self.ledger:
+            self._record(content_hash, response.json)
         return response.json
+
+    async def list_workouts(self, start=0, limit=100):
+        response = await self._request(self._list_request, start, limit)
+        if response.status != 200:
+            raise RuntimeError(f"listing workouts failed: {response.status}")
+        return response.json
+
+    async def iter_workouts(self, page_size=100):
+        start = 0
+        while True:
+            page = await self.list_workouts(start, page_size)
+            for workout in page:
+                yield workout
+            if len(page) < page_size:
+                return
+            start += page_size
+
+    async def _delete_result(self, workout_id):
+        start = time.perf_counter()
+        try:
+            response = await self._request(self._delete_request, workout_id)
+        except Exception as e:
+            return UploadResult(workout_id, None, None, e, time.perf_counter() - start)
+
+        gone = response.status <= 299 or response.status == 404
+        error = None if gone else RuntimeError(f"delete failed: {response.status}")
+        return UploadResult(workout_id, response.status, None, error, time.perf_counter() - start)
+
+    async def delete_workout(self, workout_id):
+        result = await self._delete_result(workout_id)
+        if result.error:
+            raise result.error
+
+    @staticmethod
+    async def _as_completed(run, items, max_workers):
+        # yields run(item) for each of items as they finish, with at most max_workers running at a time
+        items = iter(items)
+        pending = {asyncio.ensure_future(run(item)) for item in islice(items, max_workers)}
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            pending.update(asyncio.ensure_future(run(item)) for item in islice(items, len(done)))
+
+            for task in done:
+                yield task.result()
+
+    def delete_workouts(self, workout_ids, max_workers=4):
+        """
+        Yields an UploadResult (with the workout id in place of the workout) for
+        each workout as it's deleted, with at most max_workers deletes in flight.
+        """
+        return self._as_completed(self._delete_result, workout_ids, max_workers)
+
+    def add_workouts(self, workouts, max_workers=4):
+        """
+        Yields an UploadResult for each workout as it finishes, with at most
+        max_workers uploads in flight at a time.
+        """
+        if self.ledger:
+            return self._as_completed(self._ledger_upload_result, self._ledger_items(workouts), max_workers)
+        return self._as_completed(self._upload_result, workouts, max_workers)
@@ -1,9 +1,11 @@
-from .thttp import request
+import os
 
-GETFIT_URL = "https://getfitfile.azurewebsites.net/api/getfitfromjson"
+from .thttp import download_to, request
 
+GETFIT_URL = os.environ.get("FITLEK_GETFIT_URL", "https://getfitfile.azurewebsites.net/api/getfitfromjson")
 
-def getfit_download(workout_name, workout, save=True):
+
+def getfit_download(workout_name, workout, save=True, url=None, path="fitlek.fit"):
     j = {
         "name": workout_name,
         "steps": [
@@ -17,12 +19,15 @@ def getfit_download(workout_name, workout, save=True):
         ],
     }
 
-    response = request(GETFIT_URL, json=j, method="POST")
+    if save:
+        # written straight to disk (at path), rather than held in memory first
+        response = download_to(path, url or GETFIT_URL, json=j, method="POST")
+        if response.status != 200:
+            print(response.content)
+        return
+
+    response = request(url or GETFIT_URL, json=j, method="POST")
     if response.status == 200:
-        if save:
-            with open("fitlek.fit", "wb") as f:
-                f.write(response.content)
-        else:
-            return response.content
+        return response.content
     else:
         print(response.content)
@@ -1,112 +1,357 @@
-from .thttp import request
+import os
+import threading
+import time
+from functools import partial
+from itertools import islice
 
+from . import athttp
+from .exporters import intervals_step
+from .ledger import LOOKUP_CHUNK_SIZE
+from .thttp import Retry, request
 
-def upload_str_to_intervals(workout_str, workout_name, athlete_id, api_key, folder_name="Run Randomly"):
-    f"https://intervals.icu/api/v1/athlete/{athlete_id}/folders"
+INTERVALS_URL = os.environ.get("FITLEK_INTERVALS_URL", "https://intervals.icu/api/v1")
+FOLDER_CACHE_TTL = 60 * 60
 
-    # check to see if the Run Randomly folder already exists
-    response = request(
-        f"https://intervals.icu/api/v1/athlete/{athlete_id}/folders",
-        headers={
+# (base_url, athlete_id, folder_name) -> (folder_id, expiry), shared by all uploaders in this process
+_folder_cache = {}
+_folder_cache_lock = threading.Lock()
+
+
+def workout_description(workout):
+    return "".join(map(intervals_step, workout.workout_steps))
+
+
+def _folders_request(base_url, athlete_id, api_key):
+    return {
+        "url": f"{base_url}/athlete/{athlete_id}/folders",
+        "headers": {
             "Authorization": f"Bearer {api_key}",
         },
-    )
+    }
 
-    folders = [x for x in response.json if x["name"] == folder_name and x["type"] == "FOLDER"]
 
-    # create a folder if it doesn't exist
-    if not folders:
-        response = request(
-            f"https://intervals.icu/api/v1/athlete/{athlete_id}/folders",
-            json={"name": folder_name, "type": "FOLDER"},
-            method="post",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-            },
-        )
-        print(response.json)
-        folder = response.json
-    else:
-        folder = folders[0]
-
-    # upload our workout to that folder
-    response = request(
-        f"https://intervals.icu/api/v1/athlete/{athlete_id}/workouts",
-        method="post",
-        json=[
-            {
-                "description": workout_str,
-                "folder_id": folder["id"],
-                "indoor": False,
-                "name": workout_name,
-                "type": "Run",
-            }
-        ],
-        headers={
+def _create_folder_request(base_url, athlete_id, api_key, folder_name):
+    return {
+        "url": f"{base_url}/athlete/{athlete_id}/folders",
+        "json": {"name": folder_name, "type": "FOLDER"},
+        "method": "post",
+        "headers": {
             "Authorization": f"Bearer {api_key}",
         },
-    )
+    }
 
-    return response.json
 
+def _find_folder(response, folder_name):
+    folders = [x for x in response.json if x["name"] == folder_name and x["type"] == "FOLDER"]
+    return folders[0] if folders else None
 
-def upload_to_intervals(workout, athlete_id, api_key, folder_name="Run Randomly"):
-    f"https://intervals.icu/api/v1/athlete/{athlete_id}/folders"
 
+def _get_or_create_folder(http, base_url, athlete_id, api_key, folder_name):
     # check to see if the Run Randomly folder already exists
-    response = request(
-        f"https://intervals.icu/api/v1/athlete/{athlete_id}/folders",
-        headers={
-            "Authorization": f"Bearer {api_key}",
-        },
-    )
-
-    folders = [x for x in response.json if x["name"] == folder_name and x["type"] == "FOLDER"]
+    folder = _find_folder(http(**_folders_request(base_url, athlete_id, api_key)), folder_name)
 
     # create a folder if it doesn't exist
-    if not folders:
-        response = request(
-            f"https://intervals.icu/api/v1/athlete/{athlete_id}/folders",
-            json={"name": folder_name, "type": "FOLDER"},
-            method="post",
-            headers={
-                "Authorization": f"Bearer {api_key}",
+    if not folder:
+        folder = http(**_create_folder_request(base_url, athlete_id, api_key, folder_name)).json
+
+    return folder
+
+
+async def _async_get_or_create_folder(http, base_url, athlete_id, api_key, folder_name):
+    folder = _find_folder(await http(**_folders_request(base_url, athlete_id, api_key)), folder_name)
+
+    if not folder:
+        folder = (await http(**_create_folder_request(base_url, athlete_id, api_key, folder_name))).json
+
+    return folder
+
+
+class IntervalsUploader:
+    """
+    Uploads workouts to a folder in an athlete's intervals.icu library.
+
+    The folder id is looked up (or the folder created) once and cached for
+    folder_ttl seconds. Many workouts can be uploaded with a single request per
+    chunk_size workouts, if the folder has been deleted in the meantime it's
+    looked up again and the upload retried.
+
+    base_url defaults to INTERVALS_URL. Failed requests are retried according to
+    retry (a thttp.Retry), by default 429s and 503s are retried for uploads and
+    any server error for folder lookups.
+
+    With a ledger (a fitlek.ledger.UploadLedger), uploaded workouts are recorded
+    under "intervals:<athlete_id>" and upload() / upload_many() don't upload them
+    again, returning {"id": <its id>} in place of the created workout.
+    """
+
+    def __init__(
+        self,
+        athlete_id,
+        api_key,
+        folder_name="Run Randomly",
+        session=None,
+        folder_ttl=FOLDER_CACHE_TTL,
+        chunk_size=50,
+        base_url=None,
+        retry=None,
+        ledger=None,
+    ):
+        self.athlete_id = athlete_id
+        self.api_key = api_key
+        self.ledger = ledger
+        self.destination = f"intervals:{athlete_id}"
+        self.folder_name = folder_name
+        self.folder_ttl = folder_ttl
+        self.chunk_size = chunk_size
+        self.base_url = base_url or INTERVALS_URL
+        self.retry = retry or Retry()
+        self.http = partial(session.request if session else request, retry=self.retry)
+
+    def _cached_folder_id(self):
+        with _folder_cache_lock:
+            folder_id, expires = _folder_cache.get((self.base_url, self.athlete_id, self.folder_name), (None, 0))
+        return folder_id if expires > time.monotonic() else None
+
+    def _cache_folder(self, folder):
+        with _folder_cache_lock:
+            key = (self.base_url, self.athlete_id, self.folder_name)
+            _folder_cache[key] = (folder["id"], time.monotonic() + self.folder_ttl)
+        return folder["id"]
+
+    def folder_id(self, refresh=False):
+        folder_id = None if refresh else self._cached_folder_id()
+        if folder_id is None:
+            folder = _get_or_create_folder(self.http, self.base_url, self.athlete_id, self.api_key, self.folder_name)
+            folder_id = self._cache_folder(folder)
+        return folder_id
+
+    def _workouts_request(self, workouts, folder_id):
+        return {
+            "url": f"{self.base_url}/athlete/{self.athlete_id}/workouts",
+            "method": "post",
+            "json": [
+                {
+                    "description": workout_str,
+                    "folder_id": folder_id,
+                    "indoor": False,
+                    "name": workout_name,
+                    "type": "Run",
+                }
+                for workout_str, workout_name in workouts
+            ],
+            "headers": {
+                "Authorization": f"Bearer {self.api_key}",
             },
+        }
+
+    @staticmethod
+    def _folder_rejected(response):
+        # the cached folder may have been deleted
+        return 400 <= response.status < 500 and response.status not in (401, 403, 429)
+
+    def _upload(self, workouts):
+        folder_id = self.folder_id()
+        response = self.http(**self._workouts_request(workouts, folder_id))
+
+        if self._folder_rejected(response):
+            new_folder_id = self.folder_id(refresh=True)
+            if new_folder_id != folder_id:
+                response = self.http(**self._workouts_request(workouts, new_folder_id))
+
+        return response
+
+    def upload_str(self, workout_str, workout_name):
+        return self._upload([(workout_str, workout_name)]).json
+
+    def _uploaded(self, content_hash):
+        remote_id = self.ledger.get(self.destination, content_hash)
+        return None if remote_id is None else [{"id": remote_id}]
+
+    def _record(self, content_hashes, response):
+        if response.status < 300:
+            self.ledger.record_many(self.destination, zip(content_hashes, (w["id"] for w in response.json)))
+
+    def _ledger_chunks(self, workouts):
+        # yields (content_hashes, uploaded, new) for LOOKUP_CHUNK_SIZE workouts at a time, where uploaded
+        # is {content_hash: {"id": remote_id}} for those in the ledger and new is {content_hash: workout}
+        # for the rest (each distinct workout once)
+        workouts = iter(workouts)
+        while chunk := list(islice(workouts, LOOKUP_CHUNK_SIZE)):
+            hashes = [workout.content_hash() for workout in chunk]
+            uploaded = {h: {"id": remote_id} for h, remote_id in self.ledger.lookup(self.destination, hashes).items()}
+            new = {h: workout for h, workout in zip(hashes, chunk) if h not in uploaded}
+            yield hashes, uploaded, new
+
+    def _new_chunks(self, new):
+        items = list(new.items())
+        for i in range(0, len(items), self.chunk_size):
+            chunk = items[i : i + self.chunk_size]
+            yield [h for h, _ in chunk], [(workout_description(w), w.workout_name) for _, w in chunk]
+
+    def upload(self, workout):
+        if not self.ledger:
+            return self.upload_str(workout_description(workout), workout.workout_name)
+
+        content_hash = workout.content_hash()
+        uploaded = self._uploaded(content_hash)
+        if uploaded:
+            return uploaded
+
+        response = self._upload([(workout_description(workout), workout.workout_name)])
+        self._record([content_hash], response)
+        return response.json
+
+    def upload_strs(self, workouts):
+        """
+        Uploads an iterable of (workout_str, workout_name) pairs, chunk_size at a time,
+        and returns the list of created workouts.
+        """
+        workouts = iter(workouts)
+        created = []
+
+        while chunk := list(islice(workouts, self.chunk_size)):
+            response = self._upload(chunk)
+            if response.status > 299:
+                raise RuntimeError(f"intervals.icu upload failed: {response.status}: {response.content}")
+            created.extend(response.json)
+
+        return created
+
+    def upload_many(self, workouts):
+        if not self.ledger:
+            return self.upload_strs((workout_description(w), w.workout_name) for w in workouts)
+
+        created = []
+        for hashes, uploaded, new in self._ledger_chunks(workouts):
+            for new_hashes, chunk in self._new_chunks(new):
+                response = self._upload(chunk)
+                if response.status > 299:
+                    raise RuntimeError(f"intervals.icu upload failed: {response.status}: {response.content}")
+                self._record(new_hashes, response)
+                uploaded.update(zip(new_hashes, response.json))
+            created.extend(uploaded[h] for h in hashes)
+
+        return created
+
+
+def upload_str_to_intervals(workout_str, workout_name, athlete_id, api_key, folder_name="Run Randomly", session=None):
+    return IntervalsUploader(athlete_id, api_key, folder_name=folder_name, session=session).upload_str(
+        workout_str, workout_name
+    )
+
+
+def upload_to_intervals(workout, athlete_id, api_key, folder_name="Run Randomly", session=None, ledger=None):
+    return IntervalsUploader(athlete_id, api_key, folder_name=folder_name, session=session, ledger=ledger).upload(
+        workout
+    )
+
+
+class AsyncIntervalsUploader(IntervalsUploader):
+    """
+    The same as IntervalsUploader, but for use with asyncio. The session (if
+    provided) should be an athttp.AsyncSession.
+    """
+
+    def __init__(
+        self,
+        athlete_id,
+        api_key,
+        folder_name="Run Randomly",
+        session=None,
+        folder_ttl=FOLDER_CACHE_TTL,
+        chunk_size=50,
+        base_url=None,
+        retry=None,
+        ledger=None,
+    ):
+        super().__init__(
+            athlete_id,
+            api_key,
+            folder_name=folder_name,
+            folder_ttl=folder_ttl,
+            chunk_size=chunk_size,
+            base_url=base_url,
+            retry=retry,
+            ledger=ledger,
         )
-        print(response.json)
-        folder = response.json
-    else:
-        folder = folders[0]
-
-    # create the workout string
-    workout_str = ""
-    paces = {
-        "warmup": "60-80%",
-        "interval": "90-120%",
-        "recovery": "60-90%",
-        "cooldown": "60-80%",
-    }
+        self.http = partial(session.request if session else athttp.request, retry=self.retry)
 
-    for step in workout.workout_steps:
-        workout_str += step.step_type + "\n"
-        workout_str += f"- {step.end_condition_value.replace(':', 'm')}s {paces[step.step_type]} Pace\n\n"
-
-    # upload our workout to that folder
-    response = request(
-        f"https://intervals.icu/api/v1/athlete/{athlete_id}/workouts",
-        method="post",
-        json=[
-            {
-                "description": workout_str,
-                "folder_id": folder["id"],
-                "indoor": False,
-                "name": workout.workout_name,
-                "type": "Run",
-            }
-        ],
-        headers={
-            "Authorization": f"Bearer {api_key}",
-        },
+    async def folder_id(self, refresh=False):
+        folder_id = None if refresh else self._cached_folder_id()
+        if folder_id is None:
+            folder = await _async_get_or_create_folder(
+                self.http, self.base_url, self.athlete_id, self.api_key, self.folder_name
+            )
+            folder_id = self._cache_folder(folder)
+        return folder_id
+
+    async def _upload(self, workouts):
+        folder_id = await self.folder_id()
+        response = await self.http(**self._workouts_request(workouts, folder_id))
+
+        if self._folder_rejected(response):
+            new_folder_id = await self.folder_id(refresh=True)
+            if new_folder_id != folder_id:
+                response = await self.http(**self._workouts_request(workouts, new_folder_id))
+
+        return response
+
+    async def upload_str(self, workout_str, workout_name):
+        return (await self._upload([(workout_str, workout_name)])).json
+
+    async def upload(self, workout):
+        if not self.ledger:
+            return await self.upload_str(workout_description(workout), workout.workout_name)
+
+        content_hash = workout.content_hash()
+        uploaded = self._uploaded(content_hash)
+        if uploaded:
+            return uploaded
+
+        response = await self._upload([(workout_description(workout), workout.workout_name)])
+        self._record([content_hash], response)
+        return response.json
+
+    async def upload_strs(self, workouts):
+        workouts = iter(workouts)
+        created = []
+
+        while chunk := list(islice(workouts, self.chunk_size)):
+            response = await self._upload(chunk)
+            if response.status > 299:
+                raise RuntimeError(f"intervals.icu upload failed: {response.status}: {response.content}")
+            created.extend(response.json)
+
+        return created
+
+    async def upload_many(self, workouts):
+        if not self.ledger:
+            return await self.upload_strs((workout_description(w), w.workout_name) for w in workouts)
+
+        created = []
+        for hashes, uploaded, new in self._ledger_chunks(workouts):
+            for new_hashes, chunk in self._new_chunks(new):
+                response = await self._upload(chunk)
+                if response.status > 299:
+                    raise RuntimeError(f"intervals.icu upload failed: {response.status}: {response.content}")
+                self._record(new_hashes, response)
+                uploaded.update(zip(new_hashes, response.json))
+            created.extend(uploaded[h] for h in hashes)
+
+        return created
+
+
+async def async_upload_str_to_intervals(
+    workout_str, workout_name, athlete_id, api_key, folder_name="Run Randomly", session=None
+):
+    return await AsyncIntervalsUploader(athlete_id, api_key, folder_name=folder_name, session=session).upload_str(
+        workout_str, workout_name
     )
 
-    return response.json
+
+async def async_upload_to_intervals(
+    workout, athlete_id, api_key, folder_name="Run Randomly", session=None, ledger=None
+):
+    return await AsyncIntervalsUploader(
+        athlete_id, api_key, folder_name=folder_name, session=session, ledger=ledger
+    ).upload(workout)
@@ -0,0 +1,90 @@
+"""
+Writes workouts as Garmin Connect JSON one step at a time, so that a plan of
+hundreds of workouts can be exported without building the whole document (or
+the whole encoded string) in memory first.
+
+The output is the same as json.dumps(workout.garminconnect_json(), indent=indent).
+"""
+
+import json
+
+from .workout import Workout
+
+STEPS_MARKER = "\x00workoutSteps\x00"
+
+
+def _skeleton(workout, encoder):
+    # everything but the steps, split around where the steps should go
+    skeleton = Workout(workout.sport_type, workout.workout_name).garminconnect_json()
+    skeleton["workoutSegments"][0]["workoutSteps"] = STEPS_MARKER
+    head, _, tail = encoder.encode(skeleton).rpartition(encoder.encode(STEPS_MARKER))
+    return head, tail
+
+
+def _write_workout(workout, write, encoder, prefix=""):
+    head, tail = _skeleton(workout, encoder)
+    newline = "\n" + prefix
+    write(head.replace("\n", newline))
+
+    if not workout.workout_steps:
+        write("[]")
+    elif encoder.indent is None:
+        write("[")
+        for i, step in enumerate(workout.workout_steps):
+            if i:
+                write(", ")
+            write(encoder.encode(step.garminconnect_json()))
+        write("]")
+    else:
+        line = head.rpartition("\n")[2]
+        step_newline = newline + line[: len(line) - len(line.lstrip())] + encoder.indent
+        write("[")
+        for i, step in enumerate(workout.workout_steps):
+            write("," + step_newline if i else step_newline)
+            write(encoder.encode(step.garminconnect_json()).replace("\n", step_newline))
+        write(step_newline[: len(step_newline) - len(encoder.indent)] + "]")
+
+    write(tail.replace("\n", newline))
+
+
+def _encoder(indent):
+    if isinstance(indent, int):
+        indent = " " * indent
+    return json.JSONEncoder(indent=indent)
+
+
+def dump_workout(workout, f, indent=None):
+    _write_workout(workout, f.write, _encoder(indent))
+
+
+def dump_workouts(workouts, f, indent=None):
+    """
+    Writes an iterable of workouts as a JSON array. Workouts are only pulled from
+    the iterable as they're written, so it can be a generator.
+    """
+    encoder = _encoder(indent)
+    write = f.write
+    write("[")
+
+    empty = True
+    for workout in workouts:
+        if encoder.indent is None:
+            write(", " if not empty else "")
+            _write_workout(workout, write, encoder)
+        else:
+            write(",\n" + encoder.indent if not empty else "\n" + encoder.indent)
+            _write_workout(workout, write, encoder, prefix=encoder.indent)
+        empty = False
+
+    write("]" if empty or encoder.indent is None else "\n]")
+
+
+def dump_workouts_jsonl(workouts, f):
+    """
+    Writes each workout as compact JSON on its own line (JSON Lines).
+    """
+    encoder = _encoder(None)
+    write = f.write
+    for workout in workouts:
+        _write_workout(workout, write, encoder)
+        write("\n")
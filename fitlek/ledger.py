@@ -0,0 +1,127 @@
+"""
+A local record of which workouts have already been uploaded where, so that a
+re-run batch job doesn't post them again.
+
+Workouts are identified by Workout.content_hash() and destinations by a string
+like "garmin:<username>" or "intervals:<athlete_id>":
+
+    with UploadLedger() as ledger:
+        client = GarminClient(username, password, ledger=ledger)
+        client.add_workouts(workouts)  # skips anything uploaded by a previous run
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_LEDGER_PATH = os.path.join(
+    os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share"), "fitlek", "uploads.sqlite3"
+)
+
+# SQLite limits the number of parameters in a query, lookups are split into chunks of this many
+LOOKUP_CHUNK_SIZE = 500
+
+# formatted with a "?" placeholder for each content hash in a chunk, the hashes themselves are parameters
+LOOKUP_QUERY = "SELECT content_hash, remote_id FROM uploads WHERE destination = ? AND content_hash IN ({})"
+
+
+class UploadLedger:
+    """
+    Maps (destination, content hash) to the id the destination gave the workout,
+    in a SQLite database at path (":memory:" for one that isn't kept). A ledger
+    can be shared between threads, and between processes through the file.
+    """
+
+    def __init__(self, path=DEFAULT_LEDGER_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        # remote_id has no type, so ids are returned as they were recorded (int or str)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS uploads ("
+            "destination TEXT NOT NULL, content_hash TEXT NOT NULL, remote_id, uploaded_at REAL NOT NULL, "
+            "PRIMARY KEY (destination, content_hash)) WITHOUT ROWID"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS uploads_remote_id ON uploads (destination, remote_id)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def get(self, destination, content_hash):
+        """
+        Returns the remote id of the workout, or None if it hasn't been uploaded to destination.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT remote_id FROM uploads WHERE destination = ? AND content_hash = ?",
+                (destination, content_hash),
+            ).fetchone()
+        return row[0] if row else None
+
+    def lookup(self, destination, content_hashes):
+        """
+        Returns {content_hash: remote_id} for those of content_hashes that have been
+        uploaded to destination.
+        """
+        content_hashes = list(dict.fromkeys(content_hashes))
+        found = {}
+
+        with self._lock:
+            for i in range(0, len(content_hashes), LOOKUP_CHUNK_SIZE):
+                chunk = content_hashes[i : i + LOOKUP_CHUNK_SIZE]
+                query = LOOKUP_QUERY.format(", ".join("?" * len(chunk)))
+                found.update(self._db.execute(query, [destination, *chunk]))
+
+        return found
+
+    def record(self, destination, content_hash, remote_id):
+        self.record_many(destination, [(content_hash, remote_id)])
+
+    def record_many(self, destination, uploads):
+        """
+        Records an iterable of (content_hash, remote_id) pairs, in a single transaction.
+        """
+        now = time.time()
+        rows = [(destination, content_hash, remote_id, now) for content_hash, remote_id in uploads]
+
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany("INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?)", rows)
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def forget(self, destination, content_hashes):
+        """
+        Removes workouts from the ledger (e.g. once they've been deleted remotely).
+        """
+        with self._lock:
+            self._db.executemany(
+                "DELETE FROM uploads WHERE destination = ? AND content_hash = ?",
+                [(destination, content_hash) for content_hash in content_hashes],
+            )
+
+    def forget_remote_ids(self, destination, remote_ids):
+        """
+        Removes workouts from the ledger by the ids the destination gave them.
+        """
+        with self._lock:
+            self._db.executemany(
+                "DELETE FROM uploads WHERE destination = ? AND remote_id = ?",
+                [(destination, remote_id) for remote_id in remote_ids],
+            )
@@ -0,0 +1,77 @@
+import random
+
+from .fartlek import create_fartlek_workout
+from .utils import mmss_to_seconds, seconds_to_mmss
+
+
+class TrainingPlan:
+    """
+    A multi-week plan of fartlek runs.
+
+    Run durations and target paces progress linearly from the first week to the
+    last (durations are rounded to the minute, paces to the second). Workouts are
+    generated lazily when iterating over the plan, and each one is seeded from the
+    plan's seed and its index, so plan[i] always gives back the same workout without
+    generating the ones before it.
+
+        plan = TrainingPlan(12, 3, "30:00", "05:00", end_duration="50:00", end_pace="04:30", seed=1)
+        for workout in plan:
+            ...
+    """
+
+    def __init__(
+        self,
+        weeks,
+        runs_per_week,
+        start_duration,
+        start_pace,
+        end_duration=None,
+        end_pace=None,
+        seed=None,
+        name="Fitlek",
+    ):
+        self.weeks = weeks
+        self.runs_per_week = runs_per_week
+        self.start_duration = mmss_to_seconds(start_duration)
+        self.end_duration = mmss_to_seconds(end_duration or start_duration)
+        self.start_pace = mmss_to_seconds(start_pace)
+        self.end_pace = mmss_to_seconds(end_pace or start_pace)
+        self.seed = seed if seed is not None else random.getrandbits(64)
+        self.name = name
+
+    def __len__(self):
+        return self.weeks * self.runs_per_week
+
+    def _progress(self, index):
+        week = index // self.runs_per_week
+        return week / (self.weeks - 1) if self.weeks > 1 else 0
+
+    def duration(self, index):
+        seconds = self.start_duration + (self.end_duration - self.start_duration) * self._progress(index)
+        return seconds_to_mmss(round(seconds / 60) * 60)
+
+    def pace(self, index):
+        seconds = self.start_pace + (self.end_pace - self.start_pace) * self._progress(index)
+        return seconds_to_mmss(round(seconds))
+
+    def workout(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError("plan index out of range")
+
+        duration = self.duration(index)
+        week, run = divmod(index, self.runs_per_week)
+        return create_fartlek_workout(
+            duration,
+            self.pace(index),
+            name=f"{self.name} W{week + 1}R{run + 1} ({duration})",
+            rng=random.Random(f"{self.seed}:{index}"),
+        )
+
+    def __getitem__(self, index):
+        return self.workout(index + len(self) if index < 0 else index)
+
+    def __iter__(self):
+        return self.workouts()
+
+    def workouts(self, start=0):
+        return (self.workout(i) for i in range(start, len(self)))
@@ -0,0 +1,213 @@
+"""
+Generates a workout for every athlete in a roster and uploads them all from one
+process, on a shared thread pool.
+
+A roster is a CSV file (with a header row) or a JSON Lines file (.jsonl) with a
+row per athlete:
+
+    destination,duration,pace,username,password,athlete_id,api_key,name,seed,folder
+    garmin,30:00,04:30,runner@example.com,hunter2,,,,,
+    intervals,45:00,05:00,,,i12345,abc123,Tuesday Fartlek,,
+
+Garmin rows need a username and password, intervals.icu rows an athlete_id and
+api_key. name, seed and folder (intervals.icu only) are optional. A row without
+a seed gets the same workout for the whole day (see default_seed), so a roster
+that's run again with a ledger skips the uploads that already succeeded.
+
+    for result in RosterUploader(workers=16).run(read_roster("athletes.csv")):
+        print(result.as_dict())
+"""
+
+import csv
+import datetime
+import json
+import os
+import time
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .fartlek import create_fartlek_workout
+from .garmin import GarminClient
+from .intervals import IntervalsUploader
+from .thttp import Retry, Session
+
+REQUIRED_FIELDS = {
+    "garmin": ("username", "password"),
+    "intervals": ("athlete_id", "api_key"),
+}
+
+# the most uploads running at once for each destination, whatever the number of workers
+DEFAULT_LIMITS = {"garmin": 4, "intervals": 8}
+
+
+class Athlete(
+    namedtuple(
+        "Athlete",
+        "line destination duration pace username password athlete_id api_key name seed folder",
+        defaults=(None,) * 7,
+    )
+):
+    __slots__ = ()
+
+    @property
+    def account(self):
+        return self.username if self.destination == "garmin" else self.athlete_id
+
+
+class RosterResult(namedtuple("RosterResult", "athlete status remote_id error elapsed")):
+    """
+    status is "uploaded", "skipped" (already in the ledger) or "failed".
+    """
+
+    __slots__ = ()
+
+    def as_dict(self):
+        return {
+            "line": self.athlete.line,
+            "destination": self.athlete.destination,
+            "account": self.athlete.account,
+            "status": self.status,
+            "id": self.remote_id,
+            "error": str(self.error) if self.error else None,
+            "elapsed": round(self.elapsed, 3),
+        }
+
+
+def _athlete(line, row):
+    if not isinstance(row, dict):
+        raise ValueError(f"line {line}: expected an object")
+
+    row = {k.strip(): v.strip() if isinstance(v, str) else v for k, v in row.items() if k and v not in (None, "")}
+    destination = row.get("destination")
+
+    if destination not in REQUIRED_FIELDS:
+        raise ValueError(f"line {line}: destination must be one of: {', '.join(REQUIRED_FIELDS)}")
+
+    missing = [f for f in ("duration", "pace", *REQUIRED_FIELDS[destination]) if f not in row]
+    if missing:
+        raise ValueError(f"line {line}: missing {', '.join(missing)}")
+
+    return Athlete(line, **{k: str(v) for k, v in row.items() if k in Athlete._fields and k != "line"})
+
+
+def default_seed(athlete, date):
+    """
+    The seed for an athlete without one: the same for every run on date (a
+    datetime.date), and different for each account and day.
+    """
+    return f"{athlete.destination}:{athlete.account}:{date.isoformat()}"
+
+
+def read_roster(path):
+    """
+    Returns the list of Athletes in the CSV or JSON Lines file at path, raising a
+    ValueError (with the line number) for the first invalid row.
+    """
+    with open(path, newline="") as f:
+        if os.path.splitext(path)[1].lower() in (".jsonl", ".ndjson"):
+            rows = ((line, json.loads(text)) for line, text in enumerate(f, 1) if text.strip())
+        else:
+            reader = csv.DictReader(f)
+            rows = ((reader.line_num, row) for row in reader)
+        return [_athlete(line, row) for line, row in rows]
+
+
+class RosterUploader:
+    """
+    Runs up to workers uploads at once, and no more than limits[destination] (see
+    DEFAULT_LIMITS) for any one destination, so a slow or rate limiting service
+    doesn't hold up the rest of the roster.
+
+    intervals.icu uploads share a single connection pool. Each Garmin athlete
+    needs their own session, these are cached in session_cache_dir (see
+    GarminClient) and their connections are closed once the upload is done. With
+    a ledger, workouts that have already been uploaded are skipped, without
+    logging in.
+
+    Athletes without a seed are given default_seed(athlete, date), date defaults
+    to today.
+    """
+
+    def __init__(self, workers=8, limits=None, ledger=None, session_cache_dir=None, date=None):
+        self.workers = workers
+        self.limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self.ledger = ledger
+        self.session_cache_dir = session_cache_dir
+        self.date = date or datetime.date.today()
+        self.intervals_session = Session(retry=Retry(), pool_size=self.limits["intervals"])
+
+    def _upload_garmin(self, athlete, workout):
+        client = GarminClient(athlete.username, athlete.password, cache_dir=self.session_cache_dir, ledger=self.ledger)
+        # the athlete's connections are closed as soon as their upload is done
+        with client.session:
+            if self.ledger:
+                remote_id = self.ledger.get(client.destination, workout.content_hash())
+                if remote_id is not None:
+                    return "skipped", remote_id
+            client.connect()
+            result = client.upload(workout)
+        if result.error:
+            raise result.error
+        return "skipped" if result.skipped else "uploaded", result.json["workoutId"]
+
+    def _upload_intervals(self, athlete, workout):
+        uploader = IntervalsUploader(
+            athlete.athlete_id,
+            athlete.api_key,
+            folder_name=athlete.folder or "Run Randomly",
+            session=self.intervals_session,
+            ledger=self.ledger,
+        )
+        if self.ledger:
+            remote_id = self.ledger.get(uploader.destination, workout.content_hash())
+            if remote_id is not None:
+                return "skipped", remote_id
+        return "uploaded", uploader.upload_many([workout])[0]["id"]
+
+    def upload(self, athlete):
+        """
+        Generates and uploads the athlete's workout. Failures are returned in the
+        RosterResult rather than raised.
+        """
+        start = time.perf_counter()
+        try:
+            seed = athlete.seed or default_seed(athlete, self.date)
+            workout = create_fartlek_workout(athlete.duration, athlete.pace, name=athlete.name, seed=seed)
+            upload = self._upload_garmin if athlete.destination == "garmin" else self._upload_intervals
+            status, remote_id = upload(athlete, workout)
+        except Exception as e:
+            return RosterResult(athlete, "failed", None, e, time.perf_counter() - start)
+        return RosterResult(athlete, status, remote_id, None, time.perf_counter() - start)
+
+    def run(self, athletes):
+        """
+        Uploads a workout for each athlete, yielding a RosterResult for each one as
+        it finishes.
+        """
+        queues = {destination: deque() for destination in REQUIRED_FIELDS}
+        for athlete in athletes:
+            queues[athlete.destination].append(athlete)
+
+        running = dict.fromkeys(queues, 0)
+        pending = {}
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while True:
+                # take an athlete from each destination in turn, while it and the pool have room
+                submitted = True
+                while submitted and len(pending) < self.workers:
+                    submitted = False
+                    for destination, queue in queues.items():
+                        if queue and running[destination] < self.limits[destination] and len(pending) < self.workers:
+                            athlete = queue.popleft()
+                            pending[pool.submit(self.upload, athlete)] = athlete
+                            running[destination] += 1
+                            submitted = True
+
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running[pending.pop(future).destination] -= 1
+                    yield future.result()
@@ -0,0 +1,258 @@
+"""
+Serves freshly generated workouts over HTTP, so that a front-end can get one
+without starting a new Python process per request.
+
+    python -m fitlek.server --port=8000 --workers=4
+
+    GET /workout?duration=45:00&pace=04:30&format=garmin      Garmin Connect JSON
+    GET /workout?duration=45:00&pace=04:30&format=intervals   intervals.icu workout text
+    GET /workout?duration=45:00&pace=04:30&format=fit         FIT file
+
+or any other format in fitlek.exporters (zwo, tcx).
+
+`seed` makes the workout repeatable and `name` names it. Seeded workouts are
+cached (see fitlek.cache), GET /stats returns the cache's hit / miss counts.
+GET /health returns "ok" while the server is accepting requests.
+"""
+
+import argparse
+import asyncio
+import json
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from email.parser import BytesParser
+from http import HTTPStatus
+from http.client import HTTPMessage
+from urllib.parse import parse_qs, urlsplit
+
+from .cache import ArtifactCache
+from .exporters import EXPORTERS, export
+from .fartlek import create_fartlek_workout, warmup_and_cooldown
+from .utils import default_workers, mmss_to_seconds, seconds_to_mmss
+
+# a workout has to fit the shortest warmup and cooldown
+MIN_DURATION = sum(warmup_and_cooldown(0))
+MAX_DURATION = 6 * 60 * 60
+MAX_REQUEST_HEAD = 16 * 1024
+
+
+def render_workout(params):
+    """
+    Returns (content_type, content) for the query parameters of a /workout request.
+    Raises ValueError if they're missing or invalid.
+    """
+    duration, pace = params.get("duration"), params.get("pace")
+    if not duration or not pace:
+        raise ValueError("duration and pace are required (format: MM:SS)")
+
+    format_name = params.get("format", "garmin")
+    if format_name not in EXPORTERS:
+        raise ValueError(f"format must be one of: {', '.join(EXPORTERS)}")
+
+    try:
+        seconds, pace_seconds = mmss_to_seconds(duration), mmss_to_seconds(pace)
+    except Exception:
+        raise ValueError("duration and pace must use the MM:SS format")
+    if not MIN_DURATION <= seconds <= MAX_DURATION or pace_seconds <= 0:
+        raise ValueError(
+            f"duration must be between {seconds_to_mmss(MIN_DURATION)} and {MAX_DURATION // 60}:00,"
+            " and pace more than 00:00"
+        )
+
+    workout = create_fartlek_workout(duration, pace, name=params.get("name"), seed=params.get("seed"))
+
+    return EXPORTERS[format_name].content_type, export(workout, [format_name])[format_name]
+
+
+def _error(status, message):
+    return status, "application/json", json.dumps({"error": message}).encode()
+
+
+class WorkoutServer:
+    """
+    An HTTP/1.1 server with keep-alive. Connections are handled on the event loop
+    (an idle keep-alive connection costs next to nothing) and workouts are
+    generated on a pool of `workers` processes, so requests use every core. With
+    workers=0 they're generated on the event loop instead.
+
+    Seeded workouts are kept in `cache` (an ArtifactCache) once they've been
+    generated. Idle connections are closed after idle_timeout seconds. stop() stops
+    accepting connections, closes idle ones and waits for the requests that are
+    in flight to be responded to.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8000, workers=None, idle_timeout=15, cache=None):
+        self.host = host
+        self.port = port
+        self.workers = default_workers() if workers is None else workers
+        self.idle_timeout = idle_timeout
+        self.cache = cache if cache is not None else ArtifactCache()
+        self.requests = 0
+        self._server = None
+        self._pool = None
+        self._connections = {}  # writer -> whether it's in the middle of a request
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        if self.workers:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port, limit=MAX_REQUEST_HEAD, backlog=128
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+        for writer, busy in list(self._connections.items()):
+            if not busy:
+                writer.close()
+        while self._connections:
+            await asyncio.sleep(0.01)
+
+        if self._pool:
+            self._pool.shutdown()
+
+    async def serve_forever(self):
+        await self.start()
+        stopped = asyncio.Event()
+
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopped.set)
+
+        print(f"Listening on {self.url}")
+        await stopped.wait()
+        await self.stop()
+
+    async def _handle_connection(self, reader, writer):
+        self._connections[writer] = False
+        try:
+            while self._server.is_serving():
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.idle_timeout)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, OSError):
+                    break
+
+                self._connections[writer] = True
+                keep_alive = await self._handle_request(head, reader, writer)
+                self._connections[writer] = False
+                if not keep_alive:
+                    break
+        finally:
+            del self._connections[writer]
+            writer.close()
+
+    async def _handle_request(self, head, reader, writer):
+        # returns whether the connection can be kept open for another request
+        try:
+            request_line, _, header_lines = head.decode("latin-1").partition("\r\n")
+            method, target, version = request_line.split(" ")
+            headers = BytesParser(_class=HTTPMessage).parsebytes(header_lines.encode("latin-1"))
+            if headers.get("content-length"):
+                # the body isn't used, but it mustn't be mistaken for the next request
+                await reader.readexactly(int(headers["content-length"]))
+        except (ValueError, asyncio.IncompleteReadError):
+            await self._respond(writer, *_error(400, "bad request"), keep_alive=False)
+            return False
+
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+
+        self.requests += 1
+        try:
+            status, content_type, content = await self._route(method, target)
+        except Exception:
+            status, content_type, content = _error(500, "internal server error")
+
+        keep_alive = keep_alive and self._server.is_serving()
+        await self._respond(writer, status, content_type, content, keep_alive, head_only=method == "HEAD")
+        return keep_alive
+
+    async def _route(self, method, target):
+        url = urlsplit(target)
+        if method not in ("GET", "HEAD"):
+            return _error(405, "method not allowed")
+        if url.path == "/health":
+            return 200, "text/plain", b"ok"
+        if url.path == "/stats":
+            stats = {"requests": self.requests, "cache": self.cache.stats()}
+            return 200, "application/json", json.dumps(stats).encode()
+        if url.path != "/workout":
+            return _error(404, "not found")
+
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        # a workout without a seed is different every time, so there's no point caching it
+        format_name = params.get("format", "garmin")
+        key = None
+        if "seed" in params:
+            key = (params.get("duration"), params.get("pace"), params["seed"], format_name, params.get("name"))
+            content = self.cache.get(key)
+            if content is not None:
+                return 200, EXPORTERS[format_name].content_type, content
+
+        try:
+            if self._pool:
+                content_type, content = await asyncio.get_running_loop().run_in_executor(
+                    self._pool, render_workout, params
+                )
+            else:
+                content_type, content = render_workout(params)
+        except ValueError as e:
+            return _error(400, str(e))
+
+        if key:
+            self.cache.set(key, content)
+        return 200, content_type, content
+
+    async def _respond(self, writer, status, content_type, content, keep_alive, head_only=False):
+        head = (
+            f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(content)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            "\r\n"
+        )
+        writer.write(head.encode("latin-1") if head_only else head.encode("latin-1") + content)
+        try:
+            await writer.drain()
+        except OSError:
+            pass
+
+
+def serve(host="127.0.0.1", port=8000, workers=None, cache_size=1024, cache_ttl=None, cache_dir=None):
+    """
+    Runs a WorkoutServer until it's interrupted or sent SIGTERM, then shuts down gracefully.
+    """
+    cache = ArtifactCache(maxsize=cache_size, ttl=cache_ttl, directory=cache_dir)
+    asyncio.run(WorkoutServer(host, port, workers=workers, cache=cache).serve_forever())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve generated workouts over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, help="processes generating workouts (default: one per core)")
+    parser.add_argument("--cache-size", type=int, default=1024, help="seeded workouts kept in memory")
+    parser.add_argument("--cache-ttl", type=float, help="seconds a cached workout is kept (default: forever)")
+    parser.add_argument("--cache-dir", help="also cache workouts on disk, in this directory")
+    args = parser.parse_args()
+
+    serve(
+        args.host,
+        args.port,
+        workers=args.workers,
+        cache_size=args.cache_size,
+        cache_ttl=args.cache_ttl,
+        cache_dir=args.cache_dir,
+    )
+
+
+if __name__ == "__main__":
+    main()
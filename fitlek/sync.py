@@ -0,0 +1,224 @@
+"""
+Keeps the workouts fitlek has created in a Garmin Connect account in line with a
+plan: missing workouts are added and old ones deleted.
+
+The account's workout listing is cached on disk along with a watermark (the
+latest updateDate seen), so later syncs only fetch the first page or two of
+changes rather than listing the whole account:
+
+    client = GarminClient(username, password, cache_dir=DEFAULT_SESSION_CACHE_DIR)
+    client.connect()
+    result = GarminSync(client).sync(TrainingPlan(12, 3, "30:00", "05:00", seed=1))
+    print(len(result.added), len(result.deleted))
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+from .garmin import DEFAULT_SESSION_CACHE_DIR, UploadBatch
+
+FULL_LISTING_TTL = 60 * 60 * 24
+
+SyncPlan = namedtuple("SyncPlan", "keep add delete")
+SyncResult = namedtuple("SyncResult", "kept added deleted failed")
+
+
+def plan_sync(existing, workouts, prefix="Fitlek"):
+    """
+    Works out how to get from existing ({workoutId: summary}) to workouts. Returns
+    a SyncPlan of the workout ids to keep, the workouts to add and the workout ids
+    to delete.
+
+    Only existing workouts whose name starts with prefix are considered. They're
+    matched to workouts by their contentHash, which is known for workouts that were
+    uploaded by a sync or recorded in a ledger. Those without one can't be told
+    apart from other workouts with the same name, so they're replaced.
+    """
+    wanted = {}
+    for workout in workouts:
+        if not workout.workout_name.startswith(prefix):
+            raise ValueError(f"workout names must start with {prefix!r} to be synced: {workout.workout_name!r}")
+        wanted.setdefault(workout.content_hash(), workout)
+
+    managed = {i: w for i, w in existing.items() if w.get("workoutName", "").startswith(prefix)}
+    keep = []
+
+    # the same content is only kept once, any copies are deleted
+    for workout_id, summary in managed.items():
+        if wanted.pop(summary.get("contentHash"), None) is not None:
+            keep.append(workout_id)
+
+    kept = set(keep)
+    return SyncPlan(keep, list(wanted.values()), [i for i in managed if i not in kept])
+
+
+class GarminSync:
+    """
+    Syncs workouts to the account of a connected GarminClient.
+
+    The listing is cached in cache_dir (per username). A sync lists the account's
+    workouts newest first, and stops at the cached watermark. Workouts deleted in
+    Garmin Connect itself don't change the listing's order, so they're only noticed
+    by a full listing, which is done at least every full_listing_ttl seconds (or
+    with full=True).
+    """
+
+    def __init__(
+        self,
+        client,
+        cache_dir=DEFAULT_SESSION_CACHE_DIR,
+        prefix="Fitlek",
+        page_size=100,
+        full_listing_ttl=FULL_LISTING_TTL,
+        max_workers=4,
+    ):
+        self.client = client
+        self.cache_dir = cache_dir
+        self.prefix = prefix
+        self.page_size = page_size
+        self.full_listing_ttl = full_listing_ttl
+        self.max_workers = max_workers
+        self.requests = 0
+        self._cache = None
+
+    def _cache_path(self):
+        if not self.cache_dir:
+            return None
+        name = hashlib.sha256(self.client.username.encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{name}.workouts.json")
+
+    def _load(self):
+        path = self._cache_path()
+        try:
+            with open(path) as f:
+                cache = json.load(f)
+            # a cache without every key (say from an older version) is no cache at all
+            return {
+                "listed_at": float(cache["listed_at"]),
+                "watermark": cache["watermark"],
+                "workouts": {int(i): w for i, w in cache["workouts"].items()},
+            }
+        except (AttributeError, TypeError, OSError, ValueError, KeyError):
+            return None
+
+    def _save(self, cache):
+        path = self._cache_path()
+        if not path:
+            return
+
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, path)
+
+    def _pages(self):
+        start = 0
+        while True:
+            page = self.client.list_workouts(start, self.page_size)
+            self.requests += 1
+            yield page
+            if len(page) < self.page_size:
+                return
+            start += self.page_size
+
+    @staticmethod
+    def _summary(workout, content_hash=None):
+        summary = {"workoutName": workout.get("workoutName", ""), "updateDate": workout.get("updateDate") or ""}
+        if content_hash:
+            summary["contentHash"] = content_hash
+        return summary
+
+    def workouts(self, full=False):
+        """
+        Returns {workoutId: summary} for every workout in the account, fetching only
+        what's changed since the last sync unless a full listing is due.
+        """
+        cache = self._load()
+        if full or cache is None or time.time() - cache["listed_at"] > self.full_listing_ttl:
+            # the whole account is listed again, dropping anything that's no longer there, but the
+            # content of workouts that haven't been updated since they were cached is still known
+            previous_workouts = cache["workouts"] if cache else {}
+            cache = {"listed_at": time.time(), "watermark": "", "workouts": {}}
+            watermark = None
+        else:
+            previous_workouts = cache["workouts"]
+            watermark = cache["watermark"]
+
+        workouts = cache["workouts"]
+        for page in self._pages():
+            for workout in page:
+                previous = previous_workouts.get(workout["workoutId"], {})
+                # an updated workout may have been edited, so its content is no longer known
+                keep_hash = previous.get("updateDate") == workout.get("updateDate")
+                workouts[workout["workoutId"]] = self._summary(workout, keep_hash and previous.get("contentHash"))
+            # the rest of the listing is older than the watermark, and already cached
+            if watermark is not None and any((w.get("updateDate") or "") < watermark for w in page):
+                break
+
+        cache["watermark"] = max((w["updateDate"] for w in workouts.values()), default="")
+        self._save(cache)
+        self._cache = cache
+        return workouts
+
+    def plan(self, workouts, full=False):
+        existing = self.workouts(full=full)
+        ledger = self.client.ledger
+
+        if ledger:
+            # workouts uploaded with the client's ledger (rather than by a sync) can be matched by content too
+            workouts = list(workouts)
+            uploaded = ledger.lookup(self.client.destination, [w.content_hash() for w in workouts])
+            existing = dict(existing)
+            for content_hash, workout_id in uploaded.items():
+                if workout_id in existing and "contentHash" not in existing[workout_id]:
+                    existing[workout_id] = {**existing[workout_id], "contentHash": content_hash}
+
+        return plan_sync(existing, workouts, self.prefix)
+
+    def sync(self, workouts, full=False, dry_run=False):
+        """
+        Adds the workouts that aren't in the account and deletes those (starting
+        with prefix) that aren't in workouts. Returns a SyncResult of the kept
+        workout ids, the UploadResults of the added workouts and deleted workout ids,
+        and the UploadResults that failed. With dry_run=True nothing is changed, and
+        added is the workouts that would have been.
+        """
+        plan = self.plan(workouts, full=full)
+        if dry_run:
+            return SyncResult(plan.keep, plan.add, plan.delete, [])
+
+        cache = self._cache
+        ledger = self.client.ledger
+        added, deleted, failed = [], [], []
+
+        # uploaded without checking the client's ledger, it doesn't know about workouts deleted in Garmin Connect
+        for result in UploadBatch(self.client._upload_result, plan.add, self.max_workers):
+            self.requests += 1
+            if result.ok:
+                added.append(result)
+                content_hash = result.workout.content_hash()
+                cache["workouts"][result.json["workoutId"]] = self._summary(result.json, content_hash)
+                if ledger:
+                    self.client._record(content_hash, result.json)
+            else:
+                failed.append(result)
+
+        for result in self.client.delete_workouts(plan.delete, self.max_workers):
+            self.requests += 1
+            if result.ok:
+                deleted.append(result.workout)
+                cache["workouts"].pop(result.workout, None)
+            else:
+                failed.append(result)
+
+        if ledger:
+            ledger.forget_remote_ids(self.client.destination, deleted)
+
+        # our own changes don't move the watermark, so they're listed (once) by the next sync
+        self._save(cache)
+        return SyncResult(plan.keep, added, deleted, failed)
@@ -6,53 +6,46 @@ https://github.com/sesh/thttp
 """
 
 import gzip
+import hashlib
+import http.client
 import json as json_lib
+import os
+import random
+import socket
 import ssl
+import threading
+import time
+import zlib
 from base64 import b64encode
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from http.cookiejar import CookieJar
-from urllib.error import HTTPError, URLError
-from urllib.parse import urlencode
-from urllib.request import (
-    HTTPCookieProcessor,
-    HTTPRedirectHandler,
-    HTTPSHandler,
-    Request,
-    build_opener,
-)
+from urllib.error import URLError
+from urllib.parse import unquote, urlencode, urljoin, urlsplit
+from urllib.request import Request
+from urllib.request import __version__ as urllib_version
+from urllib.request import getproxies, proxy_bypass_environment
 
-Response = namedtuple("Response", "request content json status url headers cookiejar")
+from .cache import DiskStore
 
+Response = namedtuple("Response", "request content json status url headers cookiejar timings", defaults=(None,))
 
-class NoRedirect(HTTPRedirectHandler):
-    def redirect_request(self, req, fp, code, msg, headers, newurl):
-        return None
+MAX_REDIRECTS = 10
+CHUNK_SIZE = 64 * 1024
+USER_AGENT = f"Python-urllib/{urllib_version}"
 
+# errors that mean the server closed an idle keep-alive connection before we reused it
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
 
-def request(
-    url,
-    params={},
-    json=None,
-    data=None,
-    headers={},
-    method="GET",
-    verify=True,
-    redirect=True,
-    cookiejar=None,
-    basic_auth=None,
-    timeout=None,
-):
-    """
-    Returns a (named)tuple with the following properties:
-        - request
-        - content
-        - json (dict; or None)
-        - headers (dict; all lowercase keys)
-            - https://stackoverflow.com/questions/5258977/are-http-headers-case-sensitive
-        - status
-        - url (final url, after any redirects)
-        - cookiejar
-    """
+
+def _is_stale(e):
+    if isinstance(e, URLError):
+        e = e.reason
+    return isinstance(e, STALE_CONNECTION_ERRORS)
+
+
+def prepare_request(url, params={}, json=None, data=None, headers={}, method="GET", basic_auth=None):
     method = method.upper()
     headers = {k.lower(): v for k, v in headers.items()}  # lowecase headers
 
@@ -62,165 +55,1021 @@ def request(
         raise Exception("Cannot provide both json and data parameters")
     if method not in ["POST", "PATCH", "PUT"] and (json or data):
         raise Exception("Request method must POST, PATCH or PUT if json or data is provided")
-    if not timeout:
-        timeout = 60
 
     if json:  # if we have json, stringify and put it in our data variable
         headers["content-type"] = "application/json"
         data = json_lib.dumps(json).encode("utf-8")
     elif data:
         data = urlencode(data).encode()
+        headers.setdefault("content-type", "application/x-www-form-urlencoded")
 
     if basic_auth and len(basic_auth) == 2 and "authorization" not in headers:
         username, password = basic_auth
         headers["authorization"] = f'Basic {b64encode(f"{username}:{password}".encode()).decode("ascii")}'
 
-    if not cookiejar:
-        cookiejar = CookieJar()
+    return Request(url, data=data, headers=headers, method=method)
+
 
-    ctx = ssl.create_default_context()
-    if not verify:  # ignore ssl errors
-        ctx.check_hostname = False
-        ctx.verify_mode = ssl.CERT_NONE
+def build_response(req, status, content, headers, cookiejar, timings=None):
+    headers = {k.lower(): v for k, v in headers}
 
-    handlers = []
-    handlers.append(HTTPSHandler(context=ctx))
-    handlers.append(HTTPCookieProcessor(cookiejar=cookiejar))
+    if "gzip" in headers.get("content-encoding", ""):
+        start = time.perf_counter()
+        content = gzip.decompress(content)
+        if timings:
+            timings.decompress = time.perf_counter() - start
 
-    if not redirect:
-        no_redirect = NoRedirect()
-        handlers.append(no_redirect)
+    json = (
+        json_lib.loads(content) if "application/json" in headers.get("content-type", "").lower() and content else None
+    )
 
-    opener = build_opener(*handlers)
-    req = Request(url, data=data, headers=headers, method=method)
+    return Response(req, content, json, status, req.full_url, headers, cookiejar, timings)
 
+
+def redirect_request(req, status, location):
+    method = req.get_method()
+    if not (
+        (status in (301, 302, 303, 307, 308) and method in ("GET", "HEAD"))
+        or (status in (301, 302, 303) and method == "POST")
+    ):
+        return None
+
+    headers = {k: v for k, v in req.headers.items() if k.lower() not in ("content-length", "content-type")}
+    return Request(
+        urljoin(req.full_url, location),
+        headers=headers,
+        origin_req_host=req.origin_req_host,
+        unverifiable=True,
+        method="HEAD" if method == "HEAD" else "GET",
+    )
+
+
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "PUT", "DELETE", "OPTIONS", "TRACE"])
+
+
+class Retry:
+    """
+    Decides whether (and after how long) a failed request is retried.
+
+    Connection errors and responses with one of `statuses` are only retried for
+    idempotent methods. A 429 or 503 means the server turned the request away
+    without acting on it, so those are retried for any method.
+
+    Waits grow exponentially from `backoff` up to `max_backoff` seconds with full
+    jitter, or follow the server's Retry-After header. A request is retried at
+    most `total` times and never once `deadline` seconds have passed since the
+    first attempt.
+    """
+
+    def __init__(
+        self,
+        total=3,
+        backoff=0.5,
+        max_backoff=30,
+        deadline=120,
+        statuses=(429, 500, 502, 503, 504),
+        safe_statuses=(429, 503),
+        methods=IDEMPOTENT_METHODS,
+        respect_retry_after=True,
+    ):
+        self.total = total
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.statuses = statuses
+        self.safe_statuses = safe_statuses
+        self.methods = methods
+        self.respect_retry_after = respect_retry_after
+
+    def retry_status(self, method, status):
+        return status in self.safe_statuses or (status in self.statuses and method in self.methods)
+
+    def retry_error(self, method, error):
+        return method in self.methods
+
+    @staticmethod
+    def parse_retry_after(value):
+        if not value:
+            return None
+        try:
+            return max(0, int(value))
+        except ValueError:
+            pass
+        try:
+            return max(0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+    def delay(self, attempt, start, retry_after=None):
+        """
+        Returns how long to wait before the next attempt, or None to give up.
+        """
+        if attempt >= self.total:
+            return None
+
+        delay = self.parse_retry_after(retry_after) if self.respect_retry_after else None
+        if delay is None:
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+        if time.monotonic() - start + delay > self.deadline:
+            return None
+        return delay
+
+
+CONDITIONAL_HEADERS = ("If-none-match", "If-modified-since")
+
+
+def _cache_control(headers):
+    # {directive: value or True} from the cache-control header(s)
+    directives = {}
+    for name, value in headers:
+        if name.lower() == "cache-control":
+            for part in value.split(","):
+                directive, _, arg = part.strip().partition("=")
+                if directive:
+                    directives[directive.lower()] = arg.strip('"') if arg else True
+    return directives
+
+
+def _int_or_none(value):
     try:
-        with opener.open(req, timeout=timeout) as resp:
-            status, content, resp_url = (resp.getcode(), resp.read(), resp.geturl())
-            headers = {k.lower(): v for k, v in list(resp.info().items())}
+        return int(value)
+    except (TypeError, ValueError):
+        return None
 
-            if "gzip" in headers.get("content-encoding", ""):
-                content = gzip.decompress(content)
 
-            json = (
-                json_lib.loads(content)
-                if "application/json" in headers.get("content-type", "").lower() and content
-                else None
-            )
-    except HTTPError as e:
-        status, content, resp_url = (e.code, e.read(), e.geturl())
-        headers = {k.lower(): v for k, v in list(e.headers.items())}
+def _header(headers, name):
+    name = name.lower()
+    return next((v for k, v in reversed(headers) if k.lower() == name), None)
 
-        if "gzip" in headers.get("content-encoding", ""):
-            content = gzip.decompress(content)
 
-        json = (
-            json_lib.loads(content)
-            if "application/json" in headers.get("content-type", "").lower() and content
-            else None
-        )
+class CacheEntry(namedtuple("CacheEntry", "status headers content stored_at")):
+    """
+    A cached response: its status, headers (a list of (name, value) pairs) and
+    body as it was received, and when it was stored (a time.time()).
+    """
 
-    return Response(req, content, json, status, resp_url, headers, cookiejar)
+    __slots__ = ()
 
+    @property
+    def size(self):
+        return len(self.content) + sum(len(k) + len(v) for k, v in self.headers)
 
-import unittest  # noqa: E402
+    def freshness(self):
+        # how many seconds the response may be used for without revalidating it
+        directives = _cache_control(self.headers)
+        if "no-cache" in directives:
+            return 0
 
+        age = _int_or_none(_header(self.headers, "age")) or 0
+        max_age = _int_or_none(directives.get("max-age"))
+        if max_age is not None:
+            return max_age - age
 
-class RequestTestCase(unittest.TestCase):
-    def test_cannot_provide_json_and_data(self):
-        with self.assertRaises(Exception):
-            request(
-                "https://httpbingo.org/post",
-                json={"name": "Brenton"},
-                data="This is some form data",
-            )
+        expires, date = _header(self.headers, "expires"), _header(self.headers, "date")
+        try:
+            return (parsedate_to_datetime(expires) - parsedate_to_datetime(date)).total_seconds() - age
+        except (TypeError, ValueError):
+            return 0
 
-    def test_should_fail_if_json_or_data_and_not_p_method(self):
-        with self.assertRaises(Exception):
-            request("https://httpbingo.org/post", json={"name": "Brenton"})
+    def is_fresh(self, now=None):
+        return (now or time.time()) - self.stored_at < self.freshness()
 
-        with self.assertRaises(Exception):
-            request("https://httpbingo.org/post", json={"name": "Brenton"}, method="HEAD")
+    def validators(self):
+        # the headers that make a request for this entry conditional
+        headers = {}
+        etag, last_modified = _header(self.headers, "etag"), _header(self.headers, "last-modified")
+        if etag:
+            headers["If-none-match"] = etag
+        if last_modified:
+            headers["If-modified-since"] = last_modified
+        return headers
 
-    def test_should_set_content_type_for_json_request(self):
-        response = request("https://httpbingo.org/post", json={"name": "Brenton"}, method="POST")
-        self.assertEqual(response.request.headers["Content-type"], "application/json")
+    def revalidated(self, headers):
+        """
+        The entry updated with the headers of a 304 (Not Modified) response.
+        """
+        updated = {k.lower() for k, _ in headers if k.lower() not in ("content-length", "transfer-encoding")}
+        merged = [(k, v) for k, v in self.headers if k.lower() not in updated]
+        merged += [(k, v) for k, v in headers if k.lower() in updated]
+        return CacheEntry(self.status, merged, self.content, time.time())
 
-    def test_should_work(self):
-        response = request("https://httpbingo.org/get")
-        self.assertEqual(response.status, 200)
 
-    def test_should_create_url_from_params(self):
-        response = request(
-            "https://httpbingo.org/get",
-            params={"name": "brenton", "library": "tiny-request"},
-        )
-        self.assertEqual(response.url, "https://httpbingo.org/get?name=brenton&library=tiny-request")
+def cacheable(status, headers):
+    """
+    Whether a response can be stored: a 200 that isn't no-store, doesn't Vary (on
+    anything but Accept-Encoding), and is either fresh for a while or can be
+    revalidated with an ETag or Last-Modified.
+    """
+    if status != 200 or "no-store" in _cache_control(headers):
+        return False
+    vary = {v.strip().lower() for v in (_header(headers, "vary") or "").split(",") if v.strip()}
+    if vary - {"accept-encoding"}:
+        return False
+    entry = CacheEntry(status, headers, b"", 0)
+    return entry.freshness() > 0 or bool(entry.validators())
 
-    def test_should_return_headers(self):
-        response = request("https://httpbingo.org/response-headers", params={"Test-Header": "value"})
-        self.assertEqual(response.headers["test-header"], "value")
 
-    def test_should_populate_json(self):
-        response = request("https://httpbingo.org/json")
-        self.assertTrue("slideshow" in response.json)
+def cache_key(req):
+    # responses can depend on who's asking, so the credentials (hashed) are part of the key
+    credentials = f"{req.get_header('Authorization', '')}\n{req.get_header('Cookie', '')}"
+    return f"{req.get_method()} {req.full_url} {hashlib.sha256(credentials.encode()).hexdigest()[:32]}"
 
-    def test_should_return_response_for_404(self):
-        response = request("https://httpbingo.org/404")
-        self.assertEqual(response.status, 404)
-        self.assertTrue("text/plain" in response.headers["content-type"])
 
-    def test_should_fail_with_bad_ssl(self):
-        with self.assertRaises(URLError):
-            request("https://expired.badssl.com/")
+class _HTTPCache:
+    """
+    Counters shared by the cache backends. A hit is a fresh response served
+    without a request, a revalidation a cached response confirmed by a 304, and a
+    miss anything that needed the full response.
+    """
 
-    def test_should_load_bad_ssl_with_verify_false(self):
-        response = request("https://expired.badssl.com/", verify=False)
-        self.assertEqual(response.status, 200)
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
 
-    def test_should_form_encode_non_json_post_requests(self):
-        response = request("https://httpbingo.org/post", data={"name": "test-user"}, method="POST")
-        self.assertEqual(response.json["form"]["name"], ["test-user"])
+    def count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
 
-    def test_should_follow_redirect(self):
-        response = request(
-            "https://httpbingo.org/redirect-to",
-            params={"url": "https://duckduckgo.com/"},
-        )
-        self.assertEqual(response.url, "https://duckduckgo.com/")
-        self.assertEqual(response.status, 200)
-
-    def test_should_not_follow_redirect_if_redirect_false(self):
-        response = request(
-            "https://httpbingo.org/redirect-to",
-            params={"url": "https://duckduckgo.com/"},
-            redirect=False,
-        )
-        self.assertEqual(response.status, 302)
+    def stats(self):
+        lookups = self.hits + self.misses + self.revalidations
+        return {
+            "size": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.revalidations) / lookups if lookups else 0,
+        }
+
+
+class MemoryCache(_HTTPCache):
+    """
+    Keeps responses in memory, evicting the least recently used once their total
+    size goes over max_bytes.
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        super().__init__(max_bytes)
+        self.size = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            self.size += entry.size - (previous.size if previous else 0)
+            self._entries[key] = entry
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted.size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class DiskCache(_HTTPCache):
+    """
+    Keeps responses in files in directory (see cache.DiskStore), so they survive
+    a restart, evicting the least recently used once their total size goes over
+    max_bytes. A file holds a line of JSON (the status, headers and stored_at) and
+    then the body.
+    """
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024):
+        super().__init__(max_bytes)
+        self.directory = directory
+        self._store = DiskStore(directory, max_bytes)
+
+    def __len__(self):
+        return len(self._store)
+
+    @property
+    def size(self):
+        return self._store.size
+
+    def get(self, key):
+        stored = self._store.read(key)
+        if stored is None:
+            return None
+        meta, _, content = stored[0].partition(b"\n")
+        try:
+            meta = json_lib.loads(meta)
+            return CacheEntry(meta["status"], [tuple(h) for h in meta["headers"]], content, meta["stored_at"])
+        except (ValueError, KeyError):
+            return None
+
+    def set(self, key, entry):
+        meta = json_lib.dumps({"status": entry.status, "headers": entry.headers, "stored_at": entry.stored_at})
+        evicted = self._store.write(key, meta.encode() + b"\n" + entry.content)
+        if evicted:
+            with self._lock:
+                self.evictions += evicted
+
+    def clear(self):
+        self._store.clear()
+
+
+class RequestTimings:
+    """
+    Where the time went for one request (each redirect or retry is a request of
+    its own). Durations are in seconds:
+
+        - dns, connect, tls: opening the connection (None if a pooled connection
+          was reused, tls is also None for plain http)
+        - ttfb: from sending the request to having the response headers
+        - download: reading the body
+        - decompress: gunzipping the body (None if it wasn't compressed)
+
+    bytes_sent and bytes_received count the request (headers and body) and the
+    response body as sent over the wire.
+    """
+
+    __slots__ = (
+        "method",
+        "url",
+        "status",
+        "reused",
+        "dns",
+        "connect",
+        "tls",
+        "ttfb",
+        "download",
+        "decompress",
+        "bytes_sent",
+        "bytes_received",
+    )
+
+    def __init__(self, method, url):
+        self.method = method
+        self.url = url
+        self.status = None
+        self.reused = False
+        self.dns = self.connect = self.tls = None
+        self.ttfb = self.download = self.decompress = None
+        self.bytes_sent = self.bytes_received = 0
+
+    @property
+    def total(self):
+        return sum(getattr(self, name) or 0 for name in ("dns", "connect", "tls", "ttfb", "download", "decompress"))
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"<RequestTimings {self.method} {self.url} {self.status} {self.total * 1000:.1f}ms>"
+
+
+def _timed_create_connection(timings, address, timeout, source_address=None):
+    # socket.create_connection(), with the name lookup timed separately from connecting
+    host, port = address
+    start = time.perf_counter()
+    addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    timings.dns = time.perf_counter() - start
+
+    start = time.perf_counter()
+    error = None
+    for family, type_, proto, _, sockaddr in addresses:
+        sock = socket.socket(family, type_, proto)
+        try:
+            sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+        except OSError as e:
+            sock.close()
+            error = e
+        else:
+            timings.connect = time.perf_counter() - start
+            return sock
+    raise error
+
+
+class _TimedConnection:
+    # set by the session for each request when instrumentation is on
+    timings = None
+
+    def connect(self):
+        timings = self.timings
+        if timings is None:
+            return super().connect()
+
+        create_connection = self._create_connection
+        self._create_connection = lambda *args: _timed_create_connection(timings, *args)
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            self._create_connection = create_connection
+        if isinstance(self, http.client.HTTPSConnection):
+            timings.tls = time.perf_counter() - start - (timings.dns or 0) - (timings.connect or 0)
+
+    def send(self, data):
+        if self.timings is not None and isinstance(data, (bytes, bytearray)):
+            self.timings.bytes_sent += len(data)
+        super().send(data)
+
+
+class _HTTPConnection(_TimedConnection, http.client.HTTPConnection):
+    pass
+
+
+class _HTTPSConnection(_TimedConnection, http.client.HTTPSConnection):
+    pass
+
+
+def _proxy_headers(proxy):
+    # the Proxy-Authorization for a proxy url with a username (and password) in it
+    parts = urlsplit(proxy)
+    if parts.username is None:
+        return {}
+    credentials = f"{unquote(parts.username)}:{unquote(parts.password or '')}"
+    return {"Proxy-Authorization": "Basic " + b64encode(credentials.encode()).decode()}
+
+
+class Session:
+    """
+    Keeps HTTP/1.1 connections open between requests so that repeated calls to
+    the same host don't pay for a new TCP + TLS handshake each time.
+
+    Idle connections are pooled per host (up to pool_size of them) and the SSL
+    contexts are created once. A session can be shared between threads, each
+    request checks a connection out of the pool for its duration.
+
+    Requests that don't pass a cookiejar use the session's cookiejar, and those
+    that don't pass a Retry use the session's retry (if any).
 
-    def test_cookies(self):
-        response = request(
-            "https://httpbingo.org/cookies/set",
-            params={"cookie": "test"},
-            redirect=False,
+    With instrument=True (or any hooks), each request records a RequestTimings,
+    available as response.timings. Hooks are called with the RequestTimings of
+    every request once its body has been read, including redirects and retries.
+
+    With a cache (a MemoryCache or DiskCache), GET responses are stored and reused
+    while they're fresh (Cache-Control max-age, or Expires), then revalidated with
+    If-None-Match / If-Modified-Since. A 304 is returned as the cached response.
+    Requests that don't pass a cache use the session's cache (if any). Only
+    request() uses the cache, not stream() or download_to().
+
+    Like urllib, requests go through the proxies in the http_proxy / https_proxy
+    environment variables (read when the session is created) unless the host is
+    in no_proxy. https requests are tunnelled through the proxy with CONNECT. Pass
+    proxies ({scheme: url}, as returned by urllib.request.getproxies()) to use
+    others, or {} for none.
+    """
+
+    def __init__(
+        self, cookiejar=None, pool_size=10, retry=None, instrument=False, hooks=None, cache=None, proxies=None
+    ):
+        self.cookiejar = cookiejar if cookiejar is not None else CookieJar()
+        self.proxies = getproxies() if proxies is None else proxies
+        self.pool_size = pool_size
+        self.retry = retry
+        self.cache = cache
+        self.instrument = instrument
+        self.hooks = list(hooks or [])
+        self._pools = {}
+        self._ssl_contexts = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = self._pools, {}
+
+        for pool in pools.values():
+            for conn in pool:
+                conn.close()
+
+    def _ssl_context(self, verify):
+        with self._lock:
+            if verify not in self._ssl_contexts:
+                ctx = ssl.create_default_context()
+                if not verify:  # ignore ssl errors
+                    ctx.check_hostname = False
+                    ctx.verify_mode = ssl.CERT_NONE
+                self._ssl_contexts[verify] = ctx
+            return self._ssl_contexts[verify]
+
+    def _proxy(self, scheme, host):
+        # the url of the proxy for scheme://host, or None to connect directly
+        proxy = self.proxies.get(scheme)
+        if not proxy or proxy_bypass_environment(host, self.proxies):
+            return None
+        return proxy if "://" in proxy else f"http://{proxy}"
+
+    def _connection(self, key, timeout):
+        scheme, host, verify, proxy = key
+
+        with self._lock:
+            pool = self._pools.get(key)
+            conn = pool.pop() if pool else None
+
+        if conn:
+            conn.timeout = timeout
+            if conn.sock:
+                conn.sock.settimeout(timeout)
+            return conn, True
+
+        if scheme not in ("http", "https"):
+            raise URLError(f"unknown url type: {scheme}")
+        address = urlsplit(proxy).netloc.rpartition("@")[2] if proxy else host
+
+        if scheme == "http":
+            return _HTTPConnection(address, timeout=timeout), False
+        conn = _HTTPSConnection(address, timeout=timeout, context=self._ssl_context(verify))
+        if proxy:
+            conn.set_tunnel(host, headers=_proxy_headers(proxy))
+        return conn, False
+
+    def _release(self, key, conn):
+        with self._lock:
+            pool = self._pools.setdefault(key, [])
+            if len(pool) < self.pool_size:
+                pool.append(conn)
+                return
+        conn.close()
+
+    def _send(self, req, verify, timeout):
+        # returns the response with its body still to be read, see _read()
+        proxy = self._proxy(req.type, req.host)
+        key = (req.type, req.host, verify, proxy)
+        headers = dict(req.header_items())
+        headers.setdefault("User-agent", USER_AGENT)
+        selector = req.selector
+        if proxy and req.type == "http":
+            # a plain http proxy is sent the whole url, https goes through a tunnel (see _connection)
+            selector = req.full_url
+            headers.update(_proxy_headers(proxy))
+        instrument = self.instrument or self.hooks
+
+        while True:
+            conn, reused = self._connection(key, timeout)
+            timings = conn.timings = RequestTimings(req.get_method(), req.full_url) if instrument else None
+            try:
+                try:
+                    start = time.perf_counter() if timings else None
+                    conn.request(req.get_method(), selector, body=req.data, headers=headers)
+                except OSError as e:
+                    raise URLError(e)
+                resp = conn.getresponse()
+            except Exception as e:
+                conn.close()
+                if reused and _is_stale(e):
+                    continue  # try again with a fresh connection
+                raise
+
+            if timings:
+                connecting = (timings.dns or 0) + (timings.connect or 0) + (timings.tls or 0)
+                timings.ttfb = time.perf_counter() - start - connecting
+                timings.reused = reused
+                timings.status = resp.status
+            return key, conn, resp
+
+    def _send_with_retry(self, req, verify, timeout, retry):
+        if not retry:
+            return self._send(req, verify, timeout)
+
+        method = req.get_method()
+        start = time.monotonic()
+        attempt = 0
+
+        while True:
+            try:
+                key, conn, resp = self._send(req, verify, timeout)
+            except (OSError, http.client.HTTPException) as e:
+                delay = retry.delay(attempt, start) if retry.retry_error(method, e) else None
+                if delay is None:
+                    raise
+            else:
+                if not retry.retry_status(method, resp.status):
+                    return key, conn, resp
+                delay = retry.delay(attempt, start, resp.getheader("retry-after"))
+                if delay is None:
+                    return key, conn, resp
+                self._discard(key, conn, resp)
+
+            time.sleep(delay)
+            attempt += 1
+
+    def _finish(self, key, conn, resp):
+        # the body has been read, so the connection can be used again
+        if resp.will_close:
+            conn.close()
+        else:
+            self._release(key, conn)
+
+    def _read(self, key, conn, resp):
+        timings = conn.timings
+        try:
+            start = time.perf_counter() if timings else None
+            content = resp.read()
+        except BaseException:
+            conn.close()
+            raise
+        if timings:
+            timings.download = time.perf_counter() - start
+            timings.bytes_received = len(content)
+        self._finish(key, conn, resp)
+        return content
+
+    def _discard(self, key, conn, resp):
+        # read the body of a response that's being redirected or retried
+        timings = conn.timings
+        self._read(key, conn, resp)
+        self._record(timings)
+
+    def _record(self, timings):
+        if timings:
+            for hook in self.hooks:
+                hook(timings)
+
+    def _open(self, url, params, json, data, headers, method, verify, redirect, cookiejar, basic_auth, timeout, retry):
+        req = prepare_request(url, params, json, data, headers, method, basic_auth)
+        return self._open_request(req, verify, redirect, cookiejar, timeout, retry)
+
+    def _open_request(self, req, verify, redirect, cookiejar, timeout, retry):
+        if not timeout:
+            timeout = 60
+
+        if cookiejar is None:
+            cookiejar = self.cookiejar
+        if retry is None:
+            retry = self.retry
+
+        redirects = 0
+
+        while True:
+            cookiejar.add_cookie_header(req)
+            key, conn, resp = self._send_with_retry(req, verify, timeout, retry)
+            cookiejar.extract_cookies(resp, req)
+
+            location = resp.getheader("location")
+            next_req = redirect_request(req, resp.status, location) if redirect and location else None
+            if not next_req or redirects >= MAX_REDIRECTS:
+                return req, cookiejar, key, conn, resp
+
+            self._discard(key, conn, resp)
+            req = next_req
+            redirects += 1
+
+    def request(
+        self,
+        url,
+        params={},
+        json=None,
+        data=None,
+        headers={},
+        method="GET",
+        verify=True,
+        redirect=True,
+        cookiejar=None,
+        basic_auth=None,
+        timeout=None,
+        retry=None,
+        cache=None,
+    ):
+        """
+        Takes the same arguments as request().
+        """
+        req = prepare_request(url, params, json, data, headers, method, basic_auth)
+        if cache is None:
+            cache = self.cache
+        # a caller that sends its own validators wants the server's answer, not ours
+        if cache is None or req.get_method() != "GET" or any(map(req.has_header, CONDITIONAL_HEADERS)):
+            return self._request(req, verify, redirect, cookiejar, timeout, retry)
+
+        if cookiejar is None:
+            cookiejar = self.cookiejar
+        cookiejar.add_cookie_header(req)
+        entry_key = cache_key(req)
+        entry = cache.get(entry_key)
+
+        if entry is not None and entry.is_fresh():
+            cache.count("hits")
+            return build_response(req, entry.status, entry.content, entry.headers, cookiejar)
+
+        conditional = entry.validators() if entry is not None else {}
+        for name, value in conditional.items():
+            req.add_header(name, value)
+
+        sent = req
+        req, cookiejar, key, conn, resp = self._open_request(req, verify, redirect, cookiejar, timeout, retry)
+        timings = conn.timings
+        content = self._read(key, conn, resp)
+        headers = resp.getheaders()
+
+        if resp.status == 304 and conditional:
+            cache.count("revalidations")
+            entry = entry.revalidated(headers)
+            cache.set(entry_key, entry)
+            response = build_response(req, entry.status, entry.content, entry.headers, cookiejar, timings)
+        else:
+            cache.count("misses")
+            # redirected responses aren't stored, they'd be served for the wrong url
+            if req is sent and cacheable(resp.status, headers):
+                cache.set(entry_key, CacheEntry(resp.status, headers, content, time.time()))
+            response = build_response(req, resp.status, content, headers, cookiejar, timings)
+
+        self._record(timings)
+        return response
+
+    def _request(self, req, verify, redirect, cookiejar, timeout, retry):
+        req, cookiejar, key, conn, resp = self._open_request(req, verify, redirect, cookiejar, timeout, retry)
+        timings = conn.timings
+        content = self._read(key, conn, resp)
+        response = build_response(req, resp.status, content, resp.getheaders(), cookiejar, timings)
+        self._record(timings)
+        return response
+
+    def stream(
+        self,
+        url,
+        params={},
+        json=None,
+        data=None,
+        headers={},
+        method="GET",
+        verify=True,
+        redirect=True,
+        cookiejar=None,
+        basic_auth=None,
+        timeout=None,
+        retry=None,
+    ):
+        """
+        Takes the same arguments as request(), but returns a StreamingResponse
+        without reading the body.
+        """
+        req, cookiejar, key, conn, resp = self._open(
+            url, params, json, data, headers, method, verify, redirect, cookiejar, basic_auth, timeout, retry
         )
-        response = request("https://httpbingo.org/cookies", cookiejar=response.cookiejar)
-        self.assertEqual(response.json["cookie"], "test")
+        return StreamingResponse(self, req, cookiejar, key, conn, resp)
+
+    def download_to(self, path, url, chunk_size=CHUNK_SIZE, **kwargs):
+        """
+        Streams the response body into a file at path (written to a temporary file
+        first, then moved into place). Takes the same keyword arguments as request().
+
+        Returns a Response, its content is None if the body was written to the file.
+        Nothing is written for a non-2xx response, its body is in content instead.
+        """
+        with self.stream(url, **kwargs) as response:
+            if not 200 <= response.status < 300:
+                # already decompressed by iter_content(), so not passed through build_response()
+                content = b"".join(response.iter_content(chunk_size))
+                json = (
+                    json_lib.loads(content)
+                    if "application/json" in response.headers.get("content-type", "").lower() and content
+                    else None
+                )
+                return Response(
+                    response.request,
+                    content,
+                    json,
+                    response.status,
+                    response.url,
+                    response.headers,
+                    response.cookiejar,
+                    response.timings,
+                )
+
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    for chunk in response.iter_content(chunk_size):
+                        f.write(chunk)
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+            return Response(
+                response.request,
+                None,
+                None,
+                response.status,
+                response.url,
+                response.headers,
+                response.cookiejar,
+                response.timings,
+            )
+
+
+class StreamingResponse:
+    """
+    A response whose body is read in chunks by iterating over it (or iter_content()).
+    Gzip encoded bodies are decompressed as they're read.
+
+    The connection goes back to the session's pool once the whole body has been
+    read. Use it as a context manager (or call close()) so that a partly read
+    response doesn't hold on to its connection.
+    """
+
+    def __init__(self, session, req, cookiejar, key, conn, resp):
+        self.request = req
+        self.status = resp.status
+        self.url = req.full_url
+        self.headers = {k.lower(): v for k, v in resp.getheaders()}
+        self.cookiejar = cookiejar
+        self.timings = conn.timings
+        self._session = session
+        self._key = key
+        self._conn = conn
+        self._resp = resp
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        return self.iter_content()
 
-    def test_basic_auth(self):
-        response = request("http://httpbingo.org/basic-auth/user/passwd", basic_auth=("user", "passwd"))
-        self.assertEqual(response.json["authorized"], True)
+    def iter_content(self, chunk_size=CHUNK_SIZE):
+        resp = self._resp
+        if resp is None:
+            raise RuntimeError("the response body has already been read")
 
-    def test_should_handle_gzip(self):
-        response = request("http://httpbingo.org/gzip", headers={"Accept-Encoding": "gzip"})
-        self.assertEqual(response.json["gzipped"], True)
+        decompressor = None
+        if "gzip" in self.headers.get("content-encoding", ""):
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
 
-    def test_should_timeout(self):
-        import socket
+        timings = self.timings
+        if timings:
+            # only the time spent reading and decompressing counts, not the time spent by the caller
+            chunks = self._timed_chunks(resp, chunk_size, decompressor, timings)
+        else:
+            chunks = self._chunks(resp, chunk_size, decompressor)
 
-        with self.assertRaises((TimeoutError, socket.timeout)):
-            request("http://httpbingo.org/delay/3", timeout=1)
+        try:
+            yield from chunks
+        except BaseException:
+            self.close()
+            raise
 
-    def test_should_handle_head_requests(self):
-        response = request("http://httpbingo.org/head", method="HEAD")
-        self.assertTrue(response.content == b"")
+        self._resp = None
+        self._session._finish(self._key, self._conn, resp)
+        self._session._record(timings)
+
+    @staticmethod
+    def _chunks(resp, chunk_size, decompressor):
+        while chunk := resp.read(chunk_size):
+            if decompressor:
+                chunk = decompressor.decompress(chunk)
+            if chunk:
+                yield chunk
+
+        if decompressor and (chunk := decompressor.flush()):
+            yield chunk
+
+    @staticmethod
+    def _timed_chunks(resp, chunk_size, decompressor, timings):
+        timings.download = 0
+        if decompressor:
+            timings.decompress = 0
+
+        while True:
+            start = time.perf_counter()
+            chunk = resp.read(chunk_size)
+            timings.download += time.perf_counter() - start
+            if not chunk:
+                break
+            timings.bytes_received += len(chunk)
+
+            if decompressor:
+                start = time.perf_counter()
+                chunk = decompressor.decompress(chunk)
+                timings.decompress += time.perf_counter() - start
+            if chunk:
+                yield chunk
+
+        if decompressor:
+            start = time.perf_counter()
+            chunk = decompressor.flush()
+            timings.decompress += time.perf_counter() - start
+            if chunk:
+                yield chunk
+
+    def close(self):
+        if self._resp is not None:
+            self._resp = None
+            self._conn.close()
+
+
+_default_session = Session()
+
+
+def request(
+    url,
+    params={},
+    json=None,
+    data=None,
+    headers={},
+    method="GET",
+    verify=True,
+    redirect=True,
+    cookiejar=None,
+    basic_auth=None,
+    timeout=None,
+    retry=None,
+    cache=None,
+):
+    """
+    Returns a (named)tuple with the following properties:
+        - request
+        - content
+        - json (dict; or None)
+        - headers (dict; all lowercase keys)
+            - https://stackoverflow.com/questions/5258977/are-http-headers-case-sensitive
+        - status
+        - url (final url, after any redirects)
+        - cookiejar
+        - timings (a RequestTimings; None unless the Session is instrumented)
+
+    Pass a Retry to retry failed requests with backoff, and a MemoryCache or
+    DiskCache to cache GET responses (see Session).
+
+    Connections are pooled in a shared default Session, but each call gets its own
+    cookiejar unless one is passed in.
+    """
+    return _default_session.request(
+        url,
+        params=params,
+        json=json,
+        data=data,
+        headers=headers,
+        method=method,
+        verify=verify,
+        redirect=redirect,
+        cookiejar=cookiejar if cookiejar is not None else CookieJar(),
+        basic_auth=basic_auth,
+        timeout=timeout,
+        retry=retry,
+        cache=cache,
+    )
+
+
+def stream(
+    url,
+    params={},
+    json=None,
+    data=None,
+    headers={},
+    method="GET",
+    verify=True,
+    redirect=True,
+    cookiejar=None,
+    basic_auth=None,
+    timeout=None,
+    retry=None,
+):
+    """
+    Like request(), but returns a StreamingResponse to read the body from in chunks.
+    """
+    return _default_session.stream(
+        url,
+        params=params,
+        json=json,
+        data=data,
+        headers=headers,
+        method=method,
+        verify=verify,
+        redirect=redirect,
+        cookiejar=cookiejar if cookiejar is not None else CookieJar(),
+        basic_auth=basic_auth,
+        timeout=timeout,
+        retry=retry,
+    )
+
+
+def download_to(path, url, chunk_size=CHUNK_SIZE, cookiejar=None, **kwargs):
+    """
+    Writes the response body to path without holding it in memory, see Session.download_to().
+    """
+    cookiejar = cookiejar if cookiejar is not None else CookieJar()
+    return _default_session.download_to(path, url, chunk_size=chunk_size, cookiejar=cookiejar, **kwargs)
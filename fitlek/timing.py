@@ -0,0 +1,91 @@
+"""
+Wall-clock timings for the stages of a run (used by cli.py --profile).
+
+    timer = StageTimer()
+    with timer.stage("generate"):
+        workout = create_fartlek_workout("45:00", "04:30")
+    print(timer.summary())
+
+Pass timer.record_request as a thttp Session hook and the HTTP requests made
+during each stage are timed too, so that time spent waiting on the network can
+be told apart from time spent in fitlek.
+"""
+
+import time
+from contextlib import contextmanager
+
+
+class Stage:
+    __slots__ = ("name", "calls", "elapsed", "requests")
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.elapsed = 0
+        self.requests = []
+
+    @property
+    def network(self):
+        return sum(timings.total for timings in self.requests)
+
+
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
+        self._current = None
+
+    @contextmanager
+    def stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = Stage(name)
+        stage = self.stages[name]
+        outer, self._current = self._current, stage
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.elapsed += time.perf_counter() - start
+            stage.calls += 1
+            self._current = outer
+
+    def record_request(self, timings):
+        if self._current is not None:
+            self._current.requests.append(timings)
+
+    @property
+    def total(self):
+        return sum(stage.elapsed for stage in self.stages.values())
+
+    def summary(self):
+        total = self.total or 1
+        lines = [f"{'stage':<16} {'calls':>5} {'ms':>10} {'%':>6}"]
+
+        for stage in self.stages.values():
+            elapsed = stage.elapsed
+            lines.append(f"{stage.name:<16} {stage.calls:>5} {elapsed * 1000:>10.1f} {elapsed / total:>6.1%}")
+            if stage.requests:
+                network = stage.network
+                lines.append(f"{'  network':<16} {len(stage.requests):>5} {network * 1000:>10.1f}")
+                lines.append(f"{'  local':<16} {'':>5} {(elapsed - network) * 1000:>10.1f}")
+
+        lines.append(f"{'total':<16} {'':>5} {self.total * 1000:>10.1f}")
+
+        requests = [timings for stage in self.stages.values() for timings in stage.requests]
+        if requests:
+            lines.append("")
+            lines.extend(_request_line(timings) for timings in requests)
+
+        return "\n".join(lines)
+
+
+def _ms(value):
+    return "-" if value is None else f"{value * 1000:.1f}"
+
+
+def _request_line(timings):
+    return (
+        f"{timings.method} {timings.url} {timings.status}"
+        f" dns={_ms(timings.dns)} connect={_ms(timings.connect)} tls={_ms(timings.tls)}"
+        f" ttfb={_ms(timings.ttfb)} download={_ms(timings.download)} decompress={_ms(timings.decompress)}"
+        f" sent={timings.bytes_sent}B received={timings.bytes_received}B"
+    )
@@ -1,3 +1,6 @@
+import os
+
+
 def mmss_to_seconds(s):
     parts = s.split(":")
 
@@ -17,3 +20,9 @@ def pace_to_ms(pace):
     seconds = mmss_to_seconds(pace)
     km_h = 60 / (seconds / 60)
     return km_h * 0.27778
+
+
+def default_workers():
+    # a single core is better off without the overhead of a pool of worker processes
+    cpus = os.cpu_count() or 1
+    return cpus if cpus > 1 else 0
@@ -1,3 +1,6 @@
+import hashlib
+import json
+
 SPORT_TYPES = {
     "running": 1,
 }
@@ -20,7 +23,47 @@ TARGET_TYPES = {
 }
 
 
+# The constant parts of the Garmin Connect JSON, built once and shared by every
+# serialized workout. Don't modify the output of garminconnect_json() in place.
+SPORT_TYPE_JSON = {k: {"sportTypeId": v, "sportTypeKey": k} for k, v in SPORT_TYPES.items()}
+STEP_TYPE_JSON = {k: {"stepTypeId": v, "stepTypeKey": k} for k, v in STEP_TYPES.items()}
+END_CONDITION_JSON = {k: {"conditionTypeKey": k, "conditionTypeId": v} for k, v in END_CONDITIONS.items()}
+TARGET_TYPE_JSON = {k: {"workoutTargetTypeId": v, "workoutTargetTypeKey": k} for k, v in TARGET_TYPES.items()}
+KILOMETER_UNIT_JSON = {"unitKey": "kilometer"}
+
+
+def parse_end_condition_value(value):
+    # distance
+    if value and value.endswith("km"):
+        return int(float(value.replace("km", "")) * 1000)
+
+    # time
+    elif value and ":" in value:
+        m, s = [int(x) for x in value.split(":")]
+        return m * 60 + s
+    else:
+        return None
+
+
+def workout_json(sport_type, name, steps_json):
+    # the Garmin Connect JSON for a workout whose steps have already been serialized
+    sport_type = SPORT_TYPE_JSON[sport_type]
+    return {
+        "sportType": sport_type,
+        "workoutName": name,
+        "workoutSegments": [
+            {
+                "segmentOrder": 1,
+                "sportType": sport_type,
+                "workoutSteps": steps_json,
+            }
+        ],
+    }
+
+
 class Workout:
+    __slots__ = ("sport_type", "workout_name", "workout_steps")
+
     def __init__(self, sport_type, name):
         self.sport_type = sport_type
         self.workout_name = name
@@ -30,26 +73,34 @@ class Workout:
         self.workout_steps.append(step)
 
     def garminconnect_json(self):
-        return {
-            "sportType": {
-                "sportTypeId": SPORT_TYPES[self.sport_type],
-                "sportTypeKey": self.sport_type,
-            },
-            "workoutName": self.workout_name,
-            "workoutSegments": [
-                {
-                    "segmentOrder": 1,
-                    "sportType": {
-                        "sportTypeId": SPORT_TYPES[self.sport_type],
-                        "sportTypeKey": self.sport_type,
-                    },
-                    "workoutSteps": [step.garminconnect_json() for step in self.workout_steps],
-                }
-            ],
-        }
+        steps_json = [step.garminconnect_json() for step in self.workout_steps]
+        return workout_json(self.sport_type, self.workout_name, steps_json)
+
+    def content_hash(self):
+        """
+        A sha256 (hex) of the sport, name and every step and target. It's the same on
+        every run and machine, so it identifies a workout that's been uploaded before.
+        """
+        steps = [
+            [
+                step.order,
+                step.step_type,
+                step.end_condition,
+                step.end_condition_value,
+                step.target.target,
+                step.target.to_value,
+                step.target.from_value,
+                step.target.zone,
+            ]
+            for step in self.workout_steps
+        ]
+        content = json.dumps([self.sport_type, self.workout_name, steps], separators=(",", ":"))
+        return hashlib.sha256(content.encode()).hexdigest()
 
 
 class WorkoutStep:
+    __slots__ = ("order", "step_type", "end_condition", "target", "_end_condition_value", "_parsed_end_condition_value")
+
     def __init__(
         self,
         order,
@@ -69,48 +120,50 @@ class WorkoutStep:
         self.end_condition_value = end_condition_value
         self.target = target or Target()
 
+    @property
+    def end_condition_value(self):
+        return self._end_condition_value
+
+    @end_condition_value.setter
+    def end_condition_value(self, value):
+        # parsed once here rather than every time the step is serialized
+        self._end_condition_value = value
+        self._parsed_end_condition_value = parse_end_condition_value(value)
+
     def end_condition_unit(self):
         if self.end_condition and self.end_condition.endswith("km"):
-            return {"unitKey": "kilometer"}
+            return KILOMETER_UNIT_JSON
         else:
             return None
 
     def parsed_end_condition_value(self):
-        # distance
-        if self.end_condition_value and self.end_condition_value.endswith("km"):
-            return int(float(self.end_condition_value.replace("km", "")) * 1000)
-
-        # time
-        elif self.end_condition_value and ":" in self.end_condition_value:
-            m, s = [int(x) for x in self.end_condition_value.split(":")]
-            return m * 60 + s
-        else:
-            return None
+        return self._parsed_end_condition_value
 
     def garminconnect_json(self):
+        target = self.target
         return {
             "type": "ExecutableStepDTO",
             "stepId": None,
             "stepOrder": self.order,
             "childStepId": None,
             "description": None,
-            "stepType": {
-                "stepTypeId": STEP_TYPES[self.step_type],
-                "stepTypeKey": self.step_type,
-            },
-            "endCondition": {
-                "conditionTypeKey": self.end_condition,
-                "conditionTypeId": END_CONDITIONS[self.end_condition],
-            },
+            "stepType": STEP_TYPE_JSON[self.step_type],
+            "endCondition": END_CONDITION_JSON[self.end_condition],
             "preferredEndConditionUnit": self.end_condition_unit(),
-            "endConditionValue": self.parsed_end_condition_value(),
+            "endConditionValue": self._parsed_end_condition_value,
             "endConditionCompare": None,
             "endConditionZone": None,
-            **self.target.garminconnect_json(),
+            # the same as **target.garminconnect_json(), without the intermediate dict
+            "targetType": TARGET_TYPE_JSON[target.target],
+            "targetValueOne": target.to_value,
+            "targetValueTwo": target.from_value,
+            "zoneNumber": target.zone,
         }
 
 
 class Target:
+    __slots__ = ("target", "to_value", "from_value", "zone")
+
     def __init__(self, target="no.target", to_value=None, from_value=None, zone=None):
         self.target = target
         self.to_value = to_value
@@ -119,10 +172,7 @@ class Target:
 
     def garminconnect_json(self):
         return {
-            "targetType": {
-                "workoutTargetTypeId": TARGET_TYPES[self.target],
-                "workoutTargetTypeKey": self.target,
-            },
+            "targetType": TARGET_TYPE_JSON[self.target],
             "targetValueOne": self.to_value,
             "targetValueTwo": self.from_value,
             "zoneNumber": self.zone,
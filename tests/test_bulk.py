@@ -0,0 +1,69 @@
+import os
+import tempfile
+import unittest
+import zipfile
+
+from fitlek.bulk import export_fit, export_plan, fit_filename
+from fitlek.fartlek import create_fartlek_workout
+from fitlek.fit import encode_workout
+from fitlek.plan import TrainingPlan
+
+
+class ExportTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.plan = TrainingPlan(3, 3, "30:00", "05:00", end_duration="40:00", seed=1)
+
+    def expected(self):
+        return {fit_filename(i, w.workout_name): encode_workout(w) for i, w in enumerate(self.plan)}
+
+    def read_zip(self, path):
+        with zipfile.ZipFile(path) as z:
+            return {name: z.read(name) for name in z.namelist()}
+
+    def test_should_name_files_by_position_and_name(self):
+        self.assertEqual(fit_filename(0, "Fitlek: 30 min @ 5:00"), "0001-fitlek-30-min-5-00.fit")
+        self.assertEqual(fit_filename(41, "!!!"), "0042-workout.fit")
+
+    def test_should_export_a_zip(self):
+        path = os.path.join(self.directory, "plan.zip")
+        self.assertEqual(export_fit(self.plan, path, workers=0, chunk_size=4), 9)
+
+        files = self.read_zip(path)
+        self.assertEqual(files, self.expected())
+        self.assertEqual(os.listdir(self.directory), ["plan.zip"])
+
+    def test_should_export_a_plan_on_a_process_pool(self):
+        path = os.path.join(self.directory, "plan.zip")
+        self.assertEqual(export_plan(self.plan, path, workers=2, chunk_size=2), 9)
+
+        # in order, whichever chunk finishes first
+        self.assertEqual(list(self.read_zip(path).items()), list(self.expected().items()))
+
+    def test_should_export_a_directory(self):
+        path = os.path.join(self.directory, "plan")
+        export_plan(self.plan, path, workers=0)
+        export_fit([self.plan[0]], path, workers=0)
+
+        names = sorted(os.listdir(path))
+        self.assertEqual(names[1:], sorted(self.expected()))
+        # the second export didn't overwrite the first one's file
+        first = fit_filename(0, self.plan[0].workout_name)
+        self.assertEqual(names[0], first.replace(".fit", "-2.fit"))
+        with open(os.path.join(path, names[0]), "rb") as f:
+            self.assertEqual(f.read(), self.expected()[first])
+
+    def test_should_not_leave_a_partial_zip(self):
+        def workouts():
+            yield create_fartlek_workout("30:00", "05:00", seed="1")
+            raise RuntimeError("generating failed")
+
+        with self.assertRaises(RuntimeError):
+            export_fit(workouts(), os.path.join(self.directory, "plan.zip"), workers=0, chunk_size=1)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
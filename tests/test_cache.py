@@ -0,0 +1,70 @@
+import os
+import tempfile
+import time
+import unittest
+
+from fitlek.cache import ArtifactCache
+
+
+class ArtifactCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_should_evict_the_least_recently_used(self):
+        cache = ArtifactCache(maxsize=2)
+        cache.set(("a",), b"1")
+        cache.set(("b",), b"2")
+        cache.get(("a",))
+        cache.set(("c",), b"3")
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(("b",)))
+        self.assertEqual((cache.get(("a",)), cache.get(("c",))), (b"1", b"3"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_should_expire_values(self):
+        cache = ArtifactCache(ttl=0)
+        cache.set(("a",), b"1")
+
+        self.assertIsNone(cache.get(("a",)))
+        self.assertEqual(len(cache), 0)
+
+    def test_should_only_create_values_once(self):
+        cache = ArtifactCache()
+        calls = []
+        for _ in range(3):
+            value = cache.get_or_set(("a",), lambda: calls.append(1) or b"1")
+
+        self.assertEqual((value, len(calls)), (b"1", 1))
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["hit_rate"]), (2, 1, 2 / 3))
+
+    def test_should_read_evicted_values_back_from_disk(self):
+        cache = ArtifactCache(maxsize=1, directory=self.directory.name)
+        cache.set(("a",), b"1")
+        cache.set(("b",), b"2")
+
+        self.assertEqual(cache.get(("a",)), b"1")
+        self.assertEqual((cache.evictions, cache.disk_hits), (2, 1))
+
+    def test_should_share_values_on_disk(self):
+        ArtifactCache(directory=self.directory.name).set(("a",), b"1")
+        cache = ArtifactCache(directory=self.directory.name)
+
+        self.assertEqual(cache.get(("a",)), b"1")
+        self.assertEqual(cache.disk_hits, 1)
+        self.assertFalse([name for name in os.listdir(self.directory.name) if name.endswith(".tmp")])
+
+    def test_should_remove_expired_files(self):
+        ArtifactCache(directory=self.directory.name).set(("a",), b"1")
+        (name,) = os.listdir(self.directory.name)
+        an_hour_ago = time.time() - 3600
+        os.utime(os.path.join(self.directory.name, name), (an_hour_ago, an_hour_ago))
+
+        self.assertIsNone(ArtifactCache(ttl=60, directory=self.directory.name).get(("a",)))
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+from http.cookiejar import CookieJar
+
+from fitlek.fakeserver import FakeServer
+from fitlek.fartlek import create_fartlek_workout
+from fitlek.garmin import GarminClient
+from fitlek.getfit import getfit_download
+from fitlek.thttp import Session
+
+
+class FakeServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer(seed=1).start()
+        self.addCleanup(self.server.stop)
+        self.session = Session()
+        self.addCleanup(self.session.close)
+        self.workouts_url = f"{self.server.connect_url}/modern/proxy/workout-service"
+
+    def connected_client(self):
+        client = GarminClient(
+            "runner", "secret", session=self.session, sso_url=self.server.sso_url, connect_url=self.server.connect_url
+        )
+        client.connect()
+        return client
+
+    def test_should_log_in(self):
+        self.connected_client()
+        self.assertEqual(len(self.server.sessions), 1)
+        # the ticket is claimed by logging in
+        self.assertEqual(self.server.tickets, set())
+
+    def test_should_need_a_session_for_garmin(self):
+        response = self.session.request(f"{self.workouts_url}/workouts", cookiejar=CookieJar())
+        self.assertEqual(response.status, 401)
+
+    def test_should_reject_a_login_without_a_password(self):
+        response = self.session.request(self.server.sso_url, data={"username": "runner"}, method="POST")
+        self.assertEqual(response.status, 401)
+
+    def test_should_list_garmin_workouts_newest_first(self):
+        client = self.connected_client()
+        for i, date in enumerate(["2024-01-02", "2024-01-03", "2024-01-01"]):
+            self.server.garmin_workouts[i] = {"workoutId": i, "workoutName": f"Workout {i}", "updateDate": date}
+
+        self.assertEqual([w["workoutId"] for w in client.list_workouts(0, 2)], [1, 0])
+        self.assertEqual([w["workoutId"] for w in client.list_workouts(2, 2)], [2])
+
+    def test_should_add_and_delete_garmin_workouts(self):
+        client = self.connected_client()
+        created = client.add_workout(create_fartlek_workout("30:00", "05:00", seed="1"))
+
+        self.assertIn(created["workoutId"], self.server.garmin_workouts)
+        self.assertTrue(created["updateDate"])
+
+        client.delete_workout(created["workoutId"])
+        self.assertEqual(self.server.garmin_workouts, {})
+        # deleting it again is a 404, which delete_workout() ignores
+        self.assertEqual(client._delete_result(created["workoutId"]).status, 404)
+
+    def test_should_throttle(self):
+        self.server.throttle_rate = 1
+        self.server.retry_after = 7
+        response = self.session.request(f"{self.server.url}/anything")
+
+        self.assertEqual(response.status, 429)
+        self.assertEqual(response.headers["retry-after"], "7")
+
+    def test_should_fail(self):
+        self.server.error_rate = 1
+        self.assertEqual(self.session.request(f"{self.server.url}/anything").status, 500)
+
+    def test_should_return_404_for_unknown_urls(self):
+        self.assertEqual(self.session.request(f"{self.server.url}/anything").status, 404)
+        self.assertEqual(self.server.requests, 1)
+
+    def test_should_encode_getfit_workouts(self):
+        content = getfit_download(
+            "Fartlek", create_fartlek_workout("30:00", "05:00", seed="1"), save=False, url=self.server.getfit_url
+        )
+        self.assertEqual(content[8:12], b".FIT")
+
+
+if __name__ == "__main__":
+    unittest.main()
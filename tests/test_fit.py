@@ -0,0 +1,88 @@
+import struct
+import unittest
+
+from fitlek.fartlek import create_fartlek_workout
+from fitlek.fit import HEADER, crc16, encode_workout
+from fitlek.workout import Target, Workout, WorkoutStep
+
+BASE_TYPE_FORMATS = {0x00: "B", 0x84: "H", 0x86: "I", 0x8C: "I"}
+
+
+def decode(data):
+    """
+    Returns [(global message number, {field number: value})] for the data messages in a FIT file.
+    """
+    header_size = data[0]
+    data_size = struct.unpack_from("<I", data, 4)[0]
+    offset, end = header_size, header_size + data_size
+    definitions, messages = {}, []
+
+    while offset < end:
+        record = data[offset]
+        offset += 1
+        local_type = record & 0x0F
+
+        if record & 0x40:
+            _, _, global_message, num_fields = struct.unpack_from("<BBHB", data, offset)
+            offset += 5
+            fields = [tuple(data[offset + i * 3 : offset + i * 3 + 3]) for i in range(num_fields)]
+            offset += num_fields * 3
+            definitions[local_type] = (global_message, fields)
+        else:
+            global_message, fields = definitions[local_type]
+            values = {}
+            for number, size, base_type in fields:
+                raw = data[offset : offset + size]
+                if base_type == 0x07:
+                    values[number] = raw.split(b"\x00")[0].decode()
+                else:
+                    values[number] = struct.unpack("<" + BASE_TYPE_FORMATS[base_type], raw)[0]
+                offset += size
+            messages.append((global_message, values))
+
+    return messages
+
+
+class FitEncoderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.workout = create_fartlek_workout("30:00", "04:30", seed="fit")
+        self.data = encode_workout(self.workout)
+
+    def test_header(self):
+        header_size, _, _, data_size, signature = HEADER.unpack_from(self.data)
+        self.assertEqual(header_size, 14)
+        self.assertEqual(signature, b".FIT")
+        self.assertEqual(len(self.data), header_size + data_size + 2)
+        self.assertEqual(struct.unpack_from("<H", self.data, 12)[0], crc16(self.data[:12]))
+
+    def test_file_crc(self):
+        self.assertEqual(struct.unpack_from("<H", self.data, len(self.data) - 2)[0], crc16(self.data[:-2]))
+        self.assertEqual(crc16(self.data), 0)
+
+    def test_messages(self):
+        messages = decode(self.data)
+        file_id, workout, *steps = messages
+
+        self.assertEqual(file_id[0], 0)
+        self.assertEqual(file_id[1][0], 5)  # a workout file
+        self.assertEqual(workout[0], 26)
+        self.assertEqual(workout[1][6], len(self.workout.workout_steps))
+        self.assertEqual(workout[1][8], self.workout.workout_name)
+
+        self.assertEqual([m for m, _ in steps], [27] * len(self.workout.workout_steps))
+        for index, ((_, values), step) in enumerate(zip(steps, self.workout.workout_steps)):
+            self.assertEqual(values[254], index)
+            self.assertEqual(values[1], 0)  # time
+            self.assertEqual(values[2], step.parsed_end_condition_value() * 1000)
+
+    def test_speed_target(self):
+        workout = Workout("running", "Target")
+        target = Target("pace.zone", to_value=3.5, from_value=3.0)
+        workout.add_step(WorkoutStep(1, "interval", "distance", "1.0km", target))
+
+        _, values = decode(encode_workout(workout))[-1]
+        self.assertEqual(values[2], 100000)  # centimeters
+        self.assertEqual((values[3], values[5], values[6]), (0, 3000, 3500))  # speed, mm/s
+
+    def test_should_be_deterministic(self):
+        self.assertEqual(encode_workout(self.workout), self.data)
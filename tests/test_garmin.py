@@ -0,0 +1,99 @@
+import asyncio
+import unittest
+
+from fitlek.athttp import AsyncSession
+from fitlek.fakeserver import FakeServer
+from fitlek.fartlek import create_fartlek_workout
+from fitlek.garmin import AsyncGarminClient, GarminClient
+from fitlek.ledger import UploadLedger
+from fitlek.thttp import Session
+
+
+class AddWorkoutsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer(seed=1).start()
+        self.addCleanup(self.server.stop)
+        # without a Retry, so that the server's errors reach the results
+        self.client = GarminClient(
+            "runner", "secret", session=Session(), sso_url=self.server.sso_url, connect_url=self.server.connect_url
+        )
+        self.client.connect()
+        self.workouts = [create_fartlek_workout("30:00", "05:00", seed=str(i)) for i in range(20)]
+
+    def test_should_upload_every_workout(self):
+        batch = self.client.add_workouts(self.workouts, max_workers=4)
+        results = list(batch)
+
+        self.assertEqual(len(results), 20)
+        self.assertTrue(all(r.ok and r.status == 200 for r in results))
+        self.assertEqual({r.json["workoutId"] for r in results}, set(self.server.garmin_workouts))
+        self.assertEqual((batch.succeeded, batch.failed, batch.completed), (20, 0, 20))
+
+    def test_should_report_failures_in_the_results(self):
+        self.server.error_rate = 0.5
+        batch = self.client.add_workouts(self.workouts, max_workers=4)
+        results = list(batch)
+
+        failed = [r for r in results if not r.ok]
+        self.assertEqual(len(results), 20)
+        self.assertTrue(0 < len(failed) < 20)
+        self.assertTrue(all(r.status == 500 and isinstance(r.error, RuntimeError) for r in failed))
+        self.assertEqual((batch.succeeded, batch.failed), (20 - len(failed), len(failed)))
+        self.assertEqual(len(self.server.garmin_workouts), batch.succeeded)
+        self.assertEqual({id(r.workout) for r in results}, {id(w) for w in self.workouts})
+
+
+class AsyncGarminClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer().start()
+        self.addCleanup(self.server.stop)
+        self.ledger = UploadLedger(":memory:")
+        self.addCleanup(self.ledger.close)
+        self.workout = create_fartlek_workout("30:00", "05:00", seed="1")
+
+    def run_client(self, test):
+        async def run():
+            async with AsyncSession() as session:
+                client = AsyncGarminClient(
+                    "runner",
+                    "secret",
+                    session=session,
+                    sso_url=self.server.sso_url,
+                    connect_url=self.server.connect_url,
+                    ledger=self.ledger,
+                )
+                await client.connect()
+                return await test(client)
+
+        return asyncio.run(run())
+
+    def test_should_upload(self):
+        async def upload_twice(client):
+            return await client.upload(self.workout), await client.upload(self.workout)
+
+        first, second = self.run_client(upload_twice)
+
+        self.assertTrue(first.ok and not first.skipped)
+        self.assertIn(first.json["workoutId"], self.server.garmin_workouts)
+        self.assertTrue(second.skipped)
+        self.assertEqual(second.json, {"workoutId": first.json["workoutId"]})
+        self.assertEqual(len(self.server.garmin_workouts), 1)
+
+    def test_should_list_and_delete(self):
+        async def list_and_delete(client):
+            created = [r async for r in client.add_workouts([self.workout, other], max_workers=2)]
+            listed = [w["workoutId"] async for w in client.iter_workouts(page_size=1)]
+            deleted = [r async for r in client.delete_workouts(listed + [0])]
+            return created, listed, deleted, await client.list_workouts()
+
+        other = create_fartlek_workout("30:00", "05:00", seed="2")
+        created, listed, deleted, left = self.run_client(list_and_delete)
+
+        self.assertEqual(sorted(listed), sorted(r.json["workoutId"] for r in created))
+        self.assertTrue(all(r.ok for r in deleted))
+        self.assertEqual(sorted(r.status for r in deleted), [204, 204, 404])
+        self.assertEqual(left, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+
+from fitlek import intervals
+from fitlek.fakeserver import FakeServer
+from fitlek.fartlek import create_fartlek_workout
+from fitlek.intervals import IntervalsUploader
+from fitlek.thttp import Session
+
+
+class IntervalsUploaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer().start()
+        self.addCleanup(self.server.stop)
+        self.session = Session()
+        self.addCleanup(self.session.close)
+        intervals._folder_cache.clear()
+        self.addCleanup(intervals._folder_cache.clear)
+        self.workout = create_fartlek_workout("30:00", "05:00", seed="1")
+
+    def uploader(self, **kwargs):
+        return IntervalsUploader("i1", "key", session=self.session, base_url=self.server.intervals_url, **kwargs)
+
+    def test_should_create_the_folder_once(self):
+        created = self.uploader().upload(self.workout)
+        (folder,) = self.server.intervals_folders.values()
+        self.assertEqual((folder["name"], folder["type"]), ("Run Randomly", "FOLDER"))
+        self.assertEqual(created[0]["folder_id"], folder["id"])
+        # list folders, create the folder, upload
+        self.assertEqual(self.server.requests, 3)
+
+        # the folder id is cached for every uploader of the same folder
+        self.uploader().upload(self.workout)
+        self.assertEqual(self.server.requests, 4)
+        self.assertEqual(len(self.server.intervals_folders), 1)
+
+    def test_should_use_an_existing_folder(self):
+        folder_id = self.uploader().folder_id()
+        intervals._folder_cache.clear()
+
+        self.assertEqual(self.uploader().folder_id(), folder_id)
+        self.assertEqual(len(self.server.intervals_folders), 1)
+
+    def test_should_look_up_the_folder_again_once_it_expires(self):
+        self.uploader(folder_ttl=0).upload(self.workout)
+        self.uploader(folder_ttl=0).upload(self.workout)
+        # both uploads list the folders
+        self.assertEqual(self.server.requests, 5)
+
+    def test_should_recreate_a_deleted_folder(self):
+        uploader = self.uploader()
+        old_folder_id = uploader.folder_id()
+        self.server.intervals_folders.clear()
+        requests = self.server.requests
+
+        created = uploader.upload_many([self.workout, create_fartlek_workout("30:00", "05:00", seed="2")])
+
+        (folder,) = self.server.intervals_folders.values()
+        self.assertNotEqual(folder["id"], old_folder_id)
+        self.assertEqual([w["folder_id"] for w in created], [folder["id"]] * 2)
+        self.assertEqual(uploader.folder_id(), folder["id"])
+        # the rejected upload, list folders, create the folder, upload again
+        self.assertEqual(self.server.requests - requests, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
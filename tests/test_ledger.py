@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+
+from fitlek.ledger import LOOKUP_CHUNK_SIZE, UploadLedger
+
+
+class UploadLedgerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.ledger = UploadLedger(":memory:")
+        self.addCleanup(self.ledger.close)
+
+    def test_should_record_uploads(self):
+        self.ledger.record("garmin:runner", "a", 1)
+        self.ledger.record("intervals:i1", "a", "x1")
+
+        self.assertEqual(self.ledger.get("garmin:runner", "a"), 1)
+        self.assertEqual(self.ledger.get("intervals:i1", "a"), "x1")
+        self.assertIsNone(self.ledger.get("garmin:runner", "b"))
+        self.assertIsNone(self.ledger.get("garmin:someone-else", "a"))
+
+    def test_should_replace_uploads(self):
+        self.ledger.record("garmin:runner", "a", 1)
+        self.ledger.record_many("garmin:runner", [("a", 2), ("b", 3)])
+
+        self.assertEqual(self.ledger.lookup("garmin:runner", ["a", "b"]), {"a": 2, "b": 3})
+
+    def test_should_look_up_across_chunks(self):
+        hashes = [f"hash-{i}" for i in range(LOOKUP_CHUNK_SIZE * 2 + 100)]
+        self.ledger.record_many("garmin:runner", ((h, i) for i, h in enumerate(hashes) if i % 3))
+
+        found = self.ledger.lookup("garmin:runner", hashes + hashes[:10])
+        self.assertEqual(found, {h: i for i, h in enumerate(hashes) if i % 3})
+        self.assertEqual(self.ledger.lookup("garmin:runner", []), {})
+
+    def test_should_forget_uploads(self):
+        self.ledger.record_many("garmin:runner", [("a", 1), ("b", 2), ("c", 3)])
+        self.ledger.record("intervals:i1", "c", 3)
+        self.ledger.forget("garmin:runner", ["a"])
+        self.ledger.forget_remote_ids("garmin:runner", [3])
+
+        self.assertEqual(self.ledger.lookup("garmin:runner", ["a", "b", "c"]), {"b": 2})
+        self.assertEqual(self.ledger.get("intervals:i1", "c"), 3)
+
+    def test_should_keep_uploads_in_the_file(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "ledger", "uploads.sqlite3")
+            with UploadLedger(path) as ledger:
+                ledger.record("garmin:runner", "a", 1)
+
+            with UploadLedger(path) as ledger:
+                self.assertEqual(ledger.get("garmin:runner", "a"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
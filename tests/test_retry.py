@@ -0,0 +1,144 @@
+import asyncio
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+from fitlek import intervals
+from fitlek.athttp import AsyncSession
+from fitlek.fakeserver import FakeServer
+from fitlek.fartlek import create_fartlek_workout
+from fitlek.intervals import AsyncIntervalsUploader, IntervalsUploader
+from fitlek.thttp import Retry, Session
+
+
+class RetryTestCase(unittest.TestCase):
+    def test_should_back_off_exponentially_with_jitter(self):
+        retry = Retry(total=6, backoff=0.5, max_backoff=4)
+        start = time.monotonic()
+
+        for attempt, cap in enumerate([0.5, 1, 2, 4, 4, 4]):
+            delays = [retry.delay(attempt, start) for _ in range(200)]
+            self.assertTrue(all(0 <= d <= cap for d in delays))
+            self.assertGreater(max(delays), cap / 2)
+
+        self.assertIsNone(retry.delay(6, start))
+
+    def test_should_parse_retry_after(self):
+        self.assertEqual(Retry.parse_retry_after("7"), 7)
+        self.assertEqual(Retry.parse_retry_after("-3"), 0)
+        self.assertIsNone(Retry.parse_retry_after(None))
+        self.assertIsNone(Retry.parse_retry_after("soon"))
+
+        later = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+        self.assertAlmostEqual(Retry.parse_retry_after(later), 30, delta=2)
+        earlier = format_datetime(datetime.now(timezone.utc) - timedelta(seconds=30), usegmt=True)
+        self.assertEqual(Retry.parse_retry_after(earlier), 0)
+
+    def test_should_follow_retry_after(self):
+        start = time.monotonic()
+        self.assertEqual(Retry().delay(0, start, "5"), 5)
+        self.assertLessEqual(Retry(respect_retry_after=False).delay(0, start, "5"), 0.5)
+        # an unparseable Retry-After falls back to backing off
+        self.assertLessEqual(Retry().delay(0, start, "soon"), 0.5)
+
+    def test_should_give_up_at_the_deadline(self):
+        retry = Retry(deadline=10)
+        self.assertEqual(retry.delay(0, time.monotonic() - 4, "5"), 5)
+        self.assertIsNone(retry.delay(0, time.monotonic() - 6, "5"))
+
+    def test_should_only_retry_safe_statuses_for_any_method(self):
+        retry = Retry()
+        self.assertTrue(retry.retry_status("GET", 500))
+        self.assertFalse(retry.retry_status("POST", 500))
+        self.assertTrue(retry.retry_status("POST", 429))
+        self.assertTrue(retry.retry_status("POST", 503))
+        self.assertFalse(retry.retry_status("GET", 404))
+        self.assertTrue(retry.retry_error("GET", OSError()))
+        self.assertFalse(retry.retry_error("POST", OSError()))
+
+
+class SessionRetryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer(retry_after=0, seed=1).start()
+        self.addCleanup(self.server.stop)
+
+    def request(self, retry):
+        with Session(proxies={}) as session:
+            return session.request(f"{self.server.url}/anything", method="POST", data=b"", retry=retry)
+
+    def async_request(self, retry):
+        async def request():
+            async with AsyncSession() as session:
+                return await session.request(f"{self.server.url}/anything", method="POST", data=b"", retry=retry)
+
+        return asyncio.run(request())
+
+    def test_should_retry_throttled_requests(self):
+        for request in (self.request, self.async_request):
+            with self.subTest(request.__name__):
+                self.server.throttle_rate = 1
+                self.server.requests = 0
+                self.assertEqual(request(Retry(total=2)).status, 429)
+                self.assertEqual(self.server.requests, 3)
+
+                # the first request is throttled
+                self.server.throttle_rate = 0.5
+                self.server.random.seed(1)
+                self.server.requests = 0
+                self.assertEqual(request(Retry(total=20)).status, 404)
+                self.assertGreater(self.server.requests, 1)
+
+    def test_should_not_retry_server_errors_for_posts(self):
+        self.server.error_rate = 1
+        for request in (self.request, self.async_request):
+            with self.subTest(request.__name__):
+                self.server.requests = 0
+                self.assertEqual(request(Retry()).status, 500)
+                self.assertEqual(self.server.requests, 1)
+
+    def test_should_not_wait_past_the_deadline(self):
+        self.server.throttle_rate = 1
+        self.server.retry_after = 30
+        for request in (self.request, self.async_request):
+            with self.subTest(request.__name__):
+                self.server.requests = 0
+                start = time.monotonic()
+                self.assertEqual(request(Retry(deadline=5)).status, 429)
+                self.assertEqual(self.server.requests, 1)
+                self.assertLess(time.monotonic() - start, 5)
+
+
+class UploaderRetryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer(throttle_rate=0.5, retry_after=0, seed=1).start()
+        self.addCleanup(self.server.stop)
+        intervals._folder_cache.clear()
+        self.addCleanup(intervals._folder_cache.clear)
+        self.workout = create_fartlek_workout("30:00", "05:00", seed="1")
+
+    def test_should_retry_throttled_uploads(self):
+        uploader = IntervalsUploader("i1", "key", base_url=self.server.intervals_url, retry=Retry(total=20))
+        created = uploader.upload(self.workout)
+
+        self.assertEqual(len(self.server.intervals_workouts), 1)
+        self.assertEqual(created[0]["name"], self.workout.workout_name)
+        self.assertGreater(self.server.requests, 3)
+
+    def test_should_retry_throttled_async_uploads(self):
+        async def upload():
+            async with AsyncSession() as session:
+                uploader = AsyncIntervalsUploader(
+                    "i2", "key", session=session, base_url=self.server.intervals_url, retry=Retry(total=20)
+                )
+                return await uploader.upload(self.workout)
+
+        created = asyncio.run(upload())
+
+        self.assertEqual(len(self.server.intervals_workouts), 1)
+        self.assertEqual(created[0]["name"], self.workout.workout_name)
+        self.assertGreater(self.server.requests, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import datetime
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from fitlek import intervals
+from fitlek.fakeserver import FakeServer
+from fitlek.ledger import UploadLedger
+from fitlek.roster import RosterUploader, read_roster
+from fitlek.thttp import Session
+
+ROSTER = """destination,duration,pace,username,password,athlete_id,api_key,name,seed,folder
+garmin,30:00,04:30,runner@example.com,hunter2,,,,,
+garmin,30:00,04:30,other@example.com,hunter2,,,,7,
+intervals,45:00,05:00,,,i12345,abc123,Tuesday Fartlek,,
+"""
+
+
+class RosterUploaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer().start()
+        self.addCleanup(self.server.stop)
+        intervals._folder_cache.clear()
+        self.addCleanup(intervals._folder_cache.clear)
+        for name, url in [
+            ("fitlek.garmin.SSO_LOGIN_URL", self.server.sso_url),
+            ("fitlek.garmin.CONNECT_URL", self.server.connect_url),
+            ("fitlek.intervals.INTERVALS_URL", self.server.intervals_url),
+        ]:
+            patcher = mock.patch(name, url)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "athletes.csv")
+        with open(path, "w") as f:
+            f.write(ROSTER)
+        self.athletes = read_roster(path)
+        self.ledger = UploadLedger(":memory:")
+        self.addCleanup(self.ledger.close)
+
+    def run_roster(self, date=datetime.date(2024, 5, 1)):
+        uploader = RosterUploader(workers=4, ledger=self.ledger, date=date)
+        return sorted((r.athlete.line, r.status) for r in uploader.run(self.athletes))
+
+    def test_should_upload_for_every_athlete(self):
+        self.assertEqual(self.run_roster(), [(2, "uploaded"), (3, "uploaded"), (4, "uploaded")])
+        self.assertEqual(len(self.server.garmin_workouts), 2)
+        self.assertEqual(len(self.server.intervals_workouts), 1)
+
+    def test_should_close_each_garmin_session(self):
+        with mock.patch.object(Session, "close", autospec=True, side_effect=Session.close) as close:
+            self.run_roster()
+            self.run_roster()
+        # the intervals.icu session is shared, and stays open
+        self.assertEqual(close.call_count, 4)
+
+    def test_should_skip_uploads_in_the_ledger_without_logging_in(self):
+        self.run_roster()
+        requests = self.server.requests
+
+        self.assertEqual(self.run_roster(), [(2, "skipped"), (3, "skipped"), (4, "skipped")])
+        self.assertEqual(self.server.requests, requests)
+
+    def test_should_give_unseeded_athletes_a_new_workout_each_day(self):
+        self.run_roster()
+        self.assertEqual(self.run_roster(datetime.date(2024, 5, 2)), [(2, "uploaded"), (3, "skipped"), (4, "uploaded")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import asyncio
+import unittest
+
+from fitlek.athttp import AsyncSession
+from fitlek.server import WorkoutServer, render_workout
+
+
+class RenderWorkoutTestCase(unittest.TestCase):
+    def test_should_reject_invalid_params(self):
+        for params in (
+            {"pace": "04:30"},
+            {"duration": "45:00", "pace": "04:30", "format": "pdf"},
+            {"duration": "45", "pace": "04:30"},
+            {"duration": "06:59", "pace": "04:30"},
+            {"duration": "361:00", "pace": "04:30"},
+            {"duration": "45:00", "pace": "00:00"},
+        ):
+            with self.subTest(params):
+                self.assertRaises(ValueError, render_workout, params)
+
+    def test_should_render_the_shortest_workout(self):
+        content_type, content = render_workout({"duration": "07:00", "pace": "04:30", "format": "fit"})
+        self.assertEqual(content[8:12], b".FIT")
+
+
+class WorkoutServerTestCase(unittest.TestCase):
+    def get(self, *paths):
+        async def get():
+            server = await WorkoutServer(port=0, workers=0).start()
+            try:
+                async with AsyncSession() as session:
+                    return [await session.request(f"{server.url}{path}") for path in paths]
+            finally:
+                await server.stop()
+
+        return asyncio.run(get())
+
+    def test_should_serve_workouts(self):
+        (response,) = self.get("/workout?duration=45:00&pace=04:30&seed=1")
+        self.assertEqual(response.status, 200)
+        self.assertTrue(response.json["workoutName"])
+
+    def test_should_reject_too_short_workouts(self):
+        for response in self.get("/workout?duration=05:00&pace=04:30", "/workout?duration=00:01&pace=04:30"):
+            self.assertEqual(response.status, 400)
+            self.assertIn("between 07:00 and", response.json["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+"""
+`cli.py --dry-run` is run a lot (from cron and queue workers), so it shouldn't
+import anything it doesn't use: none of the HTTP stack, and no test code.
+"""
+
+import os
+import re
+import subprocess  # nosec B404
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DRY_RUN = [os.path.join(ROOT, "cli.py"), "--duration=45:00", "--target-pace=04:30", "--dry-run"]
+
+# total time spent importing the modules cli.py --dry-run adds to a bare interpreter, in seconds
+IMPORT_BUDGET = 0.05
+
+# modules that only the upload paths should need
+NETWORK_MODULES = [
+    "ssl",
+    "socket",
+    "http.client",
+    "http.cookiejar",
+    "urllib.request",
+    "gzip",
+    "zlib",
+    "asyncio",
+    "concurrent.futures",
+    "fitlek.thttp",
+    "fitlek.athttp",
+    "fitlek.garmin",
+    "fitlek.intervals",
+    "fitlek.getfit",
+]
+
+
+def import_times(*args):
+    """
+    Returns {module: seconds spent importing it (excluding its own imports)} from python -X importtime.
+    """
+    # subprocess is only used here, with a fixed argv (no shell) running sys.executable on our own cli.py
+    result = subprocess.run(  # nosec B603
+        [sys.executable, "-X", "importtime", *args], cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+\d+ \|\s+(\S+)$", line)
+        if match:
+            times[match[2]] = int(match[1]) / 1e6
+    return times
+
+
+class StartupTestCase(unittest.TestCase):
+    def test_dry_run_should_not_import_network_or_test_modules(self):
+        modules = import_times(*DRY_RUN)
+        self.assertIn("fitlek.fartlek", modules)
+
+        for module in NETWORK_MODULES + ["unittest"]:
+            self.assertNotIn(module, modules)
+
+    def test_dry_run_should_import_within_budget(self):
+        baseline = import_times("-c", "pass")
+        import_times(*DRY_RUN)  # a first run writes the .pyc files
+
+        # best of a few runs, so that a busy machine doesn't fail the test
+        elapsed = min(
+            sum(seconds for module, seconds in import_times(*DRY_RUN).items() if module not in baseline)
+            for _ in range(3)
+        )
+        self.assertLess(elapsed, IMPORT_BUDGET, f"cli.py --dry-run spent {elapsed * 1000:.1f}ms importing modules")
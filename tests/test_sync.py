@@ -0,0 +1,107 @@
+import json
+import tempfile
+import unittest
+
+from fitlek.fakeserver import FakeServer
+from fitlek.fartlek import create_fartlek_workout
+from fitlek.garmin import GarminClient
+from fitlek.plan import TrainingPlan
+from fitlek.sync import GarminSync, plan_sync
+from fitlek.thttp import Session
+
+
+class PlanSyncTestCase(unittest.TestCase):
+    def test_should_match_workouts_by_content(self):
+        plan = list(TrainingPlan(1, 3, "30:00", "05:00", seed=1))
+        existing = {
+            1: {"workoutName": plan[0].workout_name, "contentHash": plan[0].content_hash()},
+            2: {"workoutName": plan[0].workout_name, "contentHash": plan[0].content_hash()},
+            3: {"workoutName": plan[1].workout_name},
+            4: {"workoutName": "Someone else's workout"},
+        }
+        keep, add, delete = plan_sync(existing, plan)
+
+        self.assertEqual(keep, [1])
+        self.assertEqual(add, plan[1:])
+        # the copy, and the workout whose content isn't known
+        self.assertEqual(delete, [2, 3])
+
+    def test_should_only_sync_prefixed_workouts(self):
+        with self.assertRaises(ValueError):
+            plan_sync({}, [create_fartlek_workout("30:00", "05:00", name="Tempo")])
+
+
+class GarminSyncTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer().start()
+        self.addCleanup(self.server.stop)
+        self.client = GarminClient(
+            "runner", "secret", session=Session(), sso_url=self.server.sso_url, connect_url=self.server.connect_url
+        )
+        self.client.connect()
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.cache_dir = cache_dir.name
+        self.plan = TrainingPlan(2, 3, "30:00", "05:00", seed=1)
+
+    def sync(self, plan, **kwargs):
+        garmin_sync = GarminSync(self.client, cache_dir=self.cache_dir, page_size=4)
+        result = garmin_sync.sync(plan, **kwargs)
+        self.assertEqual(result.failed, [])
+        return len(result.kept), len(result.added), len(result.deleted), garmin_sync.requests
+
+    def fitlek_workouts(self):
+        return sorted(w["workoutName"] for w in self.server.garmin_workouts.values())
+
+    def test_should_sync_a_plan(self):
+        for i in range(8):
+            workout = {"workoutId": self.server.next_id(), "workoutName": f"Old {i}", "updateDate": f"2020-01-0{i + 1}"}
+            self.server.garmin_workouts[workout["workoutId"]] = workout
+
+        # three pages of 4 and six uploads
+        self.assertEqual(self.sync(self.plan), (0, 6, 0, 9))
+        self.assertEqual(
+            self.fitlek_workouts(), sorted([w.workout_name for w in self.plan] + [f"Old {i}" for i in range(8)])
+        )
+
+        # the listing stops at the first page with a workout older than the last sync
+        self.assertEqual(self.sync(self.plan), (6, 0, 0, 2))
+
+        # a full listing lists every page again, but still knows which workouts are in the plan
+        self.assertEqual(self.sync(self.plan, full=True), (6, 0, 0, 4))
+        self.assertEqual(len(self.server.garmin_workouts), 14)
+
+    def test_should_replace_a_changed_plan(self):
+        self.sync(self.plan)
+        changed = TrainingPlan(2, 3, "30:00", "05:00", seed=2)
+
+        self.assertEqual(self.sync(changed, dry_run=True)[:3], (0, 6, 6))
+        self.assertEqual(len(self.server.garmin_workouts), 6)
+
+        self.assertEqual(self.sync(changed)[:3], (0, 6, 6))
+        self.assertEqual(self.fitlek_workouts(), sorted(w.workout_name for w in changed))
+        self.assertEqual(self.sync(changed)[:3], (6, 0, 0))
+
+    def test_should_notice_remote_deletes_with_a_full_listing(self):
+        self.sync(self.plan)
+        deleted = next(iter(self.server.garmin_workouts))
+        self.client.delete_workout(deleted)
+
+        # an incremental listing doesn't see the delete
+        self.assertEqual(self.sync(self.plan)[:3], (6, 0, 0))
+        self.assertEqual(self.sync(self.plan, full=True)[:3], (5, 1, 0))
+        self.assertEqual(len(self.server.garmin_workouts), 6)
+
+    def test_should_ignore_an_incomplete_cache(self):
+        garmin_sync = GarminSync(self.client, cache_dir=self.cache_dir)
+        for cache in ({"workouts": {}}, {"listed_at": 0, "watermark": ""}, {"listed_at": None}, []):
+            with self.subTest(cache):
+                with open(garmin_sync._cache_path(), "w") as f:
+                    json.dump(cache, f)
+                self.assertIsNone(garmin_sync._load())
+
+        self.assertEqual(self.sync(self.plan)[:3], (0, 6, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,477 @@
+import gzip
+import json as json_lib
+import os
+import socket
+import tempfile
+import threading
+import unittest
+from base64 import b64encode
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import URLError
+
+from fitlek.thttp import (
+    DiskCache,
+    MemoryCache,
+    Retry,
+    Session,
+    download_to,
+    request,
+    stream,
+)
+
+
+def online():
+    try:
+        socket.create_connection(("httpbingo.org", 443), timeout=5).close()
+        return True
+    except OSError:
+        return False
+
+
+class LoopbackHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def respond(self):
+        self.server.requests.append((self.command, self.path, self.headers))
+        status, headers, content = self.server.respond(self)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_CONNECT = respond
+
+    def log_message(self, *args):
+        pass
+
+
+class LoopbackServer(ThreadingHTTPServer):
+    """
+    A local server that answers every request with respond(handler), which
+    returns (status, headers, content). Requests are recorded as (method, path,
+    headers).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, respond):
+        super().__init__(("127.0.0.1", 0), LoopbackHandler)
+        self.respond = respond
+        self.requests = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class ProxyTestCase(unittest.TestCase):
+    def test_should_send_http_requests_to_the_proxy(self):
+        with LoopbackServer(lambda handler: (200, {}, b"proxied")) as proxy:
+            session = Session(proxies={"http": proxy.url.replace("://", "://user:secret@")})
+            response = session.request("http://example.invalid/get", params={"a": 1})
+            session.close()
+
+        self.assertEqual(response.content, b"proxied")
+        _, path, headers = proxy.requests[0]
+        self.assertEqual(path, "http://example.invalid/get?a=1")
+        self.assertEqual(headers["Proxy-Authorization"], "Basic " + b64encode(b"user:secret").decode())
+
+    def test_should_tunnel_https_requests(self):
+        with LoopbackServer(lambda handler: (502, {}, b"")) as proxy, Session(proxies={"https": proxy.url}) as session:
+            with self.assertRaises(OSError):
+                session.request("https://example.invalid/get")
+
+        self.assertEqual(proxy.requests[0][:2], ("CONNECT", "example.invalid:443"))
+
+    def test_should_not_proxy_no_proxy_hosts(self):
+        with LoopbackServer(lambda handler: (200, {}, b"direct")) as server:
+            session = Session(proxies={"http": "http://127.0.0.1:9", "no": "127.0.0.1"})
+            response = session.request(server.url)
+            session.close()
+
+        self.assertEqual(response.content, b"direct")
+
+
+class StreamTestCase(unittest.TestCase):
+    content = bytes(range(256)) * 40
+
+    def setUp(self):
+        self.session = Session(proxies={})
+        self.addCleanup(self.session.close)
+
+    def serve(self, status=200, headers={}, content=content):
+        server = LoopbackServer(lambda handler: (status, headers, content))
+        self.addCleanup(server.__exit__)
+        return server
+
+    def test_should_stream_in_chunks(self):
+        server = self.serve()
+        with self.session.stream(server.url) as response:
+            chunks = list(response.iter_content(chunk_size=1000))
+
+        self.assertEqual(b"".join(chunks), self.content)
+        self.assertEqual([len(c) for c in chunks], [1000] * 10 + [240])
+        # the whole body was read, so the connection is reused
+        self.assertEqual(len(self.session._pools[("http", f"127.0.0.1:{server.server_port}", True, None)]), 1)
+
+    def test_should_stream_gzip(self):
+        server = self.serve(headers={"Content-Encoding": "gzip"}, content=gzip.compress(self.content))
+        with self.session.stream(server.url) as response:
+            self.assertEqual(b"".join(response.iter_content(chunk_size=16)), self.content)
+
+    def test_should_not_reuse_a_partly_read_connection(self):
+        server = self.serve()
+        with self.session.stream(server.url) as response:
+            next(response.iter_content(chunk_size=1000))
+
+        self.assertEqual(self.session._pools, {})
+        with self.assertRaises(RuntimeError):
+            next(response.iter_content())
+
+    def test_should_download_to_file(self):
+        server = self.serve(headers={"Content-Encoding": "gzip"}, content=gzip.compress(self.content))
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "download")
+            response = self.session.download_to(path, server.url, chunk_size=100)
+
+            self.assertEqual((response.status, response.content), (200, None))
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), self.content)
+            self.assertEqual(os.listdir(d), ["download"])
+
+    def test_should_not_download_error_responses(self):
+        server = self.serve(404, {"Content-Type": "application/json"}, b'{"error": "not found"}')
+        with tempfile.TemporaryDirectory() as d:
+            response = self.session.download_to(os.path.join(d, "download"), server.url)
+
+            self.assertEqual(response.status, 404)
+            self.assertEqual(response.json, {"error": "not found"})
+            self.assertEqual(os.listdir(d), [])
+
+
+class TimingsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.recorded = []
+        self.session = Session(hooks=[self.recorded.append], proxies={})
+        self.addCleanup(self.session.close)
+
+    def serve(self, respond):
+        server = LoopbackServer(respond)
+        self.addCleanup(server.__exit__)
+        return server
+
+    def test_should_record_each_request(self):
+        server = self.serve(lambda handler: (200, {}, b"x" * 100))
+        first = self.session.request(server.url, method="POST", json={"a": 1})
+        second = self.session.request(server.url)
+
+        self.assertEqual(self.recorded, [first.timings, second.timings])
+        self.assertEqual((first.timings.method, first.timings.url, first.timings.status), ("POST", server.url, 200))
+        self.assertFalse(first.timings.reused)
+        self.assertIsNotNone(first.timings.dns)
+        self.assertIsNotNone(first.timings.connect)
+        self.assertIsNone(first.timings.tls)
+        self.assertGreaterEqual(first.timings.ttfb, 0)
+        self.assertGreaterEqual(first.timings.download, 0)
+        self.assertGreater(first.timings.bytes_sent, len(b'{"a": 1}'))
+        self.assertEqual(first.timings.bytes_received, 100)
+
+        self.assertTrue(second.timings.reused)
+        self.assertIsNone(second.timings.connect)
+        self.assertGreaterEqual(first.timings.total, first.timings.ttfb)
+
+    def test_should_record_redirects_and_retries(self):
+        statuses = iter([503, 302, 200])
+        server = self.serve(lambda handler: (next(statuses), {"Location": "/next", "Retry-After": "0"}, b""))
+        response = self.session.request(server.url, retry=Retry())
+
+        self.assertEqual([t.status for t in self.recorded], [503, 302, 200])
+        self.assertEqual(self.recorded[-1], response.timings)
+        self.assertEqual(response.timings.url, f"{server.url}/next")
+
+    def test_should_record_streams_once_read(self):
+        server = self.serve(lambda handler: (200, {}, b"x" * 100))
+        with self.session.stream(server.url) as response:
+            self.assertEqual(self.recorded, [])
+            b"".join(response)
+
+        self.assertEqual(self.recorded, [response.timings])
+        self.assertEqual(response.timings.bytes_received, 100)
+
+    def test_should_not_record_without_instrumentation(self):
+        server = self.serve(lambda handler: (200, {}, b""))
+        with Session(proxies={}) as session:
+            self.assertIsNone(session.request(server.url).timings)
+
+
+class SessionCacheTestCase(unittest.TestCase):
+    """
+    Each test runs against both a MemoryCache and a DiskCache.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.version = 1
+        self.server = LoopbackServer(self.respond)
+        self.addCleanup(self.server.__exit__)
+
+    def respond(self, handler):
+        # /fresh is fresh for a minute, /private isn't stored, and anything else has to be revalidated
+        etag = f'"v{self.version}"'
+        headers = {"Content-Type": "text/plain", "X-Version": str(self.version)}
+        if handler.path == "/fresh":
+            headers["Cache-Control"] = "max-age=60"
+        elif handler.path == "/private":
+            headers["Cache-Control"] = "no-store"
+        else:
+            headers.update({"Cache-Control": "no-cache", "ETag": etag})
+            if handler.headers.get("If-None-Match") == etag:
+                return 304, {"ETag": etag, "X-Checked": "yes"}, b""
+        return 200, headers, f"{handler.path} v{self.version}".encode()
+
+    def caches(self, max_bytes=1024 * 1024):
+        return [MemoryCache(max_bytes), DiskCache(os.path.join(self.directory, "disk"), max_bytes)]
+
+    def request(self, cache, path):
+        with Session(cache=cache, proxies={}) as session:
+            return session.request(f"{self.server.url}{path}")
+
+    def test_should_serve_fresh_responses(self):
+        for cache in self.caches():
+            with self.subTest(type(cache).__name__):
+                self.server.requests.clear()
+                first = self.request(cache, "/fresh")
+                self.version += 1
+                second = self.request(cache, "/fresh")
+
+                self.assertEqual(second.content, first.content)
+                self.assertEqual(second.headers["x-version"], first.headers["x-version"])
+                self.assertEqual(len(self.server.requests), 1)
+                self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_should_revalidate_stale_responses(self):
+        for cache in self.caches():
+            with self.subTest(type(cache).__name__):
+                self.server.requests.clear()
+                first = self.request(cache, "/etag")
+                second = self.request(cache, "/etag")
+
+                self.assertEqual(self.server.requests[1][2]["If-None-Match"], f'"v{self.version}"')
+                self.assertEqual((second.status, second.content), (200, first.content))
+                self.assertEqual((cache.revalidations, cache.misses), (1, 1))
+
+                # the 304's headers are merged into the cached ones, and kept
+                for response in (second, self.request(cache, "/etag")):
+                    self.assertEqual(response.headers["x-checked"], "yes")
+                    self.assertEqual(response.headers["content-type"], "text/plain")
+
+                # a changed response replaces the cached one
+                self.version += 1
+                self.assertEqual(self.request(cache, "/etag").content, f"/etag v{self.version}".encode())
+                self.assertEqual(cache.misses, 2)
+
+    def test_should_not_store_uncacheable_responses(self):
+        for cache in self.caches():
+            with self.subTest(type(cache).__name__):
+                self.request(cache, "/private")
+                self.request(cache, "/private")
+
+                self.assertEqual(len(cache), 0)
+                self.assertEqual(cache.misses, 2)
+
+    def test_should_evict_the_least_recently_used(self):
+        for probe in self.caches():
+            with self.subTest(type(probe).__name__):
+                # room for two responses (they're all the same size) but not three
+                self.request(probe, "/a")
+                max_bytes = probe.size * 5 // 2
+                if isinstance(probe, MemoryCache):
+                    cache = MemoryCache(max_bytes)
+                else:
+                    cache = DiskCache(os.path.join(self.directory, "lru"), max_bytes)
+
+                for path in ["/a", "/b", "/a", "/c"]:
+                    self.request(cache, path)
+                self.assertEqual((len(cache), cache.evictions), (2, 1))
+                self.assertLessEqual(cache.size, cache.max_bytes)
+
+                # /b was evicted, /a and /c weren't
+                self.request(cache, "/b")
+                self.request(cache, "/c")
+                self.assertEqual((cache.misses, cache.revalidations), (4, 2))
+
+    def test_should_keep_responses_on_disk(self):
+        self.request(DiskCache(self.directory), "/fresh")
+        cache = DiskCache(self.directory)
+
+        self.assertEqual(self.request(cache, "/fresh").content, b"/fresh v1")
+        self.assertEqual((len(cache), cache.hits), (1, 1))
+
+
+@unittest.skipUnless(online(), "needs a connection to httpbingo.org")
+class RequestTestCase(unittest.TestCase):
+    def test_cannot_provide_json_and_data(self):
+        with self.assertRaises(Exception):
+            request(
+                "https://httpbingo.org/post",
+                json={"name": "Brenton"},
+                data="This is some form data",
+            )
+
+    def test_should_fail_if_json_or_data_and_not_p_method(self):
+        with self.assertRaises(Exception):
+            request("https://httpbingo.org/post", json={"name": "Brenton"})
+
+        with self.assertRaises(Exception):
+            request("https://httpbingo.org/post", json={"name": "Brenton"}, method="HEAD")
+
+    def test_should_set_content_type_for_json_request(self):
+        response = request("https://httpbingo.org/post", json={"name": "Brenton"}, method="POST")
+        self.assertEqual(response.request.headers["Content-type"], "application/json")
+
+    def test_should_work(self):
+        response = request("https://httpbingo.org/get")
+        self.assertEqual(response.status, 200)
+
+    def test_should_create_url_from_params(self):
+        response = request(
+            "https://httpbingo.org/get",
+            params={"name": "brenton", "library": "tiny-request"},
+        )
+        self.assertEqual(response.url, "https://httpbingo.org/get?name=brenton&library=tiny-request")
+
+    def test_should_return_headers(self):
+        response = request("https://httpbingo.org/response-headers", params={"Test-Header": "value"})
+        self.assertEqual(response.headers["test-header"], "value")
+
+    def test_should_populate_json(self):
+        response = request("https://httpbingo.org/json")
+        self.assertTrue("slideshow" in response.json)
+
+    def test_should_return_response_for_404(self):
+        response = request("https://httpbingo.org/404")
+        self.assertEqual(response.status, 404)
+        self.assertTrue("text/plain" in response.headers["content-type"])
+
+    def test_should_fail_with_bad_ssl(self):
+        with self.assertRaises(URLError):
+            request("https://expired.badssl.com/")
+
+    def test_should_load_bad_ssl_with_verify_false(self):
+        response = request("https://expired.badssl.com/", verify=False)
+        self.assertEqual(response.status, 200)
+
+    def test_should_form_encode_non_json_post_requests(self):
+        response = request("https://httpbingo.org/post", data={"name": "test-user"}, method="POST")
+        self.assertEqual(response.json["form"]["name"], ["test-user"])
+
+    def test_should_follow_redirect(self):
+        response = request(
+            "https://httpbingo.org/redirect-to",
+            params={"url": "https://duckduckgo.com/"},
+        )
+        self.assertEqual(response.url, "https://duckduckgo.com/")
+        self.assertEqual(response.status, 200)
+
+    def test_should_not_follow_redirect_if_redirect_false(self):
+        response = request(
+            "https://httpbingo.org/redirect-to",
+            params={"url": "https://duckduckgo.com/"},
+            redirect=False,
+        )
+        self.assertEqual(response.status, 302)
+
+    def test_cookies(self):
+        response = request(
+            "https://httpbingo.org/cookies/set",
+            params={"cookie": "test"},
+            redirect=False,
+        )
+        response = request("https://httpbingo.org/cookies", cookiejar=response.cookiejar)
+        self.assertEqual(response.json["cookie"], "test")
+
+    def test_basic_auth(self):
+        response = request("http://httpbingo.org/basic-auth/user/passwd", basic_auth=("user", "passwd"))
+        self.assertEqual(response.json["authorized"], True)
+
+    def test_should_handle_gzip(self):
+        response = request("http://httpbingo.org/gzip", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.json["gzipped"], True)
+
+    def test_should_timeout(self):
+        with self.assertRaises((TimeoutError, socket.timeout)):
+            request("http://httpbingo.org/delay/3", timeout=1)
+
+    def test_session_should_reuse_connections(self):
+        with Session() as session:
+            session.request("https://httpbingo.org/get")
+            conn = session._pools[("https", "httpbingo.org", True, None)][0]
+            session.request("https://httpbingo.org/get")
+            self.assertEqual(session._pools[("https", "httpbingo.org", True, None)], [conn])
+
+    def test_session_should_share_cookiejar(self):
+        with Session() as session:
+            session.request("https://httpbingo.org/cookies/set", params={"cookie": "test"}, redirect=False)
+            response = session.request("https://httpbingo.org/cookies")
+            self.assertEqual(response.json["cookie"], "test")
+
+    def test_session_should_record_timings(self):
+        recorded = []
+        with Session(hooks=[recorded.append]) as session:
+            response = session.request("https://httpbingo.org/gzip")
+            self.assertEqual(recorded, [response.timings])
+            self.assertIsNotNone(response.timings.tls)
+            self.assertIsNotNone(response.timings.decompress)
+            self.assertGreater(response.timings.bytes_received, 0)
+
+            response = session.request("https://httpbingo.org/get")
+            self.assertTrue(response.timings.reused)
+            self.assertIsNone(response.timings.connect)
+
+    def test_session_cache_should_serve_fresh_responses(self):
+        cache = MemoryCache()
+        with Session(cache=cache) as session:
+            first = session.request("https://httpbingo.org/cache/60")
+            second = session.request("https://httpbingo.org/cache/60")
+        self.assertEqual(second.content, first.content)
+        self.assertIsNone(second.timings)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_session_cache_should_revalidate(self):
+        with tempfile.TemporaryDirectory() as d:
+            cache = DiskCache(d)
+            with Session(cache=cache) as session:
+                first = session.request("https://httpbingo.org/etag/fitlek")
+                second = session.request("https://httpbingo.org/etag/fitlek")
+            self.assertEqual(second.status, 200)
+            self.assertEqual(second.content, first.content)
+            self.assertEqual((cache.revalidations, cache.misses), (1, 1))
+
+    def test_should_stream_gzip(self):
+        with stream("http://httpbingo.org/gzip", headers={"Accept-Encoding": "gzip"}) as response:
+            content = b"".join(response.iter_content(chunk_size=16))
+        self.assertEqual(json_lib.loads(content)["gzipped"], True)
+
+    def test_should_download_to_file(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "get.json")
+            response = download_to(path, "https://httpbingo.org/get")
+            self.assertEqual(response.status, 200)
+            with open(path) as f:
+                self.assertEqual(json_lib.load(f)["url"], "https://httpbingo.org/get")
+
+    def test_should_handle_head_requests(self):
+        response = request("http://httpbingo.org/head", method="HEAD")
+        self.assertTrue(response.content == b"")